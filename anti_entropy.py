@@ -0,0 +1,234 @@
+# Merkle tree anti-entropy repair between the replicas of a key range.
+#
+# Every bucket keeps a merkle tree of its (object key, digest) pairs, see
+# merkle.py. Two replicas compare their trees from the root down, only the
+# subtrees whose hashes differ are descended into, so replicas differing
+# in a handful of objects exchange a few hashes per tree level and the
+# keys of a few leaves instead of their whole listings. The objects found
+# to differ are then copied between the replicas.
+#
+#     service = AntiEntropyService(consistent_hashing, {"127.0.0.1:5001": HttpNode(...), ...})
+#     service.start()
+
+import itertools
+import threading
+import time
+
+from merkle import HASH_BYTES
+from rebalance import RateLimiter, RateLimitedReader, MIGRATION_RATE, MAX_REPORTED_ERRORS
+from main import ConsistentHashing, NotFoundException, ObjectAlreadyExistsException
+
+# Replicas of every object, as placed by the router
+REPLICAS = 3
+
+# Seconds between two repair rounds
+REPAIR_INTERVAL = 60.0
+
+
+def find_differing_leaves(local, remote):
+    """
+    Walks two merkle trees from the root down to the leaves whose
+    hashes differ.
+
+    :param  local: node with get_tree_root and get_tree_hashes
+    :param  remote: node with get_tree_root and get_tree_hashes
+    :return list of leaf indexes and the number of hashes fetched:
+    :raise  ValueError when the trees have different depths:
+    """
+    depth, local_root = local.get_tree_root()
+    remote_depth, remote_root = remote.get_tree_root()
+    if depth != remote_depth:
+        raise ValueError(f"Merkle trees of depth {depth} and {remote_depth} cannot be compared")
+    fetched = 2
+    differing = [0] if local_root != remote_root else []
+    for level in range(1, depth + 1):
+        if not differing:
+            break
+        children = [child for index in differing for child in (2 * index, 2 * index + 1)]
+        local_hashes = local.get_tree_hashes(level, children)
+        remote_hashes = remote.get_tree_hashes(level, children)
+        fetched += 2 * len(children)
+        differing = [child for child, local_hash, remote_hash in zip(children, local_hashes, remote_hashes)
+                     if local_hash != remote_hash]
+    return differing, fetched
+
+
+def split_object_key(object_key):
+    index = object_key.index(".")
+    return object_key[:index], object_key[index + 1:]
+
+
+def copy_object(source, target, object_key, limiter: RateLimiter, replace: bool = False):
+    """
+    Copies an object between nodes.
+
+    :param  source:
+    :param  target:
+    :param  object_key:
+    :param  limiter:
+    :param  replace: delete a different copy on the target first, only
+                     once the first chunk of the source has been read so a
+                     source which cannot be read leaves the target as it is
+    :return int, the bytes copied:
+    """
+    object_name, object_type = split_object_key(object_key)
+    meta_data, chunks = source.read(object_name, object_type)
+    chunks = iter(chunks)
+    if replace:
+        first = next(chunks, b"")
+        chunks = itertools.chain([first], chunks)
+        try:
+            target.delete(object_name, object_type)
+        except NotFoundException:
+            pass
+    reader = RateLimitedReader(chunks, limiter)
+    try:
+        target.write(object_name, object_type, reader, meta_data)
+    except ObjectAlreadyExistsException:
+        pass  # written meanwhile, the next round compares it again
+    return reader.bytes_read
+
+
+def repair(local, remote, should_hold=None, prefer_local=None, limiter: RateLimiter = None):
+    """
+    Makes two replicas hold the same objects. Objects missing on one
+    side are copied from the other, for objects with different digests
+    the copy chosen by prefer_local wins. Objects are never deleted for
+    being missing elsewhere, deletes reach all replicas through the
+    write path.
+
+    :param  local:
+    :param  remote:
+    :param  should_hold: callable(object key) telling whether both nodes
+                         are replicas of the key, None for every key
+    :param  prefer_local: callable(object key) deciding conflicts, None
+                          lets the local copy win
+    :param  limiter: shared rate limit of the copies
+    :return dict with the exchanged hashes and the repaired objects:
+    """
+    limiter = limiter or RateLimiter(MIGRATION_RATE)
+    leaves, fetched = find_differing_leaves(local, remote)
+    report = {
+        "differing_leaves": len(leaves),
+        "hash_bytes": fetched * HASH_BYTES,
+        "compared_entries": 0,
+        "copied_to_remote": 0,
+        "copied_to_local": 0,
+        "replaced": 0,
+        "copied_bytes": 0,
+        "errors": [],
+    }
+    if not leaves:
+        return report
+    local_entries = dict(local.get_leaf_entries(leaves))
+    remote_entries = dict(remote.get_leaf_entries(leaves))
+    report["compared_entries"] = len(local_entries) + len(remote_entries)
+
+    for object_key in sorted(local_entries.keys() | remote_entries.keys()):
+        if should_hold is not None and not should_hold(object_key):
+            continue
+        local_digest, remote_digest = local_entries.get(object_key), remote_entries.get(object_key)
+        if local_digest == remote_digest:
+            continue
+        try:
+            if remote_digest is None:
+                report["copied_bytes"] += copy_object(local, remote, object_key, limiter)
+                report["copied_to_remote"] += 1
+            elif local_digest is None:
+                report["copied_bytes"] += copy_object(remote, local, object_key, limiter)
+                report["copied_to_local"] += 1
+            elif prefer_local is None or prefer_local(object_key):
+                report["copied_bytes"] += copy_object(local, remote, object_key, limiter, replace=True)
+                report["replaced"] += 1
+            else:
+                report["copied_bytes"] += copy_object(remote, local, object_key, limiter, replace=True)
+                report["replaced"] += 1
+        except NotFoundException:
+            continue  # deleted since the leaves were listed
+        except Exception as e:
+            if len(report["errors"]) < MAX_REPORTED_ERRORS:
+                report["errors"].append(f"{object_key}: {e}")
+    return report
+
+
+class AntiEntropyService:
+    """
+    Periodically repairs every pair of nodes sharing replicas. Nodes
+    marked down are skipped until they are back, a node coming back
+    after a crash is repaired by the next round.
+    """
+
+    def __init__(self, consistent_hashing: ConsistentHashing, nodes: dict, replicas: int = REPLICAS,
+                 interval: float = REPAIR_INTERVAL, max_bytes_per_second: float = MIGRATION_RATE) -> None:
+        """
+        :param  consistent_hashing: the ring placing the replicas
+        :param  nodes: dict of node id to BucketNode, HttpNode or alike
+        :param  replicas:
+        :param  interval:
+        :param  max_bytes_per_second: shared by all copies of a round
+        """
+        self.__consistent_hashing = consistent_hashing
+        self.__nodes = nodes
+        self.__replicas = replicas
+        self.__interval = interval
+        self.__limiter = RateLimiter(max_bytes_per_second)
+        self.__stopped = threading.Event()
+        self.__thread = None
+        self.__lock = threading.Lock()
+        self.__last_round = None
+        self.__rounds = 0
+
+    def get_replica_ids(self, object_key):
+        get_node_id = ConsistentHashing.Ring.get_node_id
+        return [get_node_id(node) for node in
+                self.__consistent_hashing.get_request_replicas(object_key, self.__replicas)]
+
+    def run_once(self):
+        """
+        Runs one repair round over all pairs of live nodes.
+
+        :return dict of "a|b" to the repair report of the pair:
+        """
+        get_node_id = ConsistentHashing.Ring.get_node_id
+        live = sorted(get_node_id(node) for node in self.__consistent_hashing.get_ring().get_nodes()
+                      if not getattr(node, "is_down", False) and get_node_id(node) in self.__nodes)
+        reports = {}
+        for position, local_id in enumerate(live):
+            for remote_id in live[position + 1:]:
+                if self.__stopped.is_set():
+                    break
+
+                def should_hold(object_key, pair=(local_id, remote_id)):
+                    replicas = self.get_replica_ids(object_key)
+                    return pair[0] in replicas and pair[1] in replicas
+
+                def prefer_local(object_key, pair=(local_id, remote_id)):
+                    # the replica placed first on the ring holds the reference copy
+                    replicas = self.get_replica_ids(object_key)
+                    return replicas.index(pair[0]) < replicas.index(pair[1])
+
+                try:
+                    reports[f"{local_id}|{remote_id}"] = repair(self.__nodes[local_id], self.__nodes[remote_id],
+                                                                should_hold, prefer_local, self.__limiter)
+                except Exception as e:
+                    reports[f"{local_id}|{remote_id}"] = {"errors": [str(e)]}
+        with self.__lock:
+            self.__rounds += 1
+            self.__last_round = {"finished_at": time.time(), "pairs": reports}
+        return reports
+
+    def _run(self):
+        while not self.__stopped.wait(self.__interval):
+            self.run_once()
+
+    def start(self):
+        if self.__thread is None:
+            self.__thread = threading.Thread(target=self._run, name="anti-entropy", daemon=True)
+            self.__thread.start()
+
+    def stop(self):
+        self.__stopped.set()
+
+    def get_stats(self):
+        with self.__lock:
+            return {"rounds": self.__rounds, "last_round": self.__last_round}
@@ -0,0 +1,793 @@
+# Native async entry point for DataDepot.
+# Serves the same endpoints as the Flask app in main.py but runs every
+# request on one long-lived event loop, streaming request and response
+# bodies through the async methods of Bucket.
+#
+# Run with any ASGI server, e.g.
+#     uvicorn asgi:app --host 0.0.0.0 --port 5000
+
+import os
+import json
+import uuid
+import time
+import asyncio
+import functools
+import urllib.parse
+
+import aiofiles
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import MultipartDecoder, File, Data, Epilogue, NEED_DATA
+
+from main import (bucket, bucket_name, Object, NotFoundException, ObjectAlreadyExistsException,
+                  InvalidObjectNameException, UploadNotFoundException, InvalidPartException, ChecksumMismatchException,
+                  DOWNLOAD_CHUNK_SIZE, MAX_LIST_LIMIT, parse_byte_ranges, plan_multipart_byteranges,
+                  get_user_meta_data, add_geo_meta_data, parse_location, parse_query_filter, parse_merkle_nodes,
+                  parse_merkle_leaves, split_object_name, get_bucket_metrics, tracer)
+from object_index import LAYOUT_FILE
+from compression import CONTENT_ENCODINGS, accepts_encoding
+from metrics import REGISTRY, CONTENT_TYPE, HTTP_REQUESTS_IN_FLIGHT, record_request
+from tracing import span
+from profiler import sample_stacks, format_collapsed, ProfilerBusyException, PROFILE_INTERVAL
+
+
+class ClientDisconnectedException(Exception):
+    """Exception raised when the client goes away mid request."""
+
+
+async def iter_request_body(receive):
+    """
+    Yields the request body as it arrives from the ASGI server.
+
+    :param  receive:
+    :return async generator of bytes:
+    :raise  ClientDisconnectedException:
+    """
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise ClientDisconnectedException()
+        body = message.get("body", b"")
+        if body:
+            yield body
+        if not message.get("more_body", False):
+            break
+
+
+async def iter_multipart_file(body, boundary: bytes, field_name: str):
+    """
+    Incrementally decodes a multipart/form-data body and yields only
+    the contents of the file part named field_name, nothing is buffered
+    beyond the chunk currently being parsed.
+
+    :param  body:
+    :param  boundary:
+    :param  field_name:
+    :return async generator of bytes:
+    """
+    decoder = MultipartDecoder(boundary)
+    in_field = False
+    done = False
+    body_iter = body.__aiter__()
+    while not done:
+        event = decoder.next_event()
+        if event is NEED_DATA:
+            try:
+                decoder.receive_data(await body_iter.__anext__())
+            except StopAsyncIteration:
+                decoder.receive_data(None)
+        elif isinstance(event, File):
+            in_field = event.name == field_name
+        elif isinstance(event, Data):
+            if in_field and event.data:
+                yield event.data
+            if not event.more_data:
+                in_field = False
+        elif isinstance(event, Epilogue):
+            done = True
+
+
+async def send_json(send, status: int, payload: dict):
+    """
+    Sends a complete json response.
+
+    :param  send:
+    :param  status:
+    :param  payload:
+    :return None:
+    """
+    body = json.dumps(payload).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def read_json_body(receive):
+    """
+    Reads a small json request body, an empty or invalid body reads
+    as an empty dict like Flask's get_json(silent=True).
+
+    :param  receive:
+    :return dict:
+    """
+    body = b"".join([chunk async for chunk in iter_request_body(receive)])
+    try:
+        payload = json.loads(body) if body else {}
+    except ValueError:
+        return {}
+    return payload if isinstance(payload, dict) else {}
+
+
+def get_query_args(scope):
+    """
+    :param  scope:
+    :return list of (name, value) query parameters, names may repeat:
+    """
+    return urllib.parse.parse_qsl(scope.get("query_string", b"").decode("latin-1"))
+
+
+async def send_object_range(send, record, start: int, end: int, stored: bool = False, data: bytes = None):
+    """
+    Streams [start, end) of an object as response body chunks. Cached
+    objects are sliced from memory, plain data files are read with
+    aiofiles, other layouts and compressed objects are assembled by
+    Bucket.iter_object_data on the default executor.
+
+    :param  send:
+    :param  record:
+    :param  start:
+    :param  end:
+    :param  stored: send the stored bytes, compressed objects stay compressed
+    :param  data: the object data when it is cached
+    :return None:
+    """
+    if data is not None and not stored:
+        await send({"type": "http.response.body", "body": data[start:end], "more_body": True})
+        return
+    is_compressed = record["meta_data"].get("compression") is not None
+    if record["layout"] != LAYOUT_FILE or (is_compressed and not stored):
+        loop = asyncio.get_running_loop()
+        if stored:
+            chunks = bucket.iter_stored_data(record, start, end)
+        else:
+            chunks = bucket.iter_object_data(record, start, end)
+        while True:
+            chunk = await loop.run_in_executor(None, next, chunks, None)
+            if chunk is None:
+                break
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        return
+
+    async with aiofiles.open(record["data_path"], "rb") as data_file:
+        await data_file.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            chunk = await data_file.read(min(DOWNLOAD_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+
+
+async def upload_object(scope, receive, send, object_name):
+    """
+    Takes in a file and name and uploads to the storage bucket,
+    the body may either be multipart form-data with the key object_data
+    or the raw object bytes.
+
+    :param  scope:
+    :param  receive:
+    :param  send:
+    :param  object_name:
+    :return None:
+    """
+    headers = dict(scope["headers"])
+    mimetype, options = parse_options_header(headers.get(b"content-type", b"").decode("latin-1"))
+    body = iter_request_body(receive)
+    if mimetype == "multipart/form-data":
+        object_data = iter_multipart_file(body, options.get("boundary", "").encode(), "object_data")
+    else:
+        object_data = body
+
+    _object_name, object_type = split_object_name(object_name)
+    try:
+        object_meta_data = get_user_meta_data((name.decode("latin-1"), value.decode("latin-1"))
+                                              for name, value in scope["headers"])
+        object_meta_data.update({"type": object_type,
+                                 "content_type": None if mimetype == "multipart/form-data" else mimetype})
+        add_geo_meta_data(object_meta_data)
+    except ValueError as e:
+        await send_json(send, 400, {"error": str(e)})
+        return
+
+    try:
+        with span("create_object"):
+            obj = Object(_object_name, bucket_name, object_type, object_data, object_meta_data)
+        with span("bucket_upload"):
+            meta_data = await bucket.upload_object(obj)
+    except ObjectAlreadyExistsException as e:
+        await send_json(send, 409, {"error": str(e)})
+        return
+
+    await send_json(send, 200, {"message": "Object uploaded successfully",
+                                "size": meta_data["size"],
+                                "sha256": meta_data["sha256"]})
+
+
+async def download_object(scope, receive, send, object_name, object_t, object_type):
+    """
+    End Point for downloading the object from the bucket, supports
+    single and multi part byte ranges and the ASGI pathsend extension.
+
+    :param  scope:
+    :param  receive:
+    :param  send:
+    :param  object_name:
+    :param  object_t:
+    :param  object_type:
+    :return None:
+    """
+    try:
+        with span("lookup"):
+            record, data = bucket.get_cached_object(object_name, object_type)
+    except NotFoundException as e:
+        await send_json(send, 404, {"error": str(e)})
+        return
+
+    headers = dict(scope["headers"])
+    meta_data = record["meta_data"]
+    size = record["size"]
+    mimetype = f"{object_t}/{meta_data['type']}"
+    content_encoding = CONTENT_ENCODINGS.get(meta_data.get("compression"))
+    passthrough = accepts_encoding(headers.get(b"accept-encoding", b"").decode("latin-1"), content_encoding)
+    etag = meta_data.get("sha256", meta_data["uuid"])
+    etag = f'"{etag}-{content_encoding}"' if passthrough else f'"{etag}"'
+    base_headers = [(b"accept-ranges", b"bytes"),
+                    (b"etag", etag.encode()),
+                    (b"x-metadata", json.dumps(meta_data).encode())]
+    if "compression" in meta_data:
+        base_headers.append((b"vary", b"Accept-Encoding"))
+
+    if headers.get(b"if-none-match", b"").decode("latin-1") == etag:
+        await send({"type": "http.response.start", "status": 304, "headers": base_headers})
+        await send({"type": "http.response.body", "body": b""})
+        return
+
+    if passthrough:
+        # the stored bytes already are the encoded representation, sent whole
+        stored_size = meta_data["compressed_size"]
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": base_headers + [(b"content-type", mimetype.encode()),
+                                               (b"content-encoding", content_encoding.encode()),
+                                               (b"content-length", str(stored_size).encode())]})
+        await send_object_range(send, record, 0, stored_size, stored=True)
+        await send({"type": "http.response.body", "body": b""})
+        return
+
+    if data is None and bucket.get_cache() is not None:
+        with span("load_cached_object", size=size):
+            data = await asyncio.to_thread(bucket.load_cached_object, record)
+
+    ranges = parse_byte_ranges(headers.get(b"range", b"").decode("latin-1"), size)
+    if ranges is not None and b"if-range" in headers and headers[b"if-range"].decode("latin-1") != etag:
+        # the copy of the client is stale, it gets the full object, no
+        # Last-Modified is sent so a date never matches either
+        ranges = None
+    if ranges is not None and not ranges:
+        await send({"type": "http.response.start", "status": 416,
+                    "headers": base_headers + [(b"content-range", f"bytes */{size}".encode()),
+                                               (b"content-length", b"0")]})
+        await send({"type": "http.response.body", "body": b""})
+        return
+
+    if ranges is not None and len(ranges) > 1:
+        boundary = uuid.uuid4().hex
+        parts, closing, length = plan_multipart_byteranges(ranges, size, mimetype, boundary)
+        await send({"type": "http.response.start", "status": 206,
+                    "headers": base_headers + [
+                        (b"content-type", f"multipart/byteranges; boundary={boundary}".encode()),
+                        (b"content-length", str(length).encode())]})
+        for header, start, end in parts:
+            await send({"type": "http.response.body", "body": header, "more_body": True})
+            await send_object_range(send, record, start, end, data=data)
+            await send({"type": "http.response.body", "body": b"\r\n", "more_body": True})
+        await send({"type": "http.response.body", "body": closing})
+        return
+
+    if ranges is not None:
+        start, end = ranges[0]
+        await send({"type": "http.response.start", "status": 206,
+                    "headers": base_headers + [
+                        (b"content-type", mimetype.encode()),
+                        (b"content-range", f"bytes {start}-{end - 1}/{size}".encode()),
+                        (b"content-length", str(end - start).encode())]})
+        await send_object_range(send, record, start, end, data=data)
+        await send({"type": "http.response.body", "body": b""})
+        return
+
+    await send({"type": "http.response.start", "status": 200,
+                "headers": base_headers + [(b"content-type", mimetype.encode()),
+                                           (b"content-length", str(size).encode())]})
+    if (data is None and record["layout"] == LAYOUT_FILE and "compression" not in meta_data
+            and "http.response.pathsend" in scope.get("extensions", {})):
+        # let the server hand the file to the kernel directly
+        await send({"type": "http.response.pathsend", "path": os.path.abspath(record["data_path"])})
+        return
+    await send_object_range(send, record, 0, size, data=data)
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def delete_object(scope, receive, send, object_name):
+    """
+    Deletes an object from the storage bucket.
+
+    :param  scope:
+    :param  receive:
+    :param  send:
+    :param  object_name: 'name.type'
+    :return None:
+    """
+    try:
+        await asyncio.to_thread(bucket.delete_object, *split_object_name(object_name))
+    except NotFoundException as e:
+        await send_json(send, 404, {"error": str(e)})
+        return
+    await send_json(send, 200, {"message": "Object deleted successfully"})
+
+
+async def list_objects(scope, receive, send):
+    """
+    Lists the objects of the bucket in lexicographic order.
+
+    :param  scope: query parameters prefix, start_after, limit, continuation_token
+    :param  receive:
+    :param  send:
+    :return None:
+    """
+    args = dict(get_query_args(scope))
+    try:
+        result = await asyncio.to_thread(bucket.list_objects, prefix=args.get("prefix", ""),
+                                         start_after=args.get("start_after", ""),
+                                         limit=args.get("limit", MAX_LIST_LIMIT),
+                                         continuation_token=args.get("continuation_token"))
+    except ValueError as e:
+        await send_json(send, 400, {"error": str(e)})
+        return
+    await send_json(send, 200, result)
+
+
+async def query_objects(scope, receive, send):
+    """
+    Finds objects by metadata.
+
+    :param  scope: query parameters filter (repeatable), limit, continuation_token
+    :param  receive:
+    :param  send:
+    :return None:
+    """
+    query_args = get_query_args(scope)
+    args = dict(query_args)
+    try:
+        filters = [parse_query_filter(value) for name, value in query_args if name == "filter"]
+        result = await asyncio.to_thread(bucket.query_objects, filters, limit=args.get("limit", MAX_LIST_LIMIT),
+                                         continuation_token=args.get("continuation_token"))
+    except ValueError as e:
+        await send_json(send, 400, {"error": str(e)})
+        return
+    await send_json(send, 200, result)
+
+
+async def create_multipart_upload(scope, receive, send, object_name):
+    """
+    Starts a multipart upload for the object.
+
+    :param  scope:
+    :param  receive:
+    :param  send:
+    :param  object_name: 'name.type'
+    :return None:
+    """
+    _object_name, object_type = split_object_name(object_name)
+    try:
+        upload_id = await asyncio.to_thread(bucket.create_multipart_upload, _object_name, object_type,
+                                            {"type": object_type})
+    except ObjectAlreadyExistsException as e:
+        await send_json(send, 409, {"error": str(e)})
+        return
+    await send_json(send, 200, {"upload_id": upload_id})
+
+
+async def upload_part(scope, receive, send, object_name, upload_id, part_number: int):
+    """
+    Streams one part of a multipart upload, the raw request body is the
+    part data, verified against the optional X-Checksum-Sha256 and
+    Content-MD5 headers.
+
+    :param  scope:
+    :param  receive:
+    :param  send:
+    :param  object_name: 'name.type'
+    :param  upload_id:
+    :param  part_number:
+    :return None:
+    """
+    headers = dict(scope["headers"])
+    expected_sha256 = headers.get(b"x-checksum-sha256")
+    expected_md5 = headers.get(b"content-md5")
+    _object_name, object_type = split_object_name(object_name)
+    try:
+        part = await bucket.upload_part(upload_id, _object_name, object_type, part_number,
+                                        iter_request_body(receive),
+                                        expected_sha256=expected_sha256.decode("latin-1") if expected_sha256 else None,
+                                        expected_md5=expected_md5.decode("latin-1") if expected_md5 else None)
+    except UploadNotFoundException as e:
+        await send_json(send, 404, {"error": str(e)})
+        return
+    except (InvalidPartException, ChecksumMismatchException) as e:
+        await send_json(send, 400, {"error": str(e)})
+        return
+    await send_json(send, 200, part)
+
+
+async def list_parts(scope, receive, send, object_name, upload_id):
+    """
+    Lists the parts uploaded so far.
+
+    :param  scope:
+    :param  receive:
+    :param  send:
+    :param  object_name: 'name.type'
+    :param  upload_id:
+    :return None:
+    """
+    _object_name, object_type = split_object_name(object_name)
+    try:
+        parts = await asyncio.to_thread(bucket.list_parts, upload_id, _object_name, object_type)
+    except UploadNotFoundException as e:
+        await send_json(send, 404, {"error": str(e)})
+        return
+    await send_json(send, 200, {"upload_id": upload_id, "parts": parts})
+
+
+async def complete_multipart_upload(scope, receive, send, object_name, upload_id):
+    """
+    Completes a multipart upload, the optional json body
+    {"parts": [{"part_number": 1, "etag": "..."}, ...]} selects and
+    verifies the parts.
+
+    :param  scope:
+    :param  receive:
+    :param  send:
+    :param  object_name: 'name.type'
+    :param  upload_id:
+    :return None:
+    """
+    body = await read_json_body(receive)
+    _object_name, object_type = split_object_name(object_name)
+    try:
+        meta_data = await bucket.complete_multipart_upload(upload_id, _object_name, object_type, body.get("parts"))
+    except UploadNotFoundException as e:
+        await send_json(send, 404, {"error": str(e)})
+        return
+    except InvalidPartException as e:
+        await send_json(send, 400, {"error": str(e)})
+        return
+    except ObjectAlreadyExistsException as e:
+        await send_json(send, 409, {"error": str(e)})
+        return
+    await send_json(send, 200, {"message": "Object uploaded successfully",
+                                "size": meta_data["size"],
+                                "sha256": meta_data["sha256"]})
+
+
+async def abort_multipart_upload(scope, receive, send, object_name, upload_id):
+    """
+    Aborts a multipart upload and removes its parts.
+
+    :param  scope:
+    :param  receive:
+    :param  send:
+    :param  object_name: 'name.type'
+    :param  upload_id:
+    :return None:
+    """
+    _object_name, object_type = split_object_name(object_name)
+    try:
+        await asyncio.to_thread(bucket.abort_multipart_upload, upload_id, _object_name, object_type)
+    except UploadNotFoundException as e:
+        await send_json(send, 404, {"error": str(e)})
+        return
+    await send_json(send, 200, {"message": "Upload aborted"})
+
+
+async def get_merkle_root(scope, receive, send):
+    """
+    Depth and root hash of the merkle tree of the bucket.
+
+    :param  scope:
+    :param  receive:
+    :param  send:
+    :return None:
+    """
+    tree = await asyncio.to_thread(bucket.get_merkle_tree)
+    await send_json(send, 200, {"depth": tree.get_depth(), "root": tree.get_root()})
+
+
+async def get_merkle_hashes(scope, receive, send):
+    """
+    Hashes of merkle tree nodes, json body {"level": 3, "indexes": [0, 5]}.
+
+    :param  scope:
+    :param  receive:
+    :param  send:
+    :return None:
+    """
+    body = await read_json_body(receive)
+    tree = await asyncio.to_thread(bucket.get_merkle_tree)
+    try:
+        level, indexes = parse_merkle_nodes(body, tree.get_depth())
+    except ValueError as e:
+        await send_json(send, 400, {"error": str(e)})
+        return
+    await send_json(send, 200, {"hashes": tree.get_hashes(level, indexes)})
+
+
+async def get_merkle_leaves(scope, receive, send):
+    """
+    Object keys and digests of merkle tree leaves, json body {"leaves": [7, 9]}.
+
+    :param  scope:
+    :param  receive:
+    :param  send:
+    :return None:
+    """
+    body = await read_json_body(receive)
+    tree = await asyncio.to_thread(bucket.get_merkle_tree)
+    try:
+        leaves = parse_merkle_leaves(body, tree.get_depth())
+    except ValueError as e:
+        await send_json(send, 400, {"error": str(e)})
+        return
+    await send_json(send, 200, {"entries": await asyncio.to_thread(bucket.get_leaf_entries, leaves)})
+
+
+async def query_near(scope, receive, send):
+    """
+    Finds geo-tagged objects by distance, nearest first.
+
+    :param  scope: query parameters lat, lon, radius, limit, continuation_token
+    :param  receive:
+    :param  send:
+    :return None:
+    """
+    args = dict(get_query_args(scope))
+    try:
+        result = await asyncio.to_thread(bucket.query_near, *parse_location(args),
+                                         limit=args.get("limit", MAX_LIST_LIMIT),
+                                         continuation_token=args.get("continuation_token"))
+    except ValueError as e:
+        await send_json(send, 400, {"error": str(e)})
+        return
+    await send_json(send, 200, result)
+
+
+async def send_metrics(send):
+    """
+    Sends the metrics of the process in the Prometheus text format,
+    collectors may query the object index so they run off the loop.
+
+    :param  send:
+    :return None:
+    """
+    body = (await asyncio.to_thread(REGISTRY.render, [functools.partial(get_bucket_metrics, bucket)])).encode()
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", CONTENT_TYPE.encode()),
+                    (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def send_profile(scope, send):
+    """
+    Samples the stacks of the worker for a while, from a separate thread
+    so the event loop keeps serving and shows up in the profile, and
+    sends them in the collapsed format of flame graph tools.
+
+    :param  scope: query parameters seconds, interval, idle
+    :param  send:
+    :return None:
+    """
+    args = dict(get_query_args(scope))
+    try:
+        stacks, rounds = await asyncio.to_thread(sample_stacks, float(args.get("seconds", 10)),
+                                                 float(args.get("interval", PROFILE_INTERVAL)),
+                                                 include_idle=args.get("idle") == "1")
+    except ValueError as e:
+        await send_json(send, 400, {"error": str(e)})
+        return
+    except ProfilerBusyException as e:
+        await send_json(send, 409, {"error": str(e)})
+        return
+    body = format_collapsed(stacks).encode()
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", b"text/plain; charset=utf-8"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"x-profile-samples", str(rounds).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def lifespan(scope, receive, send):
+    """
+    Handles the ASGI lifespan protocol. The bucket was already created
+    and recovered when main was imported, there is nothing left to do
+    on startup.
+
+    :param  scope:
+    :param  receive:
+    :param  send:
+    :return None:
+    """
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    """
+    ASGI application routing the DataDepot endpoints.
+
+    :param  scope:
+    :param  receive:
+    :param  send:
+    :return None:
+    """
+    if scope["type"] == "lifespan":
+        await lifespan(scope, receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    method = scope["method"]
+    parts = scope["path"].strip("/").split("/")
+    endpoint = get_endpoint(method, parts)
+    started = time.perf_counter()
+    request_bytes, response = 0, {"status": 500, "length": 0, "bytes": 0}
+
+    async def counting_receive():
+        nonlocal request_bytes
+        message = await receive()
+        request_bytes += len(message.get("body", b""))
+        return message
+
+    async def counting_send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["length"] = int(dict(message.get("headers", ())).get(b"content-length", 0))
+        elif message["type"] == "http.response.body":
+            response["bytes"] += len(message.get("body", b""))
+        elif message["type"] == "http.response.pathsend":
+            response["bytes"] += response["length"]
+        await send(message)
+
+    HTTP_REQUESTS_IN_FLIGHT.inc((endpoint,))
+    try:
+        await handle_request(scope, counting_receive, counting_send, endpoint, parts)
+    finally:
+        HTTP_REQUESTS_IN_FLIGHT.dec((endpoint,))
+        record_request(endpoint, method, response["status"], time.perf_counter() - started, request_bytes,
+                       response["bytes"])
+
+
+def get_endpoint(method, parts):
+    """
+    Routes a request to the name of its endpoint, the same names the
+    views of the Flask app have.
+
+    :param  method:
+    :param  parts: segments of the path
+    :return str, 'unknown' for unrouted requests:
+    """
+    if method == "POST" and len(parts) == 2 and parts[0] == "upload":
+        return "upload_object"
+    if method == "GET" and len(parts) == 4 and parts[0] == "download":
+        return "download_object"
+    if method == "DELETE" and len(parts) == 2 and parts[0] == "delete":
+        return "delete_object"
+    if method == "GET" and parts == ["list"]:
+        return "list_objects"
+    if method == "GET" and parts == ["query"]:
+        return "query_objects"
+    if method == "GET" and parts == ["near"]:
+        return "query_near"
+    if parts[0] == "multipart":
+        if method == "POST" and len(parts) == 2:
+            return "create_multipart_upload"
+        if method == "PUT" and len(parts) == 4 and parts[3].isdigit():
+            return "upload_part"
+        if method == "GET" and len(parts) == 3:
+            return "list_parts"
+        if method == "POST" and len(parts) == 4 and parts[3] == "complete":
+            return "complete_multipart_upload"
+        if method == "DELETE" and len(parts) == 3:
+            return "abort_multipart_upload"
+    if method == "GET" and parts == ["merkle"]:
+        return "get_merkle_root"
+    if method == "POST" and parts == ["merkle", "hashes"]:
+        return "get_merkle_hashes"
+    if method == "POST" and parts == ["merkle", "leaves"]:
+        return "get_merkle_leaves"
+    if method == "GET" and parts == ["stats"]:
+        return "storage_stats"
+    if method == "GET" and parts == ["metrics"]:
+        return "get_metrics"
+    if method == "GET" and parts == ["admin", "profile"]:
+        return "get_profile"
+    return "unknown"
+
+
+async def handle_request(scope, receive, send, endpoint, parts):
+    """
+    Runs the endpoint of a request.
+
+    :param  scope:
+    :param  receive:
+    :param  send:
+    :param  endpoint: as returned by get_endpoint
+    :param  parts: segments of the path
+    :return None:
+    """
+    try:
+        if endpoint == "upload_object":
+            with tracer.trace("POST /upload", object_name=parts[1]):
+                await upload_object(scope, receive, send, parts[1])
+        elif endpoint == "download_object":
+            with tracer.trace("GET /download", object_name=parts[1], object_type=parts[3]):
+                await download_object(scope, receive, send, parts[1], parts[2], parts[3])
+        elif endpoint == "delete_object":
+            await delete_object(scope, receive, send, parts[1])
+        elif endpoint == "list_objects":
+            await list_objects(scope, receive, send)
+        elif endpoint == "query_objects":
+            await query_objects(scope, receive, send)
+        elif endpoint == "query_near":
+            await query_near(scope, receive, send)
+        elif endpoint == "create_multipart_upload":
+            await create_multipart_upload(scope, receive, send, parts[1])
+        elif endpoint == "upload_part":
+            await upload_part(scope, receive, send, parts[1], parts[2], int(parts[3]))
+        elif endpoint == "list_parts":
+            await list_parts(scope, receive, send, parts[1], parts[2])
+        elif endpoint == "complete_multipart_upload":
+            await complete_multipart_upload(scope, receive, send, parts[1], parts[2])
+        elif endpoint == "abort_multipart_upload":
+            await abort_multipart_upload(scope, receive, send, parts[1], parts[2])
+        elif endpoint == "get_merkle_root":
+            await get_merkle_root(scope, receive, send)
+        elif endpoint == "get_merkle_hashes":
+            await get_merkle_hashes(scope, receive, send)
+        elif endpoint == "get_merkle_leaves":
+            await get_merkle_leaves(scope, receive, send)
+        elif endpoint == "storage_stats":
+            await send_json(send, 200, await asyncio.to_thread(bucket.get_storage_stats))
+        elif endpoint == "get_metrics":
+            await send_metrics(send)
+        elif endpoint == "get_profile":
+            await send_profile(scope, send)
+        else:
+            await send_json(send, 404, {"error": "Not found"})
+    except InvalidObjectNameException as e:
+        await send_json(send, 400, {"error": str(e)})
+    except ClientDisconnectedException:
+        bucket.logger.log(f"Client disconnected during {scope['method']} {scope['path']}")
@@ -0,0 +1,199 @@
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# Compares the Flask (WSGI) app in main.py against the ASGI entry point in
+# asgi.py. Both servers are started as local subprocesses in a scratch
+# directory and driven by the same keep-alive client threads.
+#
+#     python benchmarks/asgi_vs_flask.py --concurrency 32 --duration 10
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVERS = {
+    "flask": ["-c", "import sys, main; main.app.run(host='127.0.0.1', port=int(sys.argv[1]), threaded=True)"],
+    "asgi": ["-m", "uvicorn", "asgi:app", "--host", "127.0.0.1", "--log-level", "warning", "--port"],
+}
+
+
+def free_port():
+    """
+    Asks the kernel for an unused local port.
+
+    :return int:
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout: float = 15.0):
+    """
+    Blocks until something accepts connections on the port.
+
+    :param  port:
+    :param  timeout:
+    :return None:
+    :raise  TimeoutError:
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise TimeoutError(f"server on port {port} did not start")
+
+
+def start_server(kind, port, work_dir):
+    """
+    Starts one of the servers in the work directory.
+
+    :param  kind:
+    :param  port:
+    :param  work_dir:
+    :return subprocess.Popen:
+    """
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    process = subprocess.Popen([sys.executable] + SERVERS[kind] + [str(port)], cwd=work_dir, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for_port(port)
+    return process
+
+
+def percentile(sorted_values, fraction: float):
+    """
+    Nearest rank percentile of already sorted values.
+
+    :param  sorted_values:
+    :param  fraction:
+    :return float:
+    """
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_load(port, concurrency: int, duration: float, make_request):
+    """
+    Runs make_request from concurrency client threads, each holding one
+    keep-alive connection, for duration seconds.
+
+    :param  port:
+    :param  concurrency:
+    :param  duration:
+    :param  make_request: callable(connection, worker, sequence) -> status
+    :return dict with requests/sec and latency percentiles in milliseconds:
+    """
+    latencies = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+    deadline = time.monotonic() + duration
+
+    def worker(worker_id):
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        sequence = 0
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                status = make_request(connection, worker_id, sequence)
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+                status = 0
+            latencies[worker_id].append(time.perf_counter() - started)
+            if status >= 400 or status == 0:
+                errors[worker_id] += 1
+            sequence += 1
+        connection.close()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    samples = sorted(value for worker_latencies in latencies for value in worker_latencies)
+    return {
+        "requests": len(samples),
+        "errors": sum(errors),
+        "requests_per_sec": len(samples) / elapsed,
+        "p50_ms": percentile(samples, 0.50) * 1000,
+        "p99_ms": percentile(samples, 0.99) * 1000,
+    }
+
+
+def benchmark_server(kind, object_size: int, concurrency: int, duration: float):
+    """
+    Measures download and upload throughput of one server kind.
+
+    :param  kind:
+    :param  object_size:
+    :param  concurrency:
+    :param  duration:
+    :return dict of results per workload:
+    """
+    payload = os.urandom(object_size)
+    port = free_port()
+    with tempfile.TemporaryDirectory() as work_dir:
+        process = start_server(kind, port, work_dir)
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port)
+            connection.request("POST", "/upload/bench.bin", body=payload,
+                               headers={"Content-Type": "application/octet-stream"})
+            connection.getresponse().read()
+            connection.close()
+
+            def download(conn, worker_id, sequence):
+                conn.request("GET", "/download/bench/application/bin")
+                response = conn.getresponse()
+                response.read()
+                return response.status
+
+            def upload(conn, worker_id, sequence):
+                conn.request("POST", f"/upload/{kind}-{worker_id}-{sequence}.bin", body=payload,
+                             headers={"Content-Type": "application/octet-stream"})
+                response = conn.getresponse()
+                response.read()
+                return response.status
+
+            return {
+                "download": run_load(port, concurrency, duration, download),
+                "upload": run_load(port, concurrency, duration, upload),
+            }
+        finally:
+            process.terminate()
+            process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Flask vs ASGI throughput and tail latency")
+    parser.add_argument("--object-size", type=int, default=64 * 1024)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--servers", nargs="+", default=list(SERVERS), choices=list(SERVERS))
+    args = parser.parse_args()
+
+    results = {
+        "object_size": args.object_size,
+        "concurrency": args.concurrency,
+        "duration": args.duration,
+        "servers": {kind: benchmark_server(kind, args.object_size, args.concurrency, args.duration)
+                    for kind in args.servers},
+    }
+    json.dump(results, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,475 @@
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from asgi_vs_flask import ROOT, SERVERS, benchmark_server
+
+# Offline benchmarks of the hot paths: bucket uploads and downloads, the
+# HTTP servers under concurrent clients, the consistent hashing ring, the
+# LRU cache and geohash encoding. Everything runs locally in a scratch
+# directory, inputs come from a seeded generator so runs are comparable.
+#
+#     python benchmarks/suite.py run --output base.json
+#     python benchmarks/suite.py run --output head.json
+#     python benchmarks/suite.py compare base.json head.json --threshold 0.1
+#
+# compare exits with status 1 when a result got worse by more than the
+# threshold, so it can gate a CI job.
+
+SUITES = ("store", "server", "ring", "cache", "geohash")
+
+# Object sizes of the store suite, 256MB and 1GB are opt-in with --sizes
+DEFAULT_SIZES = ("1KB", "64KB", "1MB", "16MB")
+SIZE_UNITS = {"B": 1, "KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3}
+
+# Bytes uploaded per size and round, capped to MAX_STORE_OBJECTS objects
+STORE_ROUND_BYTES = 64 * 1024 * 1024
+MAX_STORE_OBJECTS = 1000
+
+# Upload bodies repeat one random block of this size
+PAYLOAD_BLOCK_SIZE = 1024 * 1024
+
+RING_NODE_COUNTS = (8, 64, 512)
+RING_LOOKUPS = 100_000
+
+CACHE_ENTRIES = 10_000
+CACHE_OPERATIONS = 200_000
+
+GEOHASH_POINTS = 100_000
+GEOHASH_BATCH_POINTS = 1_000_000
+
+SERVER_OBJECT_SIZE = 4 * 1024
+SERVER_CONCURRENCY = (1, 16)
+SERVER_DURATION = 3.0
+
+# A result is flagged when it is more than this fraction worse than the baseline
+DEFAULT_THRESHOLD = 0.10
+
+# --quick divides the amount of work by this factor, for smoke tests
+QUICK_FACTOR = 10
+
+
+def parse_size(text):
+    """
+    :param  text: e.g. '64KB' or '1GB'
+    :return int bytes:
+    :raise  ValueError:
+    """
+    text = text.strip().upper()
+    for unit in sorted(SIZE_UNITS, key=len, reverse=True):
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)]) * SIZE_UNITS[unit])
+    return int(text)
+
+
+def format_size(size: int):
+    for unit in ("GB", "MB", "KB"):
+        if size >= SIZE_UNITS[unit] and size % SIZE_UNITS[unit] == 0:
+            return f"{size // SIZE_UNITS[unit]}{unit}"
+    return f"{size}B"
+
+
+def measure(function, repeat: int):
+    """
+    Runs function repeat times.
+
+    :param  function: callable without arguments
+    :param  repeat:
+    :return median seconds of one run:
+    """
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - started)
+    return statistics.median(times)
+
+
+class Results:
+    """
+    Collects named results, each with a unit and whether a higher or a
+    lower value is better.
+    """
+
+    def __init__(self) -> None:
+        self.__results = {}
+
+    def add(self, name, value, unit, higher_is_better: bool = True):
+        self.__results[name] = {"value": value, "unit": unit, "higher_is_better": higher_is_better}
+        print(f"{name:<48} {value:>14.2f} {unit}", file=sys.stderr)
+
+    def get_results(self):
+        return self.__results
+
+
+class RepeatingReader:
+    """
+    File like object giving size bytes built from one block, large
+    objects can be uploaded without holding them in memory.
+    """
+
+    def __init__(self, block: bytes, size: int) -> None:
+        self.__block = memoryview(block)
+        self.__remaining = size
+        self.__offset = 0
+
+    def read(self, size: int = -1):
+        if size < 0:
+            size = self.__remaining
+        size = min(size, self.__remaining, len(self.__block) - self.__offset)
+        data = self.__block[self.__offset:self.__offset + size]
+        self.__offset = (self.__offset + size) % len(self.__block)
+        self.__remaining -= size
+        return data
+
+
+def benchmark_store(results, sizes, repeat: int, rng, quick: bool = False):
+    """
+    Upload and download throughput of a bucket, in process and without
+    HTTP. Downloads stream the object from disk bypassing the cache, the
+    data usually comes from the page cache.
+
+    :param  results:
+    :param  sizes: object sizes in bytes
+    :param  repeat: rounds per size
+    :param  rng: random.Random
+    :param  quick:
+    :return None:
+    """
+    import main
+
+    bucket = main.Bucket("bench_bucket", is_private=False)
+    bucket.create_bucket()
+    block = rng.randbytes(PAYLOAD_BLOCK_SIZE)
+    round_bytes = STORE_ROUND_BYTES // (QUICK_FACTOR if quick else 1)
+    meta_data = {"type": "bin", "content_type": "application/octet-stream"}
+    for size in sizes:
+        count = max(1, min(MAX_STORE_OBJECTS, round_bytes // size))
+        upload_times, download_times = [], []
+        for round_number in range(repeat):
+            names = [f"object-{size}-{round_number}-{i}" for i in range(count)]
+
+            async def upload_all():
+                for name in names:
+                    obj = main.Object(name, "bench_bucket", "bin", RepeatingReader(block, size), dict(meta_data))
+                    await bucket.upload_object(obj)
+
+            started = time.perf_counter()
+            asyncio.run(upload_all())
+            upload_times.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            for name in names:
+                record = bucket.get_object_record(name, "bin")
+                received = sum(len(chunk) for chunk in bucket.iter_object_data(record))
+                if received != size:
+                    raise RuntimeError(f"read {received} bytes of {name}, expected {size}")
+            download_times.append(time.perf_counter() - started)
+
+            for name in names:
+                bucket.delete_object(name, "bin")
+
+        label = format_size(size)
+        for kind, times in (("upload", upload_times), ("download", download_times)):
+            elapsed = statistics.median(times)
+            results.add(f"store.{kind}.{label}.mb_per_sec", count * size / elapsed / SIZE_UNITS["MB"], "MB/s")
+            results.add(f"store.{kind}.{label}.objects_per_sec", count / elapsed, "objects/s")
+
+
+def benchmark_servers(results, servers, quick: bool = False):
+    """
+    Requests/sec and latency percentiles of the HTTP servers with
+    concurrent keep-alive clients, see asgi_vs_flask.py.
+
+    :param  results:
+    :param  servers: server kinds
+    :param  quick:
+    :return None:
+    """
+    duration = SERVER_DURATION / (QUICK_FACTOR if quick else 1)
+    for kind in servers:
+        for concurrency in SERVER_CONCURRENCY:
+            workloads = benchmark_server(kind, SERVER_OBJECT_SIZE, concurrency, duration)
+            for workload, stats in workloads.items():
+                prefix = f"server.{kind}.{workload}.c{concurrency}"
+                results.add(f"{prefix}.requests_per_sec", stats["requests_per_sec"], "requests/s")
+                results.add(f"{prefix}.p50_ms", stats["p50_ms"], "ms", higher_is_better=False)
+                results.add(f"{prefix}.p99_ms", stats["p99_ms"], "ms", higher_is_better=False)
+
+
+def benchmark_ring(results, repeat: int, quick: bool = False):
+    """
+    Building the consistent hashing ring and routing keys on it.
+
+    :param  results:
+    :param  repeat:
+    :param  quick:
+    :return None:
+    """
+    from main import ConsistentHashing, ConsistentNode
+
+    lookups = RING_LOOKUPS // (QUICK_FACTOR if quick else 1)
+    keys = [f"object-{i}.bin" for i in range(lookups)]
+    for node_count in RING_NODE_COUNTS:
+        nodes = [ConsistentNode(f"10.0.{i // 256}.{i % 256}:5000") for i in range(node_count)]
+
+        def build():
+            ring = ConsistentHashing.Ring()
+            for node in nodes:
+                ring.put_server(node)
+            # the points are sorted lazily by the first lookup
+            ring.get_server(keys[0])
+            return ring
+
+        elapsed = measure(build, repeat)
+        results.add(f"ring.put.n{node_count}.nodes_per_sec", node_count / elapsed, "nodes/s")
+
+        ring = build()
+
+        def lookup():
+            for key in keys:
+                ring.get_server(key)
+
+        elapsed = measure(lookup, repeat)
+        results.add(f"ring.get_server.n{node_count}.lookups_per_sec", lookups / elapsed, "lookups/s")
+        elapsed = measure(lambda: ring.get_servers(keys), repeat)
+        results.add(f"ring.get_servers.n{node_count}.lookups_per_sec", lookups / elapsed, "lookups/s")
+
+
+def benchmark_cache(results, repeat: int, rng, quick: bool = False):
+    """
+    Cost of a cache hit and of adding an entry to a full cache, for a
+    plain LRU and for the byte bounded TinyLFU cache the bucket uses.
+
+    :param  results:
+    :param  repeat:
+    :param  rng: random.Random
+    :param  quick:
+    :return None:
+    """
+    from main import LruCache
+
+    operations = CACHE_OPERATIONS // (QUICK_FACTOR if quick else 1)
+    keys = [f"object-{i}.bin" for i in range(CACHE_ENTRIES)]
+    hits = [rng.choice(keys) for _ in range(operations)]
+    new_keys = [f"new-{i}.bin" for i in range(operations)]
+    variants = {
+        "lru": lambda: LruCache(CACHE_ENTRIES, trim_size=0),
+        "tinylfu": lambda: LruCache(CACHE_ENTRIES, trim_size=0, max_bytes=CACHE_ENTRIES * 1024, admission=True),
+    }
+    for variant, make_cache in variants.items():
+        cache = make_cache()
+        for key in keys:
+            cache.add_val(key, key, 1024)
+
+        def hit():
+            for key in hits:
+                cache.get_value(key)
+
+        elapsed = measure(hit, repeat)
+        results.add(f"cache.{variant}.hit.ns_per_op", elapsed / operations * 1e9, "ns", higher_is_better=False)
+
+        def add():
+            full_cache = make_cache()
+            for key in keys:
+                full_cache.add_val(key, key, 1024)
+            started = time.perf_counter()
+            for key in new_keys:
+                full_cache.add_val(key, key, 1024)
+            return time.perf_counter() - started
+
+        elapsed = statistics.median(add() for _ in range(repeat))
+        results.add(f"cache.{variant}.add.ns_per_op", elapsed / operations * 1e9, "ns", higher_is_better=False)
+
+
+def benchmark_geohash(results, repeat: int, seed: int, quick: bool = False):
+    """
+    Points per second of the scalar and the vectorized geohash codecs.
+
+    :param  results:
+    :param  repeat:
+    :param  seed:
+    :param  quick:
+    :return None:
+    """
+    import geo_loc
+
+    factor = QUICK_FACTOR if quick else 1
+    generator = np.random.default_rng(seed)
+    batch_points = GEOHASH_BATCH_POINTS // factor
+    lats = generator.uniform(-90, 90, batch_points)
+    lons = generator.uniform(-180, 180, batch_points)
+    points = list(zip(lats[:GEOHASH_POINTS // factor].tolist(), lons[:GEOHASH_POINTS // factor].tolist()))
+    for precision in (5, 12):
+        geohashes = [geo_loc.encode(lat, lon, precision) for lat, lon in points]
+
+        def encode():
+            for lat, lon in points:
+                geo_loc.encode(lat, lon, precision)
+
+        def decode():
+            for geohash in geohashes:
+                geo_loc.decode(geohash)
+
+        results.add(f"geohash.encode.p{precision}.points_per_sec", len(points) / measure(encode, repeat), "points/s")
+        results.add(f"geohash.decode.p{precision}.points_per_sec", len(points) / measure(decode, repeat), "points/s")
+
+        batch = geo_loc.encode_many(lats, lons, precision)
+        elapsed = measure(lambda: geo_loc.encode_many(lats, lons, precision), repeat)
+        results.add(f"geohash.encode_many.p{precision}.points_per_sec", batch_points / elapsed, "points/s")
+        elapsed = measure(lambda: geo_loc.decode_many(batch), repeat)
+        results.add(f"geohash.decode_many.p{precision}.points_per_sec", batch_points / elapsed, "points/s")
+
+
+def get_environment():
+    """
+    :return dict describing the machine and the code that was measured:
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "commit": commit,
+    }
+
+
+def run(args):
+    results = Results()
+    rng = random.Random(args.seed)
+    sys.path.insert(0, ROOT)
+    output = os.path.abspath(args.output) if args.output else None
+    cwd = os.getcwd()
+    # main creates its bucket and log files in the working directory
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.chdir(work_dir)
+        try:
+            if "store" in args.suites:
+                benchmark_store(results, [parse_size(size) for size in args.sizes], args.repeat, rng, args.quick)
+            if "server" in args.suites:
+                benchmark_servers(results, args.servers, args.quick)
+            if "ring" in args.suites:
+                benchmark_ring(results, args.repeat, args.quick)
+            if "cache" in args.suites:
+                benchmark_cache(results, args.repeat, rng, args.quick)
+            if "geohash" in args.suites:
+                benchmark_geohash(results, args.repeat, args.seed, args.quick)
+        finally:
+            os.chdir(cwd)
+
+    report = {
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "environment": get_environment(),
+        "options": {"suites": list(args.suites), "sizes": list(args.sizes), "repeat": args.repeat,
+                    "seed": args.seed, "quick": args.quick},
+        "results": results.get_results(),
+    }
+    if output is None:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        with open(output, "w") as report_file:
+            json.dump(report, report_file, indent=2)
+    return 0
+
+
+def compare_results(baseline: dict, current: dict, threshold: float = DEFAULT_THRESHOLD):
+    """
+    Compares the results of two reports.
+
+    :param  baseline: results of the report to compare against
+    :param  current: results of the new report
+    :param  threshold: fraction a result may get worse before it is a regression
+    :return list of (name, baseline value, current value, change, status):
+            change is the relative improvement, negative when worse
+    """
+    rows = []
+    for name in sorted(set(baseline) | set(current)):
+        if name not in current:
+            rows.append((name, baseline[name]["value"], None, None, "removed"))
+            continue
+        if name not in baseline:
+            rows.append((name, None, current[name]["value"], None, "added"))
+            continue
+        old, new = baseline[name]["value"], current[name]["value"]
+        if old == 0:
+            change = 0.0 if new == 0 else float("inf")
+        else:
+            change = (new - old) / old
+        if not current[name]["higher_is_better"]:
+            change = -change
+        if change < -threshold:
+            status = "REGRESSION"
+        elif change > threshold:
+            status = "improved"
+        else:
+            status = "ok"
+        rows.append((name, old, new, change, status))
+    return rows
+
+
+def compare(args):
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)["results"]
+    with open(args.current) as current_file:
+        current = json.load(current_file)["results"]
+    rows = compare_results(baseline, current, args.threshold)
+
+    def cell(value):
+        return "-" if value is None else f"{value:.2f}"
+
+    print(f"{'benchmark':<48} {'baseline':>14} {'current':>14} {'change':>8}  status")
+    for name, old, new, change, status in rows:
+        change_text = "-" if change is None else f"{change * 100:+.1f}%"
+        print(f"{name:<48} {cell(old):>14} {cell(new):>14} {change_text:>8}  {status}")
+    regressions = [row for row in rows if row[4] == "REGRESSION"]
+    if regressions:
+        print(f"{len(regressions)} regression(s) above {args.threshold * 100:g}%")
+        return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DataDepot benchmark suite")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run benchmarks and write a JSON report")
+    run_parser.add_argument("--suites", nargs="+", default=list(SUITES), choices=SUITES)
+    run_parser.add_argument("--sizes", nargs="+", default=list(DEFAULT_SIZES),
+                            help="object sizes of the store suite, e.g. 1KB 1MB 1GB")
+    run_parser.add_argument("--servers", nargs="+", default=list(SERVERS), choices=list(SERVERS))
+    run_parser.add_argument("--repeat", type=int, default=5, help="runs per benchmark, the median is reported")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--quick", action="store_true", help=f"do 1/{QUICK_FACTOR} of the work")
+    run_parser.add_argument("--output", help="report file, stdout by default")
+    run_parser.set_defaults(handler=run)
+
+    compare_parser = commands.add_parser("compare", help="flag regressions between two reports")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    compare_parser.set_defaults(handler=compare)
+
+    args = parser.parse_args()
+    sys.exit(args.handler(args))
+
+
+if __name__ == '__main__':
+    main()
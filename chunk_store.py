@@ -0,0 +1,310 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from wal import fsync_path
+
+# Content defined chunking parameters (FastCDC style). Boundaries are
+# found with a gear rolling hash so an insertion only changes the chunks
+# around it and the remaining chunks still deduplicate.
+MIN_CHUNK_SIZE = 16 * 1024
+AVG_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 256 * 1024
+
+# Bytes buffered before cut points are searched, amortizes the
+# vectorized hashing over small writes
+CUT_BATCH_SIZE = 4 * MAX_CHUNK_SIZE
+
+# Normalized chunking, a stricter mask before the average size and a
+# looser one after it keeps the chunk sizes close to the average.
+# The hash is shifted left, so its high bits depend on the most recent bytes.
+MASK_S = 0xFFFFC000
+MASK_L = 0xFFFC0000
+
+GEAR = np.array([int.from_bytes(hashlib.sha256(bytes([i])).digest()[:4], "big") for i in range(256)],
+                dtype=np.uint32)
+
+REFS_FILE_NAME = "refs.sqlite3"
+
+
+def gear_hashes(data):
+    """
+    Computes the 32 bit gear hash h[i] = (h[i - 1] << 1) + GEAR[data[i]]
+    at every position of data. Bytes older than 32 positions are shifted
+    out, so the recurrence is evaluated as a windowed sum by doubling,
+    five vectorized passes instead of a Python loop per byte.
+
+    :param  data:
+    :return numpy uint32 array:
+    """
+    hashes = GEAR[np.frombuffer(data, dtype=np.uint8)]
+    shifted = np.empty_like(hashes)
+    step = 1
+    while step < 32:
+        shifted[:step] = 0
+        np.left_shift(hashes[:-step], step, out=shifted[step:])
+        hashes += shifted
+        step *= 2
+    return hashes
+
+
+class ContentChunker:
+    """
+    Incrementally splits a byte stream into content defined chunks.
+    Only the bytes of the chunk being searched are buffered.
+    """
+
+    def __init__(self) -> None:
+        self.__buffer = bytearray()
+
+    def update(self, data):
+        """
+        Feeds data into the chunker, chunks are only cut once a full
+        MAX_CHUNK_SIZE window is buffered so every cut sees the same bytes
+        regardless of how the stream was split.
+
+        :param  data:
+        :return list of completed chunks:
+        """
+        self.__buffer += data
+        return self._cut(final=False)
+
+    def finish(self):
+        """
+        Flushes the remaining bytes as the final chunks.
+
+        :return list of chunks:
+        """
+        chunks = self._cut(final=True)
+        if self.__buffer:
+            chunks.append(bytes(self.__buffer))
+            self.__buffer.clear()
+        return chunks
+
+    def _cut(self, final: bool):
+        length = len(self.__buffer)
+        if length <= MIN_CHUNK_SIZE or (not final and length < CUT_BATCH_SIZE):
+            return []
+
+        # a position only depends on the 32 bytes before it and cuts are never
+        # searched within MIN_CHUNK_SIZE of a chunk start, so hashing the buffer
+        # from the current chunk start is the same as hashing the whole stream
+        hashes = gear_hashes(self.__buffer)
+        strict = np.flatnonzero((hashes & MASK_S) == 0)
+        loose = np.flatnonzero((hashes & MASK_L) == 0)
+
+        chunks = []
+        start = 0
+        while length - start >= (1 if final else MAX_CHUNK_SIZE):
+            cut = -1
+            normal = min(start + AVG_CHUNK_SIZE, length)
+            limit = min(start + MAX_CHUNK_SIZE, length)
+            i = np.searchsorted(strict, start + MIN_CHUNK_SIZE)
+            if i < len(strict) and strict[i] < normal:
+                cut = int(strict[i]) + 1
+            else:
+                i = np.searchsorted(loose, normal)
+                if i < len(loose) and loose[i] < limit:
+                    cut = int(loose[i]) + 1
+                elif limit - start == MAX_CHUNK_SIZE:
+                    cut = limit
+            if cut < 0:
+                break
+            chunks.append(bytes(self.__buffer[start:cut]))
+            start = cut
+        if start:
+            del self.__buffer[:start]
+        return chunks
+
+
+class ChunkStore:
+    """
+    Content addressed store of deduplicated chunks.
+
+    Each unique chunk is stored once under its sha256 digest with a
+    reference count, objects are described by manifests listing their
+    chunks. Writing a chunk that is already stored only bumps its
+    reference count, so duplicate data costs no data writes.
+    """
+
+    def __init__(self, root) -> None:
+        self.__root = root
+        os.makedirs(root, exist_ok=True)
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(os.path.join(root, REFS_FILE_NAME),
+                                            check_same_thread=False, isolation_level=None)
+        self.__connection.execute("PRAGMA journal_mode=WAL")
+        self.__connection.execute("PRAGMA synchronous=NORMAL")
+        self.__connection.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "digest TEXT PRIMARY KEY, size INTEGER NOT NULL, refcount INTEGER NOT NULL"
+            ") WITHOUT ROWID")
+        self.__ingested_bytes = 0
+        self.__ingest_seconds = 0.0
+
+    def get_chunk_path(self, digest):
+        return os.path.join(self.__root, digest[:2], digest)
+
+    def put_chunk(self, data):
+        """
+        Stores a chunk unless an identical chunk is already stored.
+
+        :param  data:
+        :return str, the sha256 digest of the chunk:
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        with self.__lock:
+            cursor = self.__connection.execute(
+                "UPDATE chunks SET refcount = refcount + 1 WHERE digest = ?", (digest,))
+            if cursor.rowcount == 1:
+                return digest
+
+            path = self.get_chunk_path(digest)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as chunk_file:
+                chunk_file.write(data)
+            os.replace(temp_path, path)
+            self.__connection.execute("INSERT INTO chunks VALUES (?, ?, 1)", (digest, len(data)))
+        return digest
+
+    def sync_chunks(self, digests):
+        """
+        Fsyncs chunks and the directories holding them. Chunks stored
+        before by another upload are synced as well, that upload may not
+        have synced them yet.
+
+        :param  digests:
+        :return None:
+        """
+        directories = set()
+        for digest in set(digests):
+            path = self.get_chunk_path(digest)
+            fsync_path(path)
+            directories.add(os.path.dirname(path))
+        for directory in directories:
+            fsync_path(directory)
+
+    def release_chunks(self, digests):
+        """
+        Drops one reference from each chunk, chunks which are no longer
+        referenced are deleted.
+
+        :param  digests:
+        :return None:
+        """
+        with self.__lock:
+            for digest in digests:
+                self.__connection.execute(
+                    "UPDATE chunks SET refcount = refcount - 1 WHERE digest = ?", (digest,))
+                cursor = self.__connection.execute(
+                    "DELETE FROM chunks WHERE digest = ? AND refcount <= 0", (digest,))
+                if cursor.rowcount == 1:
+                    try:
+                        os.remove(self.get_chunk_path(digest))
+                    except FileNotFoundError:
+                        pass
+
+    def read_chunk(self, digest):
+        with open(self.get_chunk_path(digest), "rb") as chunk_file:
+            return chunk_file.read()
+
+    def iter_range(self, chunks, start: int, end: int):
+        """
+        Yields the bytes [start, end) of an object from its chunk list.
+
+        :param  chunks: list of (digest, size)
+        :param  start:
+        :param  end:
+        :return generator of bytes:
+        """
+        offset = 0
+        for digest, size in chunks:
+            if offset >= end:
+                break
+            if offset + size > start:
+                with open(self.get_chunk_path(digest), "rb") as chunk_file:
+                    chunk_start = max(start - offset, 0)
+                    chunk_file.seek(chunk_start)
+                    yield chunk_file.read(min(end - offset, size) - chunk_start)
+            offset += size
+
+    def record_ingest(self, size: int, seconds: float):
+        """
+        Records a completed ingest for the throughput statistics.
+
+        :param  size:
+        :param  seconds:
+        :return None:
+        """
+        with self.__lock:
+            self.__ingested_bytes += size
+            self.__ingest_seconds += seconds
+
+    def get_stats(self):
+        """
+        Dedup and ingest statistics of the store.
+
+        logical_bytes counts every reference to a chunk, physical_bytes
+        counts each stored chunk once, so dedup_ratio is the factor by
+        which deduplication shrinks the data on disk.
+
+        :return dict:
+        """
+        with self.__lock:
+            unique_chunks, logical, physical = self.__connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size * refcount), 0), COALESCE(SUM(size), 0) "
+                "FROM chunks").fetchone()
+            ingested, seconds = self.__ingested_bytes, self.__ingest_seconds
+        return {
+            "unique_chunks": unique_chunks,
+            "logical_bytes": logical,
+            "physical_bytes": physical,
+            "dedup_ratio": logical / physical if physical else 1.0,
+            "ingested_bytes": ingested,
+            "ingest_mb_per_sec": ingested / seconds / 1e6 if seconds else 0.0,
+        }
+
+    def close(self):
+        with self.__lock:
+            self.__connection.close()
+
+
+class ChunkedObjectWriter:
+    """
+    Streams the data of one object into the chunk store and
+    collects the manifest of the chunks it is made of.
+    """
+
+    def __init__(self, store: ChunkStore) -> None:
+        self.__store = store
+        self.__chunker = ContentChunker()
+        self.chunks = []
+        self.__started = time.perf_counter()
+        self.__size = 0
+
+    def write(self, data):
+        self.__size += len(data)
+        for chunk in self.__chunker.update(data):
+            self.chunks.append((self.__store.put_chunk(chunk), len(chunk)))
+
+    def close(self, sync: bool = False):
+        """
+        :param  sync: fsync the chunks of the object
+        :return list of (digest, size):
+        """
+        for chunk in self.__chunker.finish():
+            self.chunks.append((self.__store.put_chunk(chunk), len(chunk)))
+        if sync:
+            self.__store.sync_chunks([digest for digest, _ in self.chunks])
+        self.__store.record_ingest(self.__size, time.perf_counter() - self.__started)
+        return self.chunks
+
+    def abort(self):
+        """Releases the chunks already stored for a failed upload."""
+        self.__store.release_chunks([digest for digest, _ in self.chunks])
+        self.chunks = []
@@ -0,0 +1,93 @@
+import base64
+import hashlib
+import http.client
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Default size of the parts of a multipart upload
+PART_SIZE = 16 * 1024 * 1024
+
+
+class DataDepotClientException(Exception):
+    """Exception raised when the server rejects a request."""
+
+
+def request_json(connection, method, url, body=None, headers=None):
+    """
+    Sends a request and decodes the json response.
+
+    :param  connection:
+    :param  method:
+    :param  url:
+    :param  body:
+    :param  headers:
+    :return dict:
+    :raise  DataDepotClientException:
+    """
+    connection.request(method, url, body=body, headers=headers or {})
+    response = connection.getresponse()
+    payload = response.read()
+    if response.status >= 400:
+        raise DataDepotClientException(f"{method} {url} failed with {response.status}: {payload!r}")
+    return json.loads(payload) if payload else {}
+
+
+def upload_file_multipart(host, port, file_path, object_name, part_size: int = PART_SIZE,
+                          concurrency: int = 8):
+    """
+    Uploads a file with the multipart api, sending the parts over
+    several keep-alive connections at once so that a single client can
+    use the available bandwidth. Each part carries its sha256 and
+    Content-MD5 so the server verifies it before storing it.
+
+    :param  host:
+    :param  port:
+    :param  file_path:
+    :param  object_name: 'name.type' as used by /upload
+    :param  part_size:
+    :param  concurrency: number of parallel connections
+    :return dict, the response of the completed upload:
+    :raise  DataDepotClientException:
+    """
+    connection = http.client.HTTPConnection(host, port)
+    upload_id = request_json(connection, "POST", f"/multipart/{object_name}")["upload_id"]
+    size = os.path.getsize(file_path)
+    part_count = max(1, (size + part_size - 1) // part_size)
+    local = threading.local()
+    # every worker connection, closed with the upload whichever thread opened it
+    part_connections = []
+
+    def send_part(part_number):
+        if not hasattr(local, "connection"):
+            local.connection = http.client.HTTPConnection(host, port)
+            part_connections.append(local.connection)
+        with open(file_path, "rb") as data_file:
+            data_file.seek((part_number - 1) * part_size)
+            data = data_file.read(part_size)
+        headers = {
+            "Content-Type": "application/octet-stream",
+            "X-Checksum-Sha256": hashlib.sha256(data).hexdigest(),
+            "Content-MD5": base64.b64encode(hashlib.md5(data).digest()).decode(),
+        }
+        return request_json(local.connection, "PUT", f"/multipart/{object_name}/{upload_id}/{part_number}",
+                            body=data, headers=headers)
+
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            parts = list(executor.map(send_part, range(1, part_count + 1)))
+        body = json.dumps({"parts": [{"part_number": part["part_number"], "etag": part["etag"]}
+                                     for part in parts]})
+        return request_json(connection, "POST", f"/multipart/{object_name}/{upload_id}/complete",
+                            body=body, headers={"Content-Type": "application/json"})
+    except BaseException:
+        try:
+            request_json(connection, "DELETE", f"/multipart/{object_name}/{upload_id}")
+        except (OSError, http.client.HTTPException, DataDepotClientException):
+            pass
+        raise
+    finally:
+        for part_connection in part_connections:
+            part_connection.close()
+        connection.close()
@@ -0,0 +1,143 @@
+import lzma
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional
+    zstandard = None
+
+# Codecs objects can be stored with, zlib and lzma ship with Python
+CODEC_ZLIB = "zlib"
+CODEC_LZMA = "lzma"
+CODEC_ZSTD = "zstd"
+
+# HTTP content codings whose bytes are identical to the stored stream,
+# a zlib stream is exactly what HTTP calls "deflate". lzma has no
+# registered content coding so it is always decompressed on download.
+CONTENT_ENCODINGS = {
+    CODEC_ZLIB: "deflate",
+    CODEC_ZSTD: "zstd",
+}
+
+ZLIB_LEVEL = 6
+LZMA_PRESET = 6
+ZSTD_LEVEL = 3
+
+
+class UnknownCodecException(Exception):
+    """Exception raised for a codec which is unknown or not installed."""
+
+
+def get_codecs():
+    """
+    Codecs usable in this environment.
+
+    :return list of str:
+    """
+    codecs = [CODEC_ZLIB, CODEC_LZMA]
+    if zstandard is not None:
+        codecs.append(CODEC_ZSTD)
+    return codecs
+
+
+def get_compressor(codec):
+    """
+    Returns a streaming compressor with compress(data) and flush().
+
+    :param  codec:
+    :return compressor:
+    :raise  UnknownCodecException:
+    """
+    if codec == CODEC_ZLIB:
+        return zlib.compressobj(ZLIB_LEVEL)
+    if codec == CODEC_LZMA:
+        return lzma.LZMACompressor(preset=LZMA_PRESET)
+    if codec == CODEC_ZSTD and zstandard is not None:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    raise UnknownCodecException(f"Compression codec '{codec}' is not available")
+
+
+def get_decompressor(codec):
+    """
+    Returns a streaming decompressor with decompress(data).
+
+    :param  codec:
+    :return decompressor:
+    :raise  UnknownCodecException:
+    """
+    if codec == CODEC_ZLIB:
+        return zlib.decompressobj()
+    if codec == CODEC_LZMA:
+        return lzma.LZMADecompressor()
+    if codec == CODEC_ZSTD and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise UnknownCodecException(f"Compression codec '{codec}' is not available")
+
+
+def compress(codec, data):
+    """
+    Compresses data in one go.
+
+    :param  codec:
+    :param  data:
+    :return bytes:
+    """
+    compressor = get_compressor(codec)
+    return compressor.compress(data) + compressor.flush()
+
+
+def iter_decompressed(codec, chunks, start: int = 0, end=None):
+    """
+    Decompresses a stream of compressed chunks and yields the
+    decompressed bytes [start, end). Compressed streams cannot be
+    seeked, so the bytes before start are decompressed and dropped.
+
+    :param  codec:
+    :param  chunks: iterable of compressed bytes
+    :param  start:
+    :param  end: exclusive, None for the end of the stream
+    :return generator of bytes:
+    """
+    decompressor = get_decompressor(codec)
+    offset = 0
+    for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if not data:
+            continue
+        data_start = max(start - offset, 0)
+        data_end = len(data) if end is None else min(end - offset, len(data))
+        offset += len(data)
+        if data_end > data_start:
+            yield data[data_start:data_end]
+        if end is not None and offset >= end:
+            return
+
+
+def accepts_encoding(accept_encoding, content_encoding):
+    """
+    Checks whether an Accept-Encoding header allows a content coding
+    with a non zero quality, either by name or through "*".
+
+    :param  accept_encoding: header value or None
+    :param  content_encoding:
+    :return bool:
+    """
+    if not accept_encoding or content_encoding is None:
+        return False
+    wildcard = False
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        coding = coding.strip().lower()
+        if coding == content_encoding:
+            return quality > 0
+        if coding == "*":
+            wildcard = quality > 0
+    return wildcard
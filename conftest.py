@@ -0,0 +1,7 @@
+import os
+import tempfile
+
+# main opens the bucket of the Flask app and the log files relative to
+# the working directory when it is imported, the tests run in a scratch
+# directory so they never write into the checkout
+os.chdir(tempfile.mkdtemp(prefix="datadepot-tests-"))
@@ -0,0 +1,418 @@
+import functools
+import os
+import threading
+import zlib
+
+import numpy as np
+
+from wal import fsync_path
+
+# Default stripe geometry, 4 data + 2 parity shards survive the loss of
+# any two shards for 1.5x the object size instead of 3x for replication
+DATA_SHARDS = 4
+PARITY_SHARDS = 2
+
+# Bytes each shard receives per stripe, must be even since the shards
+# are multiplied two bytes at a time
+BLOCK_SIZE = 256 * 1024
+
+# Shard directories are named shard-00, shard-01, ... inside the root
+SHARD_DIR_FORMAT = "shard-{:02d}"
+
+# GF(2^8) with the primitive polynomial x^8 + x^4 + x^3 + x^2 + 1
+GF_POLYNOMIAL = 0x11D
+
+
+def _build_gf_tables():
+    exp = np.zeros(512, dtype=np.uint8)
+    log = np.zeros(256, dtype=np.int32)
+    value = 1
+    for power in range(255):
+        exp[power] = value
+        log[value] = power
+        value <<= 1
+        if value & 0x100:
+            value ^= GF_POLYNOMIAL
+    exp[255:510] = exp[:255]
+    return exp, log
+
+
+GF_EXP, GF_LOG = _build_gf_tables()
+
+
+def gf_mul(a: int, b: int):
+    if a == 0 or b == 0:
+        return 0
+    return int(GF_EXP[GF_LOG[a] + GF_LOG[b]])
+
+
+def gf_inv(a: int):
+    if a == 0:
+        raise ZeroDivisionError("0 has no inverse in GF(256)")
+    return int(GF_EXP[255 - GF_LOG[a]])
+
+
+@functools.lru_cache(maxsize=256)
+def get_mul_table(coefficient: int):
+    """
+    Product table of a coefficient for pairs of bytes. Indexing it with
+    a uint16 view of a block multiplies two bytes per lookup, which is
+    about twice as fast as a 256 entry table.
+
+    :param  coefficient:
+    :return numpy uint16 array of 65536 entries:
+    """
+    row = np.array([gf_mul(coefficient, value) for value in range(256)], dtype=np.uint16)
+    pairs = np.arange(65536, dtype=np.uint32)
+    return row[pairs & 0xFF] | (row[pairs >> 8] << 8)
+
+
+def mul_add(coefficient: int, block, out):
+    """
+    out ^= coefficient * block over GF(256), both uint16 views.
+
+    :param  coefficient:
+    :param  block:
+    :param  out:
+    :return None:
+    """
+    if coefficient == 0:
+        return
+    if coefficient == 1:
+        np.bitwise_xor(out, block, out=out)
+        return
+    np.bitwise_xor(out, np.take(get_mul_table(coefficient), block), out=out)
+
+
+def invert_matrix(matrix):
+    """
+    Inverts a square matrix over GF(256) by Gauss-Jordan elimination.
+
+    :param  matrix: list of rows of ints
+    :return list of rows of ints:
+    :raise  ValueError for a singular matrix:
+    """
+    size = len(matrix)
+    rows = [list(row) + [int(i == j) for j in range(size)] for i, row in enumerate(matrix)]
+    for column in range(size):
+        pivot = next((r for r in range(column, size) if rows[r][column]), None)
+        if pivot is None:
+            raise ValueError("Matrix is singular")
+        rows[column], rows[pivot] = rows[pivot], rows[column]
+        scale = gf_inv(rows[column][column])
+        rows[column] = [gf_mul(scale, value) for value in rows[column]]
+        for r in range(size):
+            factor = rows[r][column]
+            if r != column and factor:
+                rows[r] = [value ^ gf_mul(factor, pivot_value)
+                           for value, pivot_value in zip(rows[r], rows[column])]
+    return [row[size:] for row in rows]
+
+
+class ReedSolomonEncoder:
+    """
+    Implements a systematic Reed Solomon code over GF(256).
+
+    The data shards are stored unchanged and the parity shards are
+    computed with a Cauchy matrix, every square submatrix of which is
+    invertible, so any data_shards of the shards rebuild the data.
+    """
+
+    def __init__(self, data_shards: int = DATA_SHARDS, parity_shards: int = PARITY_SHARDS) -> None:
+        if data_shards < 1 or parity_shards < 0 or data_shards + parity_shards > 256:
+            raise ValueError("Invalid shard counts")
+        self.data_shards = data_shards
+        self.parity_shards = parity_shards
+        self.parity_matrix = [[gf_inv((data_shards + i) ^ j) for j in range(data_shards)]
+                              for i in range(parity_shards)]
+
+    def get_matrix_row(self, shard: int):
+        if shard < self.data_shards:
+            return [int(shard == j) for j in range(self.data_shards)]
+        return self.parity_matrix[shard - self.data_shards]
+
+    def encode(self, data_blocks):
+        """
+        Computes the parity blocks of a stripe.
+
+        :param  data_blocks: data_shards equally sized blocks of even length
+        :return list of parity blocks as bytes:
+        """
+        blocks = [np.frombuffer(block, dtype=np.uint16) for block in data_blocks]
+        parity = []
+        for row in self.parity_matrix:
+            out = np.zeros_like(blocks[0])
+            for coefficient, block in zip(row, blocks):
+                mul_add(coefficient, block, out)
+            parity.append(out.tobytes())
+        return parity
+
+    def decode(self, shards: dict):
+        """
+        Rebuilds the data blocks of a stripe from any data_shards shards.
+
+        :param  shards: dict of shard number to block, at least data_shards entries
+        :return list of data blocks as bytes:
+        :raise  ValueError when too few shards are given:
+        """
+        if len(shards) < self.data_shards:
+            raise ValueError(f"{len(shards)} shards cannot rebuild {self.data_shards} data shards")
+        # prefer the data shards, they need no arithmetic
+        used = sorted(shards)[:self.data_shards]
+        if used == list(range(self.data_shards)):
+            return [bytes(shards[shard]) for shard in used]
+
+        inverse = invert_matrix([self.get_matrix_row(shard) for shard in used])
+        blocks = [np.frombuffer(shards[shard], dtype=np.uint16) for shard in used]
+        data_blocks = []
+        for j in range(self.data_shards):
+            if j in shards:
+                data_blocks.append(bytes(shards[j]))
+                continue
+            out = np.zeros_like(blocks[0])
+            for coefficient, block in zip(inverse[j], blocks):
+                mul_add(coefficient, block, out)
+            data_blocks.append(out.tobytes())
+        return data_blocks
+
+
+def get_block_length(stripe_size: int, data_shards: int):
+    """
+    Length of the blocks a stripe of stripe_size bytes is split into,
+    rounded up to an even length.
+
+    :param  stripe_size:
+    :param  data_shards:
+    :return int:
+    """
+    length = (stripe_size + data_shards - 1) // data_shards
+    return length + (length & 1)
+
+
+class ErasureStore:
+    """
+    Erasure coded store which stripes objects over shard directories.
+
+    Each shard directory stands in for a disk or node, an object gets
+    one file per shard directory holding its blocks of every stripe.
+    Reads use the data shards and only fall back to decoding from the
+    parity shards when a shard is missing or fails its checksum.
+    """
+
+    def __init__(self, root, data_shards: int = DATA_SHARDS, parity_shards: int = PARITY_SHARDS,
+                 block_size: int = BLOCK_SIZE) -> None:
+        if block_size % 2:
+            raise ValueError("The block size must be even")
+        self.__root = root
+        self.__block_size = block_size
+        self.__encoder = ReedSolomonEncoder(data_shards, parity_shards)
+        self.__lock = threading.Lock()
+        self.__degraded_reads = 0
+        for shard in range(data_shards + parity_shards):
+            os.makedirs(self.get_shard_dir(shard), exist_ok=True)
+
+    def get_encoder(self):
+        return self.__encoder
+
+    def get_block_size(self):
+        return self.__block_size
+
+    def get_shard_dir(self, shard: int):
+        return os.path.join(self.__root, SHARD_DIR_FORMAT.format(shard))
+
+    def get_shard_path(self, shard: int, object_id):
+        return os.path.join(self.get_shard_dir(shard), object_id)
+
+    def open_writer(self, object_id):
+        return ErasureObjectWriter(self, object_id)
+
+    def _read_block(self, manifest, shard: int, stripe: int, length: int):
+        """
+        Reads and verifies one block, None when it is missing or corrupted.
+
+        :return bytes or None:
+        """
+        try:
+            with open(self.get_shard_path(shard, manifest["object_id"]), "rb") as shard_file:
+                block = os.pread(shard_file.fileno(), length, stripe * manifest["block_size"])
+        except OSError:
+            return None
+        if len(block) != length or zlib.crc32(block) != manifest["checksums"][stripe][shard]:
+            return None
+        return block
+
+    def read_stripe(self, manifest, stripe: int, first_block: int = 0, last_block=None):
+        """
+        Reads the data blocks first_block..last_block of a stripe,
+        decoding them from the other shards when any of them is lost.
+
+        :param  manifest: as returned by ErasureObjectWriter.close
+        :param  stripe:
+        :param  first_block:
+        :param  last_block: inclusive, defaults to the last data block
+        :return bytes of the requested blocks, without padding:
+        :raise  IOError when fewer than data_shards shards survive:
+        """
+        data_shards = manifest["data_shards"]
+        total_shards = data_shards + manifest["parity_shards"]
+        stripe_size = min(data_shards * manifest["block_size"],
+                          manifest["size"] - stripe * data_shards * manifest["block_size"])
+        length = get_block_length(stripe_size, data_shards)
+        last_block = data_shards - 1 if last_block is None else last_block
+
+        shards = {}
+        for shard in range(first_block, last_block + 1):
+            block = self._read_block(manifest, shard, stripe, length)
+            if block is not None:
+                shards[shard] = block
+        if len(shards) < last_block - first_block + 1:
+            # degraded read, collect any data_shards healthy shards and decode
+            with self.__lock:
+                self.__degraded_reads += 1
+            for shard in range(total_shards):
+                if len(shards) >= data_shards:
+                    break
+                if shard in shards or first_block <= shard <= last_block:
+                    continue
+                block = self._read_block(manifest, shard, stripe, length)
+                if block is not None:
+                    shards[shard] = block
+            if len(shards) < data_shards:
+                raise IOError(f"Stripe {stripe} of object {manifest['object_id']} lost more than "
+                              f"{manifest['parity_shards']} shards")
+            encoder = self.__encoder
+            if (encoder.data_shards, encoder.parity_shards) != (data_shards, manifest["parity_shards"]):
+                encoder = ReedSolomonEncoder(data_shards, manifest["parity_shards"])
+            data_blocks = encoder.decode(shards)
+            shards = dict(enumerate(data_blocks))
+
+        data = b"".join(shards[shard] for shard in range(first_block, last_block + 1))
+        # strip the padding of the last stripe
+        return data[:max(0, stripe_size - first_block * length)]
+
+    def iter_range(self, manifest, start: int, end: int):
+        """
+        Yields the bytes [start, end) of an erasure coded object,
+        only the blocks overlapping the range are read.
+
+        :param  manifest:
+        :param  start:
+        :param  end:
+        :return generator of bytes:
+        """
+        stripe_size = manifest["data_shards"] * manifest["block_size"]
+        block_size = manifest["block_size"]
+        for stripe in range(start // stripe_size, (end - 1) // stripe_size + 1 if end > start else 0):
+            stripe_start = stripe * stripe_size
+            first_block = (max(start, stripe_start) - stripe_start) // block_size
+            last_block = (min(end, stripe_start + stripe_size) - 1 - stripe_start) // block_size
+            if stripe_start + stripe_size > manifest["size"]:
+                # the blocks of the last stripe are shorter, read it whole
+                first_block, last_block = 0, None
+            data = self.read_stripe(manifest, stripe, first_block, last_block)
+            data_start = stripe_start + first_block * block_size
+            yield data[max(start - data_start, 0):end - data_start]
+
+    def delete(self, manifest):
+        """
+        Removes the shard files of an object.
+
+        :param  manifest:
+        :return None:
+        """
+        for shard in range(manifest["data_shards"] + manifest["parity_shards"]):
+            try:
+                os.remove(self.get_shard_path(shard, manifest["object_id"]))
+            except FileNotFoundError:
+                pass
+
+    def get_stats(self):
+        """
+        :return dict with the geometry, storage overhead and degraded reads:
+        """
+        encoder = self.__encoder
+        with self.__lock:
+            degraded_reads = self.__degraded_reads
+        return {
+            "data_shards": encoder.data_shards,
+            "parity_shards": encoder.parity_shards,
+            "storage_overhead": (encoder.data_shards + encoder.parity_shards) / encoder.data_shards,
+            "degraded_reads": degraded_reads,
+        }
+
+
+class ErasureObjectWriter:
+    """
+    Streams the data of one object into the erasure store, a stripe is
+    encoded and written to the shard files as soon as it is complete.
+    """
+
+    def __init__(self, store: ErasureStore, object_id) -> None:
+        encoder = store.get_encoder()
+        self.__store = store
+        self.__encoder = encoder
+        self.__object_id = object_id
+        self.__stripe_size = encoder.data_shards * store.get_block_size()
+        self.__buffer = bytearray()
+        self.__size = 0
+        self.__checksums = []
+        self.__files = []
+        for shard in range(encoder.data_shards + encoder.parity_shards):
+            # a replaced disk comes back as an empty shard directory
+            os.makedirs(store.get_shard_dir(shard), exist_ok=True)
+            self.__files.append(open(store.get_shard_path(shard, object_id), "wb"))
+
+    def _write_stripe(self, data):
+        data_shards = self.__encoder.data_shards
+        length = get_block_length(len(data), data_shards)
+        data = bytes(data).ljust(length * data_shards, b"\0")
+        blocks = [data[i * length:(i + 1) * length] for i in range(data_shards)]
+        blocks += self.__encoder.encode(blocks)
+        self.__checksums.append([zlib.crc32(block) for block in blocks])
+        for shard_file, block in zip(self.__files, blocks):
+            shard_file.write(block)
+
+    def write(self, data):
+        self.__size += len(data)
+        self.__buffer += data
+        stripes = len(self.__buffer) // self.__stripe_size
+        for stripe in range(stripes):
+            self._write_stripe(memoryview(self.__buffer)[stripe * self.__stripe_size:
+                                                         (stripe + 1) * self.__stripe_size])
+        if stripes:
+            del self.__buffer[:stripes * self.__stripe_size]
+
+    def close(self, sync: bool = False):
+        """
+        Encodes the last partial stripe and closes the shard files.
+
+        :param  sync: fsync the shard files and their directories
+        :return dict, the manifest of the object:
+        """
+        if self.__buffer:
+            self._write_stripe(self.__buffer)
+            self.__buffer.clear()
+        for shard_file in self.__files:
+            if sync:
+                shard_file.flush()
+                os.fsync(shard_file.fileno())
+            shard_file.close()
+        if sync:
+            for shard in range(len(self.__files)):
+                fsync_path(self.__store.get_shard_dir(shard))
+        return {
+            "object_id": self.__object_id,
+            "data_shards": self.__encoder.data_shards,
+            "parity_shards": self.__encoder.parity_shards,
+            "block_size": self.__store.get_block_size(),
+            "size": self.__size,
+            "checksums": self.__checksums,
+        }
+
+    def abort(self):
+        """Removes the shard files of a failed upload."""
+        for shard_file in self.__files:
+            shard_file.close()
+        self.__store.delete({"object_id": self.__object_id,
+                             "data_shards": self.__encoder.data_shards,
+                             "parity_shards": self.__encoder.parity_shards})
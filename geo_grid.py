@@ -0,0 +1,396 @@
+import csv
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from geo_loc import encode_codes, format_geohashes, parse_geohash
+
+# Points parsed or buffered before they are encoded and sorted as one run
+CHUNK_POINTS = 1_000_000
+
+# Grid files start with the magic, the length of the json header and the
+# header, the arrays follow at offsets aligned for memory mapping
+GRID_FILE_MAGIC = b"DDGRID\x00\x01"
+GRID_FILE_ALIGNMENT = 64
+
+# Columns of a grid, in the order they are written
+GRID_ARRAYS = ("cells", "offsets", "ids", "lats", "lons")
+
+# File formats read by read_points
+FORMAT_CSV = "csv"
+FORMAT_NDJSON = "ndjson"
+FILE_FORMATS = {".csv": FORMAT_CSV, ".ndjson": FORMAT_NDJSON, ".jsonl": FORMAT_NDJSON}
+
+
+class Grid:
+    """
+    Points grouped by grid cell in columnar storage.
+
+    The points are kept in parallel arrays of ids, latitudes and
+    longitudes ordered by cell, cells[i] owns the points in
+    offsets[i]:offsets[i + 1]. Within a cell points keep the order they
+    were added in. The arrays of a saved grid are memory mapped, so
+    opening one costs nothing until its cells are read.
+    """
+
+    def __init__(self, cells, offsets, ids, lats, lons, precs: int = 2, geohash_precision: int = 5) -> None:
+        self.__cells = cells
+        self.__offsets = offsets
+        self.__ids = ids
+        self.__lats = lats
+        self.__lons = lons
+        self.__precs = precs
+        self.__geohash_precision = geohash_precision
+
+    def __len__(self):
+        return len(self.__ids)
+
+    def get_cell_count(self):
+        return len(self.__cells)
+
+    def get_precision(self):
+        """
+        :return (decimals coordinates are rounded to, geohash characters of a cell):
+        """
+        return self.__precs, self.__geohash_precision
+
+    def get_arrays(self):
+        """
+        :return dict of the columns by name, see GRID_ARRAYS:
+        """
+        return {"cells": self.__cells, "offsets": self.__offsets, "ids": self.__ids,
+                "lats": self.__lats, "lons": self.__lons}
+
+    def get_geohashes(self):
+        """
+        :return numpy array of the geohashes of the cells, in order:
+        """
+        return format_geohashes(self.__cells, self.__geohash_precision)
+
+    def get_cell(self, geohash):
+        """
+        The points of a cell, views into the grid arrays.
+
+        :param  geohash:
+        :return arrays of ids, latitudes and longitudes, empty for an unknown cell:
+        """
+        if len(geohash) != self.__geohash_precision:
+            raise ValueError(f"Cells are geohashes of {self.__geohash_precision} characters")
+        code = np.uint64(parse_geohash(geohash))
+        index = int(np.searchsorted(self.__cells, code))
+        if index == len(self.__cells) or self.__cells[index] != code:
+            start = end = 0
+        else:
+            start, end = int(self.__offsets[index]), int(self.__offsets[index + 1])
+        return self.__ids[start:end], self.__lats[start:end], self.__lons[start:end]
+
+    def iter_cells(self):
+        """
+        :return generator of (geohash, ids, latitudes, longitudes):
+        """
+        offsets = self.__offsets
+        for index, geohash in enumerate(self.get_geohashes().tolist()):
+            start, end = int(offsets[index]), int(offsets[index + 1])
+            yield geohash, self.__ids[start:end], self.__lats[start:end], self.__lons[start:end]
+
+    def to_dict(self):
+        """
+        The grid in the format of generate_grid, for small grids.
+
+        :return dict of geohash -> list of {id: (lat, lon)}:
+        """
+        return {geohash: [{point_id: (lat, lon)} for point_id, lat, lon in zip(ids.tolist(), lats.tolist(),
+                                                                                 lons.tolist())]
+                for geohash, ids, lats, lons in self.iter_cells()}
+
+    def save(self, path):
+        """
+        Writes the grid to a file which open() maps back into memory.
+        The file is written next to path and renamed into place.
+
+        :param  path:
+        :return None:
+        """
+        arrays = {name: np.ascontiguousarray(array) for name, array in self.get_arrays().items()}
+        layout, offset = {}, 0
+        for name in GRID_ARRAYS:
+            layout[name] = {"dtype": arrays[name].dtype.str, "length": len(arrays[name]), "offset": offset}
+            offset += -(-arrays[name].nbytes // GRID_FILE_ALIGNMENT) * GRID_FILE_ALIGNMENT
+        header = json.dumps({"precs": self.__precs, "geohash_precision": self.__geohash_precision,
+                             "arrays": layout}).encode()
+        data_start = -(-(len(GRID_FILE_MAGIC) + 8 + len(header)) // GRID_FILE_ALIGNMENT) * GRID_FILE_ALIGNMENT
+
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "wb") as grid_file:
+            grid_file.write(GRID_FILE_MAGIC + len(header).to_bytes(8, "little") + header)
+            for name in GRID_ARRAYS:
+                grid_file.seek(data_start + layout[name]["offset"])
+                grid_file.write(memoryview(arrays[name]).cast("B"))
+            grid_file.truncate(data_start + offset)
+            grid_file.flush()
+            os.fsync(grid_file.fileno())
+        os.replace(temp_path, path)
+
+    @staticmethod
+    def open(path):
+        """
+        Maps a grid file written by save() read-only into memory.
+
+        :param  path:
+        :return Grid:
+        :raise  ValueError for a file which is not a grid:
+        """
+        with open(path, "rb") as grid_file:
+            prefix = grid_file.read(len(GRID_FILE_MAGIC) + 8)
+            if prefix[:len(GRID_FILE_MAGIC)] != GRID_FILE_MAGIC:
+                raise ValueError(f"'{path}' is not a grid file")
+            header_length = int.from_bytes(prefix[len(GRID_FILE_MAGIC):], "little")
+            header = json.loads(grid_file.read(header_length))
+        data_start = -(-(len(GRID_FILE_MAGIC) + 8 + header_length) // GRID_FILE_ALIGNMENT) * GRID_FILE_ALIGNMENT
+        arrays = {}
+        for name in GRID_ARRAYS:
+            layout = header["arrays"][name]
+            if layout["length"] == 0:
+                arrays[name] = np.empty(0, dtype=np.dtype(layout["dtype"]))
+                continue
+            arrays[name] = np.memmap(path, dtype=np.dtype(layout["dtype"]), mode="r",
+                                     offset=data_start + layout["offset"], shape=(layout["length"],))
+        return Grid(precs=header["precs"], geohash_precision=header["geohash_precision"], **arrays)
+
+
+def _merge_runs(runs, precs: int, geohash_precision: int):
+    """
+    Merges runs of (cell codes, ids, lats, lons) sorted by cell into a
+    grid. The stable sort keeps the order of the runs within a cell and
+    finds the runs already sorted, so it only merges them.
+    """
+    if not runs:
+        return Grid(np.empty(0, dtype=np.uint64), np.zeros(1, dtype=np.int64), np.empty(0, dtype=np.int64),
+                    np.empty(0, dtype=np.float64), np.empty(0, dtype=np.float64), precs, geohash_precision)
+    codes = np.concatenate([run[0] for run in runs])
+    order = np.argsort(codes, kind="stable")
+    codes = codes[order]
+    # one column at a time to keep the peak memory down
+    columns = []
+    for column in range(1, 4):
+        values = np.concatenate([run[column] for run in runs])
+        columns.append(values[order])
+        del values
+    del order
+
+    starts = np.flatnonzero(np.concatenate([[True], codes[1:] != codes[:-1]])) if len(codes) else np.empty(0, int)
+    cells = codes[starts]
+    offsets = np.append(starts, len(codes)).astype(np.int64)
+    return Grid(cells, offsets, *columns, precs=precs, geohash_precision=geohash_precision)
+
+
+def merge_grids(grids):
+    """
+    Merges grids built from parts of the same points, in parallel
+    workers for instance. Points of a cell keep the order of the grids.
+
+    :param  grids: list of Grid of the same precision
+    :return Grid:
+    :raise  ValueError for grids of different precisions:
+    """
+    precisions = {grid.get_precision() for grid in grids}
+    if len(precisions) > 1:
+        raise ValueError("Only grids of the same precision can be merged")
+    precs, geohash_precision = precisions.pop() if precisions else (2, 5)
+    runs = []
+    for grid in grids:
+        arrays = grid.get_arrays()
+        runs.append((np.repeat(arrays["cells"], np.diff(arrays["offsets"])),
+                     arrays["ids"], arrays["lats"], arrays["lons"]))
+    return _merge_runs(runs, precs, geohash_precision)
+
+
+def _iter_lines(path, start: int = 0, end: int = None):
+    """
+    Lines of a file which start within [start, end), the line cut by
+    start belongs to the previous range.
+    """
+    with open(path, "rb") as points_file:
+        if start > 0:
+            points_file.seek(start - 1)
+            if points_file.read(1) != b"\n":
+                points_file.readline()
+        while end is None or points_file.tell() < end:
+            line = points_file.readline()
+            if not line:
+                return
+            yield line.decode()
+
+
+def read_points(path, file_format: str = None, id_column: str = "id", lat_column: str = "lat",
+                lon_column: str = "lon", id_dtype=np.int64, chunk_size: int = CHUNK_POINTS,
+                start: int = 0, end: int = None):
+    """
+    Streams the points of a CSV file with a header line or of a
+    newline delimited json file in chunks.
+
+    :param  path:
+    :param  file_format: csv or ndjson, by default from the file extension
+    :param  id_column:
+    :param  lat_column:
+    :param  lon_column:
+    :param  id_dtype: numpy dtype of the ids
+    :param  chunk_size: points per chunk
+    :param  start: byte offset to read from, for splitting a file
+    :param  end: byte offset to stop at
+    :return generator of arrays of ids, latitudes and longitudes:
+    :raise  ValueError for an unknown format or missing columns:
+    """
+    file_format = file_format or FILE_FORMATS.get(os.path.splitext(path)[1].lower())
+    if file_format not in (FORMAT_CSV, FORMAT_NDJSON):
+        raise ValueError(f"Unknown points file format of '{path}'")
+
+    if file_format == FORMAT_CSV:
+        with open(path, "r", newline="") as points_file:
+            header = next(csv.reader(points_file), [])
+        try:
+            columns = [header.index(column) for column in (id_column, lat_column, lon_column)]
+        except ValueError:
+            raise ValueError(f"'{path}' needs the columns {id_column}, {lat_column} and {lon_column}")
+        lines = _iter_lines(path, start, end)
+        if start == 0:
+            next(lines, None)
+        rows = (row for row in csv.reader(lines) if row)
+        points = ((row[columns[0]], row[columns[1]], row[columns[2]]) for row in rows)
+    else:
+        records = (json.loads(line) for line in _iter_lines(path, start, end) if line.strip())
+        points = ((record[id_column], record[lat_column], record[lon_column]) for record in records)
+
+    while True:
+        chunk = list(itertools.islice(points, chunk_size))
+        if not chunk:
+            return
+        ids, lats, lons = zip(*chunk)
+        yield (np.array(ids).astype(id_dtype), np.array(lats, dtype=np.float64),
+               np.array(lons, dtype=np.float64))
+
+
+class GridBuilder:
+    """
+    Builds a Grid from a stream of points.
+
+    Points are encoded and sorted by cell one chunk at a time and kept
+    as columnar runs, about 32 bytes per point instead of a dict per
+    point, build() then merges the runs. Cells are the geohashes of the
+    coordinates rounded to precs decimals, like generate_grid.
+    """
+
+    def __init__(self, precs: int = 2, geohash_precision: int = 5, chunk_size: int = CHUNK_POINTS,
+                 id_dtype=np.int64) -> None:
+        self.__precs = precs
+        self.__geohash_precision = geohash_precision
+        self.__chunk_size = chunk_size
+        self.__id_dtype = id_dtype
+        self.__runs = []
+        self.__buffer = []
+
+    def add(self, ids, latitudes, longitudes):
+        """
+        Adds a chunk of points.
+
+        :param  ids: array like
+        :param  latitudes: array like
+        :param  longitudes: array like
+        :return None:
+        :raise  ValueError for arrays of different lengths:
+        """
+        ids = np.asarray(ids).astype(self.__id_dtype, copy=False).ravel()
+        latitudes = np.asarray(latitudes, dtype=np.float64).ravel()
+        longitudes = np.asarray(longitudes, dtype=np.float64).ravel()
+        if not len(ids) == len(latitudes) == len(longitudes):
+            raise ValueError("Ids, latitudes and longitudes must have the same length")
+        if not len(ids):
+            return
+        if self.__precs is None:
+            codes = encode_codes(latitudes, longitudes, self.__geohash_precision)
+        else:
+            codes = encode_codes(np.round(latitudes, self.__precs), np.round(longitudes, self.__precs),
+                                 self.__geohash_precision)
+        order = np.argsort(codes, kind="stable")
+        self.__runs.append((codes[order], ids[order], latitudes[order], longitudes[order]))
+
+    def add_points(self, points):
+        """
+        Adds points from an iterable, buffered into chunks.
+
+        :param  points: iterable of (id, lat, lon)
+        :return None:
+        """
+        for point in points:
+            self.__buffer.append(point)
+            if len(self.__buffer) >= self.__chunk_size:
+                self._flush()
+
+    def _flush(self):
+        if self.__buffer:
+            ids, lats, lons = zip(*self.__buffer)
+            self.__buffer = []
+            self.add(np.array(ids), lats, lons)
+
+    def add_file(self, path, **options):
+        """
+        Adds the points of a CSV or NDJSON file, see read_points.
+
+        :param  path:
+        :param  options: passed to read_points
+        :return None:
+        """
+        options.setdefault("id_dtype", self.__id_dtype)
+        options.setdefault("chunk_size", self.__chunk_size)
+        for ids, lats, lons in read_points(path, **options):
+            self.add(ids, lats, lons)
+
+    def build(self):
+        """
+        Merges the points added so far into a grid, the builder is
+        empty afterwards.
+
+        :return Grid:
+        """
+        self._flush()
+        runs, self.__runs = self.__runs, []
+        return _merge_runs(runs, self.__precs, self.__geohash_precision)
+
+
+def _build_file_range(task):
+    # runs in a worker process, see build_grid
+    path, start, end, builder_options, read_options = task
+    builder = GridBuilder(**builder_options)
+    builder.add_file(path, start=start, end=end, **read_options)
+    return builder.build()
+
+
+def build_grid(path, workers: int = None, precs: int = 2, geohash_precision: int = 5,
+               chunk_size: int = CHUNK_POINTS, id_dtype=np.int64, **read_options):
+    """
+    Builds the grid of a CSV or NDJSON file of points, the file is split
+    into byte ranges which worker processes turn into partial grids
+    which are then merged.
+
+    :param  path:
+    :param  workers: processes, by default one per cpu
+    :param  precs: decimals coordinates are rounded to
+    :param  geohash_precision: geohash characters of a cell
+    :param  chunk_size: points per chunk
+    :param  id_dtype: numpy dtype of the ids
+    :param  read_options: passed to read_points, e.g. id_column
+    :return Grid:
+    """
+    builder_options = {"precs": precs, "geohash_precision": geohash_precision, "chunk_size": chunk_size,
+                       "id_dtype": id_dtype}
+    workers = workers or os.cpu_count() or 1
+    size = os.path.getsize(path)
+    if workers <= 1:
+        return _build_file_range((path, 0, None, builder_options, read_options))
+    bounds = [size * part // workers for part in range(workers + 1)]
+    tasks = [(path, bounds[part], bounds[part + 1], builder_options, read_options) for part in range(workers)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return merge_grids(list(executor.map(_build_file_range, tasks)))
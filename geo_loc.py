@@ -1,6 +1,34 @@
+import math
+import threading
+
+import numpy as np
+
 base32 = "ABCDEFGHIJKLMNOPQRSTUVWXYZ234567"
 decode_map = {base32[i]: i for i in range(len(base32))}
 
+# Lookup tables of the batch functions, character code <-> 5-bit value.
+# Code points are uint32 so they can be viewed as numpy unicode strings.
+base32_codes = np.frombuffer(base32.encode(), dtype=np.uint8).astype(np.uint32)
+decode_table = np.full(256, -1, dtype=np.int16)
+decode_table[base32_codes] = np.arange(len(base32))
+
+# A geohash of the batch functions is kept in one 64-bit Morton code
+MAX_BATCH_PRECISION = 12
+
+# GeoIndex keeps points sorted by their Morton code at the full batch
+# precision, a cell of any coarser size is a contiguous range of codes
+CODE_BITS = 5 * MAX_BATCH_PRECISION
+
+# Mean earth radius, distances are haversine distances in meters
+EARTH_RADIUS = 6371008.8
+
+# Points inserted into a GeoIndex are buffered and merged into the
+# sorted arrays in batches of this size
+MAX_PENDING_POINTS = 4096
+
+# A bounding box query looks up at most this many cells
+MAX_COVER_CELLS = 16
+
 
 def encode(latitude, longitude, precs: int = 5):
     """
@@ -72,6 +100,202 @@ def decode(geohash):
     return (lat_int[0] + lat_int[1]) / 2, (lon_int[0] + lon_int[1]) / 2
 
 
+def _spread_bits(values):
+    # moves bit i of a 32-bit value to bit 2i
+    values = values.astype(np.uint64) & np.uint64(0xFFFFFFFF)
+    for shift, mask in ((16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF), (4, 0x0F0F0F0F0F0F0F0F),
+                        (2, 0x3333333333333333), (1, 0x5555555555555555)):
+        values = (values | (values << np.uint64(shift))) & np.uint64(mask)
+    return values
+
+
+def _compact_bits(values):
+    # inverse of _spread_bits, moves bit 2i to bit i
+    values = values & np.uint64(0x5555555555555555)
+    for shift, mask in ((1, 0x3333333333333333), (2, 0x0F0F0F0F0F0F0F0F), (4, 0x00FF00FF00FF00FF),
+                        (8, 0x0000FFFF0000FFFF), (16, 0x00000000FFFFFFFF)):
+        values = (values | (values >> np.uint64(shift))) & np.uint64(mask)
+    return values
+
+
+def _split_bits(bits: int):
+    # longitude takes the first bit, so the odd bit when there is one
+    return bits - bits // 2, bits // 2
+
+
+def _interleave(lon_index, lat_index, bits: int):
+    # Morton code of cells, the first of the bits is a longitude bit
+    lon_bits, lat_bits = _split_bits(bits)
+    if lon_bits == lat_bits:
+        return (_spread_bits(lon_index) << np.uint64(1)) | _spread_bits(lat_index)
+    return _spread_bits(lon_index) | (_spread_bits(lat_index) << np.uint64(1))
+
+
+def _deinterleave(codes, bits: int):
+    lon_bits, lat_bits = _split_bits(bits)
+    if lon_bits == lat_bits:
+        return _compact_bits(codes >> np.uint64(1)), _compact_bits(codes)
+    return _compact_bits(codes), _compact_bits(codes >> np.uint64(1))
+
+
+def _quantize(values, low: float, high: float, bits: int):
+    """
+    Index of the interval a value falls in when [low, high] is halved
+    bits times, the way encode() does it: a value equal to a midpoint
+    goes to the lower half.
+    """
+    cells = 1 << bits
+    width = (high - low) / cells
+    index = np.floor((values - low) / width)
+    index = np.nan_to_num(index, nan=0.0)
+    index = np.clip(index, 0, cells - 1).astype(np.int64)
+    # the float estimate can be one cell off next to a boundary, the
+    # boundaries themselves are exact dyadic numbers
+    lower = low + index * width
+    index -= ((values <= lower) & (index > 0)).astype(np.int64)
+    upper = low + (index + 1) * width
+    index += ((values > upper) & (index < cells - 1)).astype(np.int64)
+    return index.astype(np.uint64)
+
+
+def _quantize_value(value: float, low: float, high: float, bits: int):
+    # _quantize() of a single value without the numpy overhead
+    cells = 1 << bits
+    width = (high - low) / cells
+    index = min(max(math.floor((value - low) / width), 0), cells - 1)
+    if value <= low + index * width and index > 0:
+        index -= 1
+    if value > low + (index + 1) * width and index < cells - 1:
+        index += 1
+    return index
+
+
+def _encode_code(latitude: float, longitude: float, bits: int):
+    # _encode_codes() of a single point without the numpy overhead
+    lon_bits, lat_bits = _split_bits(bits)
+    lon_index = _quantize_value(longitude, -180.0, 180.0, lon_bits)
+    lat_index = _quantize_value(latitude, -90.0, 90.0, lat_bits)
+    code = 0
+    for bit in range(bits):
+        if bit % 2 == 0:
+            code = (code << 1) | ((lon_index >> (lon_bits - 1 - bit // 2)) & 1)
+        else:
+            code = (code << 1) | ((lat_index >> (lat_bits - 1 - bit // 2)) & 1)
+    return code
+
+
+def _encode_codes(latitudes, longitudes, bits: int):
+    lon_bits, lat_bits = _split_bits(bits)
+    return _interleave(_quantize(longitudes, -180.0, 180.0, lon_bits),
+                       _quantize(latitudes, -90.0, 90.0, lat_bits), bits)
+
+
+def encode_codes(latitudes, longitudes, precs: int = 5):
+    """
+    The geohashes of encode_many() as integers, the 5-bit characters
+    packed into a Morton code. Codes sort like their geohashes.
+
+    :param  latitudes: array like
+    :param  longitudes: array like of the same shape
+    :param  precs: 1 to MAX_BATCH_PRECISION characters
+    :return numpy uint64 array:
+    :raise  ValueError for an unsupported precision or mismatched shapes:
+    """
+    if not 0 < precs <= MAX_BATCH_PRECISION:
+        raise ValueError(f"Precision must be between 1 and {MAX_BATCH_PRECISION}")
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    if latitudes.shape != longitudes.shape:
+        raise ValueError("Latitudes and longitudes must have the same shape")
+    return _encode_codes(latitudes.ravel(), longitudes.ravel(), 5 * precs).reshape(latitudes.shape)
+
+
+def format_geohashes(codes, precs: int = 5):
+    """
+    :param  codes: geohash codes as returned by encode_codes()
+    :param  precs: precision the codes were encoded with
+    :return numpy array of str:
+    """
+    codes = np.asarray(codes, dtype=np.uint64)
+    characters = np.empty((codes.size, precs), dtype=np.uint32)
+    for column in range(precs):
+        shift = np.uint64(5 * (precs - 1 - column))
+        characters[:, column] = base32_codes[((codes.ravel() >> shift) & np.uint64(31)).astype(np.intp)]
+    return characters.view(f"U{precs}").reshape(codes.shape)
+
+
+def parse_geohash(geohash):
+    """
+    :param  geohash:
+    :return int, the code of the geohash:
+    :raise  KeyError for a character outside the geohash alphabet:
+    """
+    code = 0
+    for c in geohash:
+        code = (code << 5) | decode_map[c]
+    return code
+
+
+def encode_many(latitudes, longitudes, precs: int = 5):
+    """
+    Encodes arrays of latitudes and longitudes, giving the same geohashes
+    as encode() for every point. The interval halving of each coordinate
+    is a single quantization and the bits are interleaved into a Morton
+    code instead of walking one bit at a time.
+
+    :param  latitudes: array like
+    :param  longitudes: array like of the same shape
+    :param  precs: 1 to MAX_BATCH_PRECISION characters
+    :return numpy array of str:
+    :raise  ValueError for an unsupported precision or mismatched shapes:
+    """
+    return format_geohashes(encode_codes(latitudes, longitudes, precs), precs)
+
+
+def decode_many(geohashes):
+    """
+    Decodes an array of geohashes, giving the same (lat, lon) as decode()
+    for every geohash. Geohashes of different lengths may be mixed.
+
+    :param  geohashes: array like of str
+    :return two numpy float64 arrays, latitudes and longitudes:
+    :raise  KeyError for a character outside the geohash alphabet,
+            ValueError for geohashes longer than MAX_BATCH_PRECISION:
+    """
+    geohashes = np.asarray(geohashes)
+    if geohashes.dtype.kind != "U":
+        geohashes = geohashes.astype(str)
+    shape = geohashes.shape
+    # the code points of the strings, padded with zeros to the widest one
+    width = max(geohashes.dtype.itemsize // 4, 1)
+    points = np.ascontiguousarray(geohashes.ravel()).view(np.uint32).reshape(-1, width)
+    lengths = np.count_nonzero(points, axis=1)
+    latitudes = np.zeros(len(points), dtype=np.float64)
+    longitudes = np.zeros(len(points), dtype=np.float64)
+
+    for precs in np.unique(lengths):
+        precs = int(precs)
+        if precs == 0:
+            continue
+        if precs > MAX_BATCH_PRECISION:
+            raise ValueError(f"Precision must be between 1 and {MAX_BATCH_PRECISION}")
+        selected = np.flatnonzero(lengths == precs)
+        characters = points[selected, :precs]
+        digits = decode_table[np.where(characters < 256, characters, 0)]
+        if (digits < 0).any():
+            raise KeyError(chr(characters[digits < 0][0]))
+        codes = np.zeros(len(selected), dtype=np.uint64)
+        for column in range(precs):
+            codes = (codes << np.uint64(5)) | digits[:, column].astype(np.uint64)
+
+        lon_bits, lat_bits = _split_bits(5 * precs)
+        lon_index, lat_index = _deinterleave(codes, 5 * precs)
+        # the centre of the cell, exact like the midpoint decode() takes
+        longitudes[selected] = (2 * lon_index.astype(np.float64) + 1) * (360.0 / (1 << (lon_bits + 1))) - 180.0
+        latitudes[selected] = (2 * lat_index.astype(np.float64) + 1) * (180.0 / (1 << (lat_bits + 1))) - 90.0
+    return latitudes.reshape(shape), longitudes.reshape(shape)
+
+
 def generate_grid(_points: dict, precs: int = 2):
     """
     It generates a grid containing all the points within
@@ -79,22 +303,468 @@ def generate_grid(_points: dict, precs: int = 2):
 
     precision = 2 means 5 - 10km on earth surface
 
+    Every point is kept as its own dict, for inputs that do not fit in
+    memory use geo_grid.GridBuilder or geo_grid.build_grid.
+
     :param  _points:
     :param  precs:
     :return dict:
     """
     _grid = {}
-    for key, val in _points.items():
-        # Quantize latitude and longitude to 1km grid cells
-        grid_lat = round(val[0], precs)  # round to 3 decimal places (approximately 1km resolution)
-        grid_lon = round(val[1], precs)
+    if not _points:
+        return _grid
+    # Quantize latitude and longitude to grid cells, the rounding of
+    # round() is kept so cells stay the same as before
+    grid_lats = [round(val[0], precs) for val in _points.values()]
+    grid_lons = [round(val[1], precs) for val in _points.values()]
 
-        # Create a geohash based on the quantized grid cell
-        geohash = encode(grid_lat, grid_lon)
+    # Create the geohashes of all the quantized grid cells at once
+    geohashes = encode_many(grid_lats, grid_lons).tolist()
+    for (key, val), geohash in zip(_points.items(), geohashes):
         # Add the point to the grid cell
         if geohash not in _grid:
-          
             _grid[geohash] = []
         _grid[geohash].append({key: (val[0], val[1])})
 
     return _grid
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """
+    Great circle distance, works on scalars and numpy arrays.
+
+    :param  lat1:
+    :param  lon1:
+    :param  lat2:
+    :param  lon2:
+    :return distance in meters:
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def _get_neighbor_cells(lon_index: int, lat_index: int, bits: int):
+    """
+    The cell and its up to 8 neighbours, longitude wraps around the
+    antimeridian while there is nothing beyond the poles.
+
+    :return list of (lon index, lat index):
+    """
+    lon_bits, lat_bits = _split_bits(bits)
+    cells = []
+    for lat_step in (-1, 0, 1):
+        lat = lat_index + lat_step
+        if not 0 <= lat < 1 << lat_bits:
+            continue
+        for lon_step in (-1, 0, 1):
+            cell = ((lon_index + lon_step) % (1 << lon_bits), lat)
+            if cell not in cells:
+                cells.append(cell)
+    return cells
+
+
+def neighbors(geohash):
+    """
+    The geohashes of the cells around a geohash.
+
+    :param  geohash:
+    :return list of up to 8 geohashes of the same precision:
+    """
+    precs = len(geohash)
+    code = parse_geohash(geohash)
+    lon_index, lat_index = _deinterleave(np.array([code], dtype=np.uint64), 5 * precs)
+    cells = _get_neighbor_cells(int(lon_index[0]), int(lat_index[0]), 5 * precs)
+    cells.remove((int(lon_index[0]), int(lat_index[0])))
+    codes = _interleave(np.array([cell[0] for cell in cells], dtype=np.uint64),
+                        np.array([cell[1] for cell in cells], dtype=np.uint64), 5 * precs)
+    return ["".join(base32[(int(code) >> (5 * (precs - 1 - i))) & 31] for i in range(precs)) for code in codes]
+
+
+def get_covering_geohashes(latitude: float, longitude: float, radius: float, precs: int):
+    """
+    The geohashes which a circle overlaps, the cell of its centre and
+    those of the neighbouring cells reaching into the circle.
+
+    :param  latitude:
+    :param  longitude:
+    :param  radius: meters
+    :param  precs:
+    :return list of geohashes, None when the circle is larger than the
+            cells around its centre:
+    """
+    angle = radius / EARTH_RADIUS
+    lat_span = math.degrees(angle)
+    if abs(latitude) + lat_span >= 90.0:
+        return None
+    lon_span = math.degrees(math.asin(min(math.sin(angle) / math.cos(math.radians(latitude)), 1.0)))
+    lon_bits, lat_bits = _split_bits(5 * precs)
+    width, height = 360.0 / (1 << lon_bits), 180.0 / (1 << lat_bits)
+    if lon_span > width or lat_span > height:
+        return None
+    geohash = encode(latitude, longitude, precs)
+    geohashes = [geohash]
+    for neighbor in neighbors(geohash):
+        lat, lon = decode(neighbor)
+        lon_distance = abs((lon - longitude + 180.0) % 360.0 - 180.0)
+        if abs(lat - latitude) <= height / 2 + lat_span and lon_distance <= width / 2 + lon_span:
+            geohashes.append(neighbor)
+    return geohashes
+
+
+class GeoIndex:
+    """
+    Spatial index of keyed points.
+
+    Points are kept in numpy arrays sorted by the Morton code of their
+    geohash at full precision, so every geohash cell, whatever its size,
+    is a contiguous slice found by binary search. A query looks up a
+    handful of cells around the searched area and filters the points in
+    them exactly. Inserts are buffered and merged in batches, deletes
+    only mark a point dead until enough of them are compacted away.
+    Keys are kept in a list the sorted arrays refer to by slot, so the
+    arrays stay numeric.
+    """
+
+    def __init__(self) -> None:
+        self.__lock = threading.RLock()
+        self.__codes = np.empty(0, dtype=np.uint64)
+        self.__lats = np.empty(0, dtype=np.float64)
+        self.__lons = np.empty(0, dtype=np.float64)
+        self.__slots = np.empty(0, dtype=np.int64)
+        self.__alive = np.empty(0, dtype=bool)
+        self.__keys = []
+        self.__dead = 0
+        # key -> Morton code of its live point
+        self.__locations = {}
+        # points not merged yet, kept unsorted
+        self.__pending_codes = np.empty(MAX_PENDING_POINTS, dtype=np.uint64)
+        self.__pending_lats = np.empty(MAX_PENDING_POINTS, dtype=np.float64)
+        self.__pending_lons = np.empty(MAX_PENDING_POINTS, dtype=np.float64)
+        self.__pending_keys = []
+        self.__pending_index = {}
+
+    def __len__(self):
+        return len(self.__locations)
+
+    def __contains__(self, key):
+        return key in self.__locations
+
+    def insert(self, key, latitude: float, longitude: float):
+        """
+        Adds a point, replacing the point of the key if there is one.
+
+        :param  key:
+        :param  latitude:
+        :param  longitude:
+        :return None:
+        :raise  ValueError for coordinates outside of the globe:
+        """
+        if not (abs(latitude) <= 90 and abs(longitude) <= 180):
+            raise ValueError("Latitudes must be within [-90, 90] and longitudes within [-180, 180]")
+        with self.__lock:
+            self._insert_pending(key, _encode_code(latitude, longitude, CODE_BITS), latitude, longitude)
+
+    def insert_many(self, keys, latitudes, longitudes):
+        """
+        Adds many points at once, the last point of a key given more
+        than once wins.
+
+        :param  keys: sequence of keys
+        :param  latitudes: array like
+        :param  longitudes: array like
+        :return None:
+        :raise  ValueError for coordinates outside of the globe:
+        """
+        keys = list(keys)
+        latitudes = np.asarray(latitudes, dtype=np.float64).ravel()
+        longitudes = np.asarray(longitudes, dtype=np.float64).ravel()
+        if not len(keys) == len(latitudes) == len(longitudes):
+            raise ValueError("Keys, latitudes and longitudes must have the same length")
+        if not ((np.abs(latitudes) <= 90) & (np.abs(longitudes) <= 180)).all():
+            raise ValueError("Latitudes must be within [-90, 90] and longitudes within [-180, 180]")
+        codes = _encode_codes(latitudes, longitudes, CODE_BITS)
+        with self.__lock:
+            if len(keys) < MAX_PENDING_POINTS:
+                for key, code, lat, lon in zip(keys, codes.tolist(), latitudes.tolist(), longitudes.tolist()):
+                    self._insert_pending(key, code, lat, lon)
+                return
+
+            # a bulk load skips the buffer
+            last = dict(zip(keys, range(len(keys))))
+            if len(last) < len(keys):
+                selected = np.fromiter(last.values(), dtype=np.intp, count=len(last))
+                keys, codes = list(last), codes[selected]
+                latitudes, longitudes = latitudes[selected], longitudes[selected]
+            for key in keys:
+                if key in self.__locations:
+                    self._remove(key)
+            self.__locations.update(zip(keys, codes.tolist()))
+            self._merge(codes, latitudes, longitudes, keys)
+
+    def _insert_pending(self, key, code: int, latitude: float, longitude: float):
+        if key in self.__locations:
+            self._remove(key)
+        position = len(self.__pending_keys)
+        self.__pending_codes[position] = code
+        self.__pending_lats[position] = latitude
+        self.__pending_lons[position] = longitude
+        self.__pending_keys.append(key)
+        self.__pending_index[key] = position
+        self.__locations[key] = code
+        if len(self.__pending_keys) == MAX_PENDING_POINTS:
+            self._merge()
+
+    def delete(self, key):
+        """
+        :param  key:
+        :return bool, if the key had a point:
+        """
+        with self.__lock:
+            if key not in self.__locations:
+                return False
+            self._remove(key)
+            if self.__dead > MAX_PENDING_POINTS and self.__dead * 2 > len(self.__codes):
+                self._merge()
+            return True
+
+    def get_location(self, key):
+        """
+        :param  key:
+        :return (lat, lon) or None:
+        """
+        with self.__lock:
+            if key not in self.__locations:
+                return None
+            if key in self.__pending_index:
+                position = self.__pending_index[key]
+                return float(self.__pending_lats[position]), float(self.__pending_lons[position])
+            position = self._find(key, self.__locations[key])
+            return float(self.__lats[position]), float(self.__lons[position])
+
+    def _find(self, key, code: int):
+        code = np.uint64(code)
+        low = np.searchsorted(self.__codes, code, "left")
+        high = np.searchsorted(self.__codes, code, "right")
+        for position in range(low, high):
+            if self.__alive[position] and self.__keys[self.__slots[position]] == key:
+                return position
+        return None
+
+    def _remove(self, key):
+        code = self.__locations.pop(key)
+        position = self.__pending_index.pop(key, None)
+        if position is not None:
+            # the last buffered point takes the place of the removed one
+            last = len(self.__pending_keys) - 1
+            if position != last:
+                moved = self.__pending_keys[last]
+                self.__pending_codes[position] = self.__pending_codes[last]
+                self.__pending_lats[position] = self.__pending_lats[last]
+                self.__pending_lons[position] = self.__pending_lons[last]
+                self.__pending_keys[position] = moved
+                self.__pending_index[moved] = position
+            self.__pending_keys.pop()
+            return
+        position = self._find(key, code)
+        self.__alive[position] = False
+        self.__keys[self.__slots[position]] = None
+        self.__dead += 1
+
+    def _merge(self, codes=None, latitudes=None, longitudes=None, keys=None):
+        """
+        Merges the buffered points, and the given ones, into the sorted
+        arrays and drops dead points when they make up half of them.
+        """
+        pending = len(self.__pending_keys)
+        if pending:
+            pending_codes = self.__pending_codes[:pending].copy()
+            pending_lats = self.__pending_lats[:pending].copy()
+            pending_lons = self.__pending_lons[:pending].copy()
+            if codes is None:
+                codes, latitudes, longitudes, keys = pending_codes, pending_lats, pending_lons, self.__pending_keys
+            else:
+                codes = np.concatenate([codes, pending_codes])
+                latitudes = np.concatenate([latitudes, pending_lats])
+                longitudes = np.concatenate([longitudes, pending_lons])
+                keys = keys + self.__pending_keys
+            self.__pending_keys = []
+            self.__pending_index = {}
+
+        if self.__dead * 2 > len(self.__codes):
+            alive = self.__alive
+            self.__codes, self.__lats, self.__lons = self.__codes[alive], self.__lats[alive], self.__lons[alive]
+            self.__keys = [self.__keys[slot] for slot in self.__slots[alive].tolist()]
+            self.__slots = np.arange(len(self.__keys), dtype=np.int64)
+            self.__alive = np.ones(len(self.__keys), dtype=bool)
+            self.__dead = 0
+        if codes is None or not len(codes):
+            return
+
+        slots = np.arange(len(self.__keys), len(self.__keys) + len(keys), dtype=np.int64)
+        self.__keys.extend(keys)
+        order = np.argsort(codes, kind="stable")
+        codes, latitudes, longitudes, slots = codes[order], latitudes[order], longitudes[order], slots[order]
+        positions = np.searchsorted(self.__codes, codes, "right")
+        self.__codes = np.insert(self.__codes, positions, codes)
+        self.__lats = np.insert(self.__lats, positions, latitudes)
+        self.__lons = np.insert(self.__lons, positions, longitudes)
+        self.__slots = np.insert(self.__slots, positions, slots)
+        self.__alive = np.insert(self.__alive, positions, True)
+
+    def _get_candidates(self, cells, bits: int):
+        """
+        The live points within cells. Buffered points are referred to by
+        negative references, -1 being the first of them.
+
+        :param  cells: list of (lon index, lat index)
+        :param  bits: size of the cells
+        :return arrays of references, latitudes and longitudes:
+        """
+        prefixes = _interleave(np.array([cell[0] for cell in cells], dtype=np.uint64),
+                               np.array([cell[1] for cell in cells], dtype=np.uint64), bits)
+        shift = np.uint64(CODE_BITS - bits)
+        low_codes, high_codes = prefixes << shift, (prefixes + np.uint64(1)) << shift
+        lows = np.searchsorted(self.__codes, low_codes, "left")
+        highs = np.searchsorted(self.__codes, high_codes, "left")
+        positions = [np.arange(low, high) for low, high in zip(lows, highs) if high > low]
+        positions = np.concatenate(positions) if positions else np.empty(0, dtype=np.intp)
+        positions = positions[self.__alive[positions]]
+        references, lats, lons = self.__slots[positions], self.__lats[positions], self.__lons[positions]
+
+        pending = len(self.__pending_keys)
+        if pending:
+            pending_codes = self.__pending_codes[:pending]
+            inside = np.zeros(pending, dtype=bool)
+            for low_code, high_code in zip(low_codes, high_codes):
+                inside |= (pending_codes >= low_code) & (pending_codes < high_code)
+            positions = np.flatnonzero(inside)
+            references = np.concatenate([references, -1 - positions])
+            lats = np.concatenate([lats, self.__pending_lats[positions]])
+            lons = np.concatenate([lons, self.__pending_lons[positions]])
+        return references, lats, lons
+
+    def _get_keys(self, references):
+        return [self.__keys[reference] if reference >= 0 else self.__pending_keys[-1 - reference]
+                for reference in references.tolist()]
+
+    @staticmethod
+    def _get_box_cells(min_lat: float, min_lon: float, max_lat: float, max_lon: float):
+        # the finest cells covering the box with at most MAX_COVER_CELLS
+        # of them, with the cell size of the box as a starting point
+        lat_span, lon_span = max(max_lat - min_lat, 1e-12), max(max_lon - min_lon, 1e-12)
+        lat_bits = max(int(math.log2(180.0 / lat_span)), 0)
+        lon_bits = max(int(math.log2(360.0 / lon_span)), 0)
+        bits = min(2 * lon_bits, 2 * lat_bits + 1, CODE_BITS - 2) + 2
+        while True:
+            lon_bits, lat_bits = _split_bits(bits)
+            lon_low = _quantize_value(min_lon, -180.0, 180.0, lon_bits)
+            lon_high = _quantize_value(max_lon, -180.0, 180.0, lon_bits)
+            lat_low = _quantize_value(min_lat, -90.0, 90.0, lat_bits)
+            lat_high = _quantize_value(max_lat, -90.0, 90.0, lat_bits)
+            if bits == 0 or (lon_high - lon_low + 1) * (lat_high - lat_low + 1) <= MAX_COVER_CELLS:
+                break
+            bits -= 1
+        cells = [(lon, lat) for lon in range(lon_low, lon_high + 1) for lat in range(lat_low, lat_high + 1)]
+        return cells, bits
+
+    def _query_box(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float):
+        references, lats, lons = self._get_candidates(*self._get_box_cells(min_lat, min_lon, max_lat, max_lon))
+        inside = (lats >= min_lat) & (lats <= max_lat) & (lons >= min_lon) & (lons <= max_lon)
+        return list(zip(self._get_keys(references[inside]), lats[inside].tolist(), lons[inside].tolist()))
+
+    def query_box(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float):
+        """
+        Points within a bounding box, a box with min_lon > max_lon
+        crosses the antimeridian.
+
+        :param  min_lat:
+        :param  min_lon:
+        :param  max_lat:
+        :param  max_lon:
+        :return list of (key, lat, lon):
+        """
+        with self.__lock:
+            if min_lon <= max_lon:
+                return self._query_box(min_lat, min_lon, max_lat, max_lon)
+            return self._query_box(min_lat, min_lon, max_lat, 180.0) + \
+                self._query_box(min_lat, -180.0, max_lat, max_lon)
+
+    def _get_radius_candidates(self, latitude: float, longitude: float, radius: float):
+        angle = radius / EARTH_RADIUS
+        lat_span = math.degrees(angle)
+        if abs(latitude) + lat_span >= 90.0:
+            # the circle holds a pole, so every longitude
+            return self._get_candidates(*self._get_box_cells(max(latitude - lat_span, -90.0), -180.0,
+                                                              min(latitude + lat_span, 90.0), 180.0))
+        # the widest longitude span of the circle, the cell of the centre
+        # and its 8 neighbours cover the circle once a cell is as large
+        lon_span = math.degrees(math.asin(min(math.sin(angle) / math.cos(math.radians(latitude)), 1.0)))
+        bits = CODE_BITS
+        while bits > 0:
+            lon_bits, lat_bits = _split_bits(bits)
+            if 360.0 / (1 << lon_bits) >= lon_span and 180.0 / (1 << lat_bits) >= lat_span:
+                break
+            bits -= 1
+        return self._get_neighborhood(latitude, longitude, bits)
+
+    def _get_neighborhood(self, latitude: float, longitude: float, bits: int):
+        lon_bits, lat_bits = _split_bits(bits)
+        cells = _get_neighbor_cells(_quantize_value(longitude, -180.0, 180.0, lon_bits),
+                                    _quantize_value(latitude, -90.0, 90.0, lat_bits), bits)
+        return self._get_candidates(cells, bits)
+
+    def query_radius(self, latitude: float, longitude: float, radius: float):
+        """
+        Points within a distance of a location.
+
+        :param  latitude:
+        :param  longitude:
+        :param  radius: meters
+        :return list of (key, lat, lon, distance) by distance:
+        """
+        with self.__lock:
+            references, lats, lons = self._get_radius_candidates(latitude, longitude, radius)
+            distances = haversine(latitude, longitude, lats, lons)
+            inside = np.flatnonzero(distances <= radius)
+            inside = inside[np.argsort(distances[inside], kind="stable")]
+            return list(zip(self._get_keys(references[inside]), lats[inside].tolist(),
+                            lons[inside].tolist(), distances[inside].tolist()))
+
+    def query_nearest(self, latitude: float, longitude: float, count: int = 1):
+        """
+        The points nearest to a location.
+
+        The neighbourhood of the location is grown until it holds count
+        points, the distance of the farthest of them then bounds a
+        radius query which returns the exact nearest points.
+
+        :param  latitude:
+        :param  longitude:
+        :param  count:
+        :return list of (key, lat, lon, distance) by distance:
+        """
+        with self.__lock:
+            if count <= 0 or not self.__locations:
+                return []
+            # the cell size which would hold count points around the
+            # location if points were spread evenly, and a bit finer
+            bits = min(int(math.log2(9 * len(self.__locations) / count)) + 2, CODE_BITS)
+            while True:
+                references, lats, lons = self._get_neighborhood(latitude, longitude, bits)
+                if len(references) >= count or bits == 0:
+                    break
+                bits = max(bits - 2, 0)
+            distances = haversine(latitude, longitude, lats, lons)
+            if len(distances) >= count:
+                bound = float(np.partition(distances, count - 1)[count - 1])
+            else:
+                bound = math.pi * EARTH_RADIUS
+            return self.query_radius(latitude, longitude, bound)[:count]
+
+    def get_stats(self):
+        """
+        :return dict with the number of points and the buffered and dead ones:
+        """
+        with self.__lock:
+            return {"points": len(self.__locations), "pending": len(self.__pending_keys), "dead": self.__dead}
@@ -1,18 +1,106 @@
+import argparse
+import atexit
 import collections
 import datetime
 import aiofiles
+import numpy as np
 import logging
+import logging.handlers
 import os
-import io
 import shutil
 import hashlib
 import uuid
 import asyncio
 import json
-
-from flask import Flask, request, jsonify, send_file, make_response
-
-# import reedsolo
+import math
+import base64
+import bisect
+import functools
+import threading
+import time
+import queue
+import contextlib
+
+from flask import Flask, request, jsonify, send_file, make_response, Response, g
+from werkzeug.http import parse_range_header
+
+from object_index import (ObjectIndex, LAYOUT_FILE, LAYOUT_CHUNKED, LAYOUT_PACKED, LAYOUT_ERASURE,
+                          MANIFEST_FILE_NAME, SHARDS_FILE_NAME, parse_query_value)
+from chunk_store import ChunkStore, ChunkedObjectWriter
+from erasure import ErasureStore, DATA_SHARDS, PARITY_SHARDS
+from segment_store import (SegmentStore, SEGMENTS_DIR_NAME, RECORD_PUT, RECORD_HEADER,
+                           COMPACTION_GARBAGE_RATIO)
+from wal import WriteAheadLog, DURABILITY_SYNC, fsync_path
+from merkle import MerkleTree, get_key_point
+from geo_loc import GeoIndex, encode
+from metrics import (REGISTRY, CONTENT_TYPE, COUNTER, GAUGE, RING_LOOKUPS, DISK_WRITE_DURATION,
+                     DISK_FSYNC_DURATION, HTTP_REQUESTS_IN_FLIGHT, record_request)
+from tracing import Tracer, span, traced_aiter
+from profiler import sample_stacks, format_collapsed, ProfilerBusyException, PROFILE_INTERVAL
+from compression import (get_codecs, get_compressor, compress, iter_decompressed, accepts_encoding,
+                         CONTENT_ENCODINGS, UnknownCodecException)
+
+# Size of the blocks read from an upload stream and written to disk,
+# keeps the memory used per upload bounded regardless of object size.
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Size of the blocks read from disk when streaming byte ranges
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+
+# Write-ahead log of the bucket mutations, and the snapshot of the
+# bucket meta data written at every checkpoint
+WAL_FILE_NAME = ".wal.log"
+BUCKET_META_DATA_FILE_NAME = ".bucket_meta_data.json"
+
+# Logged mutations after which the write-ahead log is checkpointed
+WAL_CHECKPOINT_RECORDS = 10_000
+
+# Logged puts of objects up to this size are read back and checked
+# against their digest by recovery, larger ones only by their size
+RECOVERY_VERIFY_MAX_SIZE = 64 * 1024 * 1024
+
+# Log files kept open by the background log writer
+MAX_OPEN_LOG_FILES = 64
+
+# Entries of the object cache and the largest object it holds
+CACHE_MAX_ENTRIES = 100_000
+CACHE_MAX_OBJECT_SIZE = 4 * 1024 * 1024
+
+# Virtual nodes per node of weight 1 on the consistent hashing ring
+VIRTUAL_NODES = 256
+
+# Seconds between two background compactions of packed segments
+COMPACTION_INTERVAL = 60.0
+
+# Part numbers accepted by multipart uploads
+MAX_PART_NUMBER = 10_000
+
+# Largest page returned by a single object listing
+MAX_LIST_LIMIT = 1000
+
+# Request headers carrying user metadata of an upload, X-Meta-Customer: X
+# is stored as {"customer": "X"} and can be queried through /query
+USER_META_DATA_HEADER_PREFIX = "x-meta-"
+
+# Metadata the bucket writes itself, user metadata never overrides it
+RESERVED_META_DATA_KEYS = ("uuid", "object name", "bucket_name", "object_type", "size", "sha256",
+                           "compression", "compressed_size")
+
+# Metadata taken from the request or derived from X-Meta-Lat and X-Meta-Lon,
+# X-Meta headers may not set it
+RESERVED_USER_META_DATA_KEYS = RESERVED_META_DATA_KEYS + ("type", "content_type", "geohash")
+
+# Uploads with X-Meta-Lat and X-Meta-Lon are geo-tagged, the geohash of
+# this precision (about 4 cm) is stored with them for prefix queries
+GEOHASH_PRECISION = 12
+
+# Range headers with more parts than this are ignored and the
+# full object is served, guards against range amplification
+MAX_BYTE_RANGES = 64
+
+# Sampled request traces are appended to this file in the working
+# directory unless DATADEPOT_TRACE_FILE names another one
+TRACE_FILE_NAME = "trace.json"
 
 
 class NullException(Exception):
@@ -39,33 +127,46 @@ class NullFileException(Exception):
     """Exception thrown when null files are passed"""
 
 
-# class ReedSolomonEncoder:
-#     def __init__(self, data_shards, parity_shards):
-#         """
-#         Implements the Reed Solomon Codec
-#
-#         :param data_shards:
-#         :param parity_shards:
-#         """
-#         self.data_shards = data_shards
-#         self.parity_shards = parity_shards
-#         self.encoder = reedsolo.RSCodec(self.parity_shards)
-#
-#     def encode(self, data):
-#         """
-#         :param data:
-#         :return encoded_data:
-#         """
-#         encoded_data = self.encoder.encode(data)
-#         return encoded_data
-#
-#     def decode(self, encoded_data):
-#         """
-#         :param encoded_data:
-#         :return decoded data:
-#         """
-#         decoded_data = self.encoder.decode(encoded_data)
-#         return b''.join(decoded_data)
+class UploadNotFoundException(NotFoundException):
+    """Exception raised when a multipart upload is not found."""
+
+
+class ChecksumMismatchException(Exception):
+    """Exception raised when uploaded data does not match its checksum."""
+
+
+class InvalidPartException(Exception):
+    """Exception raised when the parts of a multipart upload are invalid."""
+
+
+class InvalidObjectNameException(Exception):
+    """Exception raised when an object name in a url has no object type."""
+
+
+async def iter_chunks(data, chunk_size: int = UPLOAD_CHUNK_SIZE):
+    """
+    Yields the object data in blocks of at most chunk_size bytes.
+    The data may be a bytes like object, a file like object
+    with a read method or an async iterable of bytes.
+
+    :param  data:
+    :param  chunk_size:
+    :return async generator of bytes:
+    """
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        view = memoryview(data)
+        for start in range(0, len(view), chunk_size):
+            yield view[start:start + chunk_size]
+    elif hasattr(data, "__aiter__"):
+        async for chunk in data:
+            if chunk:
+                yield chunk
+    else:
+        while True:
+            chunk = data.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
 
 
 class MetaData:
@@ -140,11 +241,51 @@ class MetaData:
         return self.__meta_data
 
 
+class LogFileRouter(logging.Handler):
+    """
+    Writes queued log records to the file of the FileLogger which
+    emitted them, the least recently used files are closed so the
+    number of open files stays bounded.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.__handlers = collections.OrderedDict()
+
+    def emit(self, record):
+        log_file_path = record.name[len(FileLogger.LOGGER_PREFIX):]
+        handler = self.__handlers.get(log_file_path)
+        if handler is None:
+            handler = logging.FileHandler(log_file_path)
+            handler.setFormatter(logging.Formatter("[%(asctime)s] %(message)s", datefmt="%Y-%m-%d %H:%M:%S"))
+            self.__handlers[log_file_path] = handler
+            if len(self.__handlers) > MAX_OPEN_LOG_FILES:
+                self.__handlers.popitem(last=False)[1].close()
+        else:
+            self.__handlers.move_to_end(log_file_path)
+        handler.emit(record)
+
+    def close(self):
+        for handler in self.__handlers.values():
+            handler.close()
+        self.__handlers.clear()
+        super().close()
+
+
 class FileLogger:
     """
     Handles logging operations to a file.
+
+    Each log file gets its own logger. Records are put on a queue and
+    written by one background thread, so logging costs a request an
+    enqueue instead of a formatted write to a file.
     """
 
+    LOGGER_PREFIX = "datadepot."
+    __queue = queue.SimpleQueue()
+    __listener = None
+    __lock = threading.Lock()
+
     def __init__(self, log_file_path):
         self.log_file_path = log_file_path
         self._configure_logging()
@@ -155,24 +296,25 @@ class FileLogger:
 
         :return None:
         """
-        logging.basicConfig(
-            filename=self.log_file_path,
-            level=logging.INFO,
-            format="[%(asctime)s] %(message)s",
-            datefmt="%Y-%m-%d %H:%M:%S"
-        )
+        self.__logger = logging.getLogger(f"{FileLogger.LOGGER_PREFIX}{self.log_file_path}")
+        with FileLogger.__lock:
+            if not self.__logger.handlers:
+                self.__logger.addHandler(logging.handlers.QueueHandler(FileLogger.__queue))
+                self.__logger.setLevel(logging.INFO)
+                self.__logger.propagate = False
+            if FileLogger.__listener is None:
+                FileLogger.__listener = logging.handlers.QueueListener(FileLogger.__queue, LogFileRouter())
+                FileLogger.__listener.start()
+                atexit.register(FileLogger.__listener.stop)
 
     def log(self, data):
         """
-        A file based WAL logging utility
+        Logs the provided data, the timestamp is added by the formatter.
 
         :param  data:
         :return None:
         """
-        """Logs the provided data."""
-        current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        log_entry = f"[{current_time}] {data}"
-        logging.info(log_entry)
+        self.__logger.info(data)
 
 
 class ConsistentNode:
@@ -202,15 +344,22 @@ class ConsistentHashing:
 
         Implements consistent hashing with virtual nodes.
 
+        Every node is hashed to vnodes points (times its weight) on a
+        64-bit ring, a key belongs to the node owning the first point at
+        or after the hash of the key. Lookups are a binary search over
+        the sorted points.
+
         Attributes:
             __ring (ConsistentHashing.Ring): The ring structure to store nodes.
 
         Methods:
-            __init__(self, capacity): Initializes a ConsistentHashing instance with a specified capacity.
-            put(self, node): Adds a node to the consistent hashing ring.
+            __init__(self, capacity, vnodes): Initializes a ConsistentHashing instance.
+            put(self, node, weight): Adds a node to the consistent hashing ring.
             get_request_server(self, request): Returns the node responsible for handling a given request.
+            get_request_servers(self, requests): Returns the nodes for a batch of requests.
             get_ring(self): Returns the underlying ring structure.
             soft_delete(self, node): Marks a node as down in a soft delete fashion.
+            delete(self, node): Removes a node from the ring.
     """
 
     class Hash:
@@ -219,6 +368,7 @@ class ConsistentHashing:
 
                 Methods:
                     find_index(_val, final_capacity): Calculates the hash index for a given value.
+                    get_point(_val): Calculates the 64-bit ring point of a value.
         """
 
         @staticmethod
@@ -227,115 +377,107 @@ class ConsistentHashing:
                 raise ValueError("None types are forbidden")
             return int(hashlib.md5(str(_val).encode()).hexdigest(), 16) % final_capacity
 
+        @staticmethod
+        def get_point(_val):
+            if _val is None:
+                raise ValueError("None types are forbidden")
+            return get_key_point(_val)
+
     class Ring:
         """
                 Represents the ring structure in consistent hashing.
 
                 Attributes:
-                    __ring (list): The array representing the ring.
-                    capacity (int): The current capacity of the ring.
+                    __points (list): The sorted 64-bit points of the virtual nodes.
+                    __owners (list): The node owning each point.
+                    capacity (int): Kept for compatibility, the ring grows as needed.
+                    vnodes (int): Virtual nodes of a node with weight 1.
 
                 Methods:
-                    __init__(self, capacity): Initializes a Ring instance with a specified capacity.
+                    __init__(self, capacity, vnodes): Initializes a Ring instance.
                     __str__(self): Returns a string representation of the Ring.
-                    get_ring(self): Returns the underlying array representing the ring.
-                    put_server(self, _node): Adds a server node to the ring.
-                    should_expand(self): Checks if the ring needs expansion.
-                    expand_ring(self): Expands the ring if needed.
+                    get_ring(self): Returns the (point, node) pairs in ring order.
+                    get_nodes(self): Returns the nodes of the ring.
+                    put_server(self, _node, weight): Adds a server node to the ring.
                     get_server(self, request): Returns the server node responsible for handling a given request.
+                    get_servers(self, requests): Returns the server nodes for a batch of requests.
                     update(self, _node, n_node): Updates a node in the ring.
                     delete(self, _node): Deletes a node from the ring.
                     soft_delete(self, _node): Marks a node as down in a soft delete fashion.
         """
 
-        def __init__(self, capacity: int = 1_000):
-            self.__ring = [None] * capacity
+        def __init__(self, capacity: int = 1_000, vnodes: int = VIRTUAL_NODES):
             self.capacity = capacity
+            self.vnodes = vnodes
+            self.__points = []
+            self.__owners = []
+            self.__node_points = {}
+            self.__points_array = None
+            self.__is_sorted = True
 
         def __str__(self):
-            return f'{self.__ring}'
+            return f'{self.get_ring()}'
 
-        def get_ring(self):
+        @staticmethod
+        def get_node_id(_node):
             """
-            Give the current ring instance
+            The identity a node is hashed by, soft deleted copies of
+            a ConsistentNode keep the points of the original.
 
-            :return Current ring instance:
+            :param _node:
+            :return str:
             """
-            return self.__ring
+            return str(_node.node) if isinstance(_node, ConsistentNode) else str(_node)
 
-        def put_server(self, _node):
+        def get_ring(self):
             """
-            Put the data in the following way
-            find index if node at index is None
-            then it will put the data else will find
-            the empty spot to fill it.
+            Give the current ring instance
 
-            :param _node:
-            :return None:
+            :return list of (point, node) sorted by point:
             """
-            if self.should_expand():
-                self.expand_ring()
-
-            if _node is not None:
-                c_index = ConsistentHashing.Hash.find_index(_node, len(self.__ring))
-                if self.__ring[c_index] is None:
-                    self.__ring[c_index] = _node
-                else:
-                    c_idx = c_index
-                    for i in range(c_index, len(self.__ring)):
-                        if self.__ring[i] is None:
-                            self.__ring[i] = _node
-                            break
-                        c_idx += 1
+            self._sort_points()
+            return list(zip(self.__points, self.__owners))
 
-                    if c_idx == len(self.__ring):
-                        for i in range(0, c_index):
-                            if self.__ring[i] is None:
-                                self.__ring[i] = _node
-
-        def should_expand(self):
+        def get_nodes(self):
             """
-            Check whether the ring should expand or not
-
-            :return bool:
+            :return list of the nodes in the ring:
             """
-            for val in self.__ring:
-                if val is None:
-                    return False
-            return True
+            return list(self.__node_points.keys())
 
-        def expand_ring(self):
+        def put_server(self, _node, weight: float = 1.0):
             """
-            Implements the expansion of ring and
-            rearrangement of the nodes based on
-            the new capacity.
+            Adds the virtual nodes of a server, round(vnodes * weight)
+            points hashed from the node id and the vnode number. A node
+            already in the ring is left as it is. The points are sorted
+            once by the next lookup, so adding many nodes stays linear.
 
+            :param _node:
+            :param weight: relative share of the keys
             :return None:
             """
-            if self.should_expand():
-                n_capacity = self.capacity * 2 + 1
-                n_ring = [None] * n_capacity
-                for val in self.__ring:
-                    idx = ConsistentHashing.Hash.find_index(val, n_capacity)
-                    if n_ring[idx] is None:
-                        n_ring[idx] = val
-
-                    else:
-                        c_id = idx
-                        for i in range(idx + 1, len(n_ring)):
-                            if n_ring[i] is None:
-                                n_ring[i] = val
-                                break
-                            c_id += 1
-
-                        if c_id == len(n_ring):
-                            for i in range(0, idx):
-                                if n_ring[i] is None:
-                                    n_ring[i] = val
-                                    break
-
-                self.__ring = n_ring
-                self.capacity = n_capacity
+            if _node is None or _node in self.__node_points:
+                return
+            node_id = self.get_node_id(_node)
+            points = [ConsistentHashing.Hash.get_point(f"{node_id}#{vnode}")
+                      for vnode in range(max(1, round(self.vnodes * weight)))]
+            self.__points.extend(points)
+            self.__owners.extend([_node] * len(points))
+            self.__node_points[_node] = points
+            self.__points_array = None
+            self.__is_sorted = False
+
+        def _sort_points(self):
+            if self.__is_sorted:
+                return
+            order = sorted(range(len(self.__points)), key=self.__points.__getitem__)
+            points, owners = [], []
+            for index in order:
+                if points and points[-1] == self.__points[index]:
+                    continue  # a 64-bit collision, one owner keeps the point
+                points.append(self.__points[index])
+                owners.append(self.__owners[index])
+            self.__points, self.__owners = points, owners
+            self.__is_sorted = True
 
         def get_server(self, req):
             """
@@ -345,50 +487,97 @@ class ConsistentHashing:
             :param req:
             :return ConsistentNode:
             """
-            idx = ConsistentHashing.Hash.find_index(req, self.capacity)
-            if self.__ring[idx] is not None:
-                return self.__ring[idx]
-            else:
-                for i in range(idx, len(self.__ring)):
-                    if self.__ring[i]:
-                        return self.__ring[i]
+            self._sort_points()
+            if not self.__points:
+                raise NotFoundException()
+            index = bisect.bisect_left(self.__points, ConsistentHashing.Hash.get_point(req))
+            return self.__owners[index % len(self.__owners)]
+
+        def get_servers(self, reqs):
+            """
+            Routes a batch of requests with one vectorized search.
+
+            :param reqs: list of requests
+            :return list of ConsistentNode:
+            """
+            self._sort_points()
+            if not self.__points:
+                raise NotFoundException()
+            if self.__points_array is None:
+                self.__points_array = np.array(self.__points, dtype=np.uint64)
+            hashes = np.fromiter((ConsistentHashing.Hash.get_point(req) for req in reqs),
+                                 dtype=np.uint64, count=len(reqs))
+            indexes = np.searchsorted(self.__points_array, hashes, side="left") % len(self.__owners)
+            owners = self.__owners
+            return [owners[index] for index in indexes.tolist()]
+
+        def get_successors(self, req, count: int):
+            """
+            Returns the first count distinct nodes met walking the
+            ring clockwise from the request, the owner first. Used
+            to place replicas and to fall back to the next node.
 
-                for i in range(0, idx):
-                    if self.__ring[i]:
-                        return self.__ring[i]
+            :param req:
+            :param count:
+            :return list of ConsistentNode:
+            """
+            successors = []
+            if count > 0:
+                for node in self.iter_successors(req):
+                    successors.append(node)
+                    if len(successors) == count:
+                        break
+            return successors
+
+        def iter_successors(self, req):
+            """
+            Yields the distinct nodes met walking the ring clockwise
+            from the request, the owner first.
 
+            :param req:
+            :return generator of ConsistentNode:
+            """
+            self._sort_points()
+            if not self.__points:
                 raise NotFoundException()
+            owners = self.__owners
+            start = bisect.bisect_left(self.__points, ConsistentHashing.Hash.get_point(req))
+            seen = set()
+            for offset in range(len(owners)):
+                owner = owners[(start + offset) % len(owners)]
+                node_id = self.get_node_id(owner)
+                if node_id not in seen:
+                    seen.add(node_id)
+                    yield owner
+                    if len(seen) == len(self.__node_points):
+                        return
 
         def update(self, _node, n_node):
             """
             Updates the instance of the
             server based on the consistent
-            hashing algorithm.
+            hashing algorithm, the new node
+            takes over the points of the old one.
 
             :param n_node:
             :param _node:
             :return bool:
             """
-            expected_idx = ConsistentHashing.Hash.find_index(_node, self.capacity)
-            if (self.__ring[expected_idx] is None or
-                    self.__ring[expected_idx] is not _node
-                    or n_node is not None):
-
-                for i in range(expected_idx, len(self.__ring)):
-                    if self.__ring[i] is _node:
-                        self.__ring[i] = n_node
-                        return True
-
-                for i in range(0, expected_idx):
-                    if self.__ring[i] is _node:
-                        self.__ring[i] = n_node
-                        return True
-
-            elif self.__ring[expected_idx] == _node:
-                self.__ring[expected_idx] = n_node
+            points = self.__node_points.pop(_node, None)
+            if points is None:
+                return False
+            self._sort_points()
+            if n_node is None:
+                removed = set(points)
+                kept = [(point, owner) for point, owner in zip(self.__points, self.__owners) if point not in removed]
+                self.__points = [point for point, _ in kept]
+                self.__owners = [owner for _, owner in kept]
+                self.__points_array = None
                 return True
-
-            return False
+            for point in points:
+                self.__owners[bisect.bisect_left(self.__points, point)] = n_node
+            self.__node_points[n_node] = points
+            return True
 
         def delete(self, _node):
             """
@@ -413,19 +602,31 @@ class ConsistentHashing:
             n_node.is_down = True
             return self.update(_node, n_node)
 
-    def __init__(self, capacity):
-        self.__ring = ConsistentHashing.Ring(capacity)
+    def __init__(self, capacity, vnodes: int = VIRTUAL_NODES, load_factor: float = None):
+        """
+        :param capacity:
+        :param vnodes: virtual nodes of a node with weight 1
+        :param load_factor: epsilon of bounded loads, a node takes at most
+                            (1 + epsilon) times the average in-flight
+                            requests, None routes by the ring alone
+        """
+        self.__ring = ConsistentHashing.Ring(capacity, vnodes)
+        self.__load_factor = load_factor
+        self.__loads = collections.Counter()
+        self.__total_load = 0
+        self.__load_lock = threading.Lock()
 
-    def put(self, node: ConsistentNode):
+    def put(self, node: ConsistentNode, weight: float = 1.0):
         """
         api for easy calling and
         interacting with the Ring
 
         :param node:
+        :param weight:
         :return None:
         """
         if node is not None:
-            self.__ring.put_server(node)
+            self.__ring.put_server(node, weight)
 
     def get_request_server(self, req):
         """
@@ -436,7 +637,151 @@ class ConsistentHashing:
         :return ConsistentNode:
         """
         if req is not None:
-            return self.__ring.get_server(req)
+            node = self.__ring.get_server(req)
+            RING_LOOKUPS.inc((ConsistentHashing.Ring.get_node_id(node),))
+            return node
+
+    def get_request_servers(self, reqs):
+        """
+        Returns the server instances
+        of a batch of requests
+
+        :param reqs:
+        :return list of ConsistentNode:
+        """
+        nodes = self.__ring.get_servers(reqs)
+        for node_id, count in collections.Counter(map(ConsistentHashing.Ring.get_node_id, nodes)).items():
+            RING_LOOKUPS.inc((node_id,), count)
+        return nodes
+
+    def get_load_capacity(self):
+        """
+        In-flight requests a node may hold, ceil((1 + epsilon) * (m + 1) / n)
+        for m requests in flight on n live nodes.
+
+        :return int or None without bounded loads:
+        """
+        if self.__load_factor is None:
+            return None
+        with self.__load_lock:
+            return self._get_load_capacity()
+
+    def _get_load_capacity(self):
+        live = sum(1 for node in self.__ring.get_nodes() if not getattr(node, "is_down", False))
+        return math.ceil((1 + self.__load_factor) * (self.__total_load + 1) / max(live, 1))
+
+    def is_saturated(self, node):
+        """
+        Checks whether a node holds as many requests as its capacity.
+
+        :param node:
+        :return bool, always False without bounded loads:
+        """
+        capacity = self.get_load_capacity()
+        if capacity is None:
+            return False
+        with self.__load_lock:
+            return self.__loads[ConsistentHashing.Ring.get_node_id(node)] >= capacity
+
+    def start_request(self, node):
+        """
+        Counts a request in flight on a node.
+
+        :param node:
+        :return None:
+        """
+        with self.__load_lock:
+            self.__loads[ConsistentHashing.Ring.get_node_id(node)] += 1
+            self.__total_load += 1
+
+    def finish_request(self, node):
+        """
+        Counts a request of a node as finished.
+
+        :param node:
+        :return None:
+        """
+        node_id = ConsistentHashing.Ring.get_node_id(node)
+        with self.__load_lock:
+            if self.__loads[node_id] > 0:
+                self.__loads[node_id] -= 1
+                self.__total_load -= 1
+
+    def get_loads(self):
+        """
+        :return dict of node id to the requests in flight:
+        """
+        with self.__load_lock:
+            return {node_id: load for node_id, load in self.__loads.items() if load}
+
+    def acquire_request_server(self, req):
+        """
+        Returns the server instance for a request
+        with bounded loads and counts the request
+        in flight on it. Nodes marked down are
+        skipped, a saturated owner hands the request
+        to the next node on the ring. Every call
+        must be paired with finish_request.
+
+        :param req:
+        :return ConsistentNode:
+        :raise NotFoundException when every node is down:
+        """
+        with self.__load_lock:
+            capacity = self._get_load_capacity() if self.__load_factor is not None else None
+            for node in self.__ring.iter_successors(req):
+                if getattr(node, "is_down", False):
+                    continue
+                node_id = ConsistentHashing.Ring.get_node_id(node)
+                if capacity is None or self.__loads[node_id] < capacity:
+                    self.__loads[node_id] += 1
+                    self.__total_load += 1
+                    RING_LOOKUPS.inc((node_id,))
+                    return node
+        raise NotFoundException()
+
+    @contextlib.contextmanager
+    def route_request(self, req):
+        """
+        Routes a request with bounded loads for
+        the duration of the with block.
+
+        :param req:
+        :return ConsistentNode:
+        """
+        node = self.acquire_request_server(req)
+        try:
+            yield node
+        finally:
+            self.finish_request(node)
+
+    @staticmethod
+    def get_geo_placement_key(latitude: float, longitude: float, precision: int):
+        """
+        Key which places an object by its location instead of its name,
+        objects sharing a geohash prefix land on the same nodes.
+
+        :param  latitude:
+        :param  longitude:
+        :param  precision: geohash characters shared by co-located objects
+        :return str:
+        """
+        return f"geo:{encode(latitude, longitude, precision)}"
+
+    def get_request_replicas(self, req, count: int):
+        """
+        Returns the count distinct server instances
+        following the request on the ring
+
+        :param req:
+        :param count:
+        :return list of ConsistentNode:
+        """
+        if req is not None:
+            nodes = self.__ring.get_successors(req, count)
+            for node in nodes:
+                RING_LOOKUPS.inc((ConsistentHashing.Ring.get_node_id(node),))
+            return nodes
 
     def get_ring(self):
         """
@@ -457,75 +802,274 @@ class ConsistentHashing:
         if node is not None:
             return self.__ring.soft_delete(node)
 
+    def delete(self, node):
+        """
+        Removes the instance from the ring,
+        its keys move to the next nodes
+
+        :param node:
+        :return bool:
+        """
+        if node is not None:
+            return self.__ring.delete(node)
+
+
+class CountMinSketch:
+    """
+    Approximate access frequencies of keys in a fixed amount of memory.
+
+    Counters saturate at 15 and are all halved every sample_size
+    increments, so the popularity of keys which are no longer requested
+    fades away (the TinyLFU aging scheme).
+    """
+
+    def __init__(self, width: int, depth: int = 4, sample_size: int = None) -> None:
+        self.__width = 1 << max(4, (width - 1).bit_length())
+        self.__depth = depth
+        self.__table = bytearray(depth * self.__width)
+        self.__sample_size = sample_size or 10 * self.__width
+        self.__additions = 0
+
+    def _get_cells(self, key):
+        mask = self.__width - 1
+        return [row * self.__width + (hash((row, key)) & mask) for row in range(self.__depth)]
+
+    def increment(self, key):
+        """
+        Records one access of the key.
+
+        :param  key:
+        :return None:
+        """
+        table = self.__table
+        for cell in self._get_cells(key):
+            if table[cell] < 15:
+                table[cell] += 1
+        self.__additions += 1
+        if self.__additions >= self.__sample_size:
+            view = np.frombuffer(table, dtype=np.uint8)
+            np.right_shift(view, 1, out=view)
+            self.__additions //= 2
+
+    def estimate(self, key):
+        """
+        :param  key:
+        :return int, the estimated number of recent accesses:
+        """
+        table = self.__table
+        return min(table[cell] for cell in self._get_cells(key))
+
 
 class LruCache:
-    """ Creates a lru cache implementation """
+    """
+    Creates a lru cache implementation
+
+    Entries are bounded by count (max_size) and optionally by the total
+    size of their values (max_bytes). With admission enabled a
+    count-min sketch tracks how often every key is requested and a new
+    entry may only evict entries requested less often than itself
+    (TinyLFU), so one large scan cannot flush the hot entries.
+    """
 
-    def __init__(self, max_size: int, trim_size: int) -> None:
+    def __init__(self, max_size: int, trim_size: int, max_bytes: int = None, admission: bool = False) -> None:
         if max_size <= 0:
-            self.__max_size = 1_000
+            max_size = 1_000
         self.__cache_map = collections.OrderedDict()
         self.__max_size = max_size
         self.trim_size = trim_size
+        self.__max_bytes = max_bytes
+        self.__bytes = 0
+        self.__sketch = CountMinSketch(max_size) if admission else None
+        self.__lock = threading.RLock()
+        self.__epoch = 0
         self.__hit_count = 0
         self.__put_count = 0
         self.__evict_count = 0
         self.__miss_count = 0
+        self.__reject_count = 0
         self.__logger = FileLogger("cache.log")
 
+    def _remove(self, key):
+        _, size = self.__cache_map.pop(key)
+        self.__bytes -= size
+
     def trim_to_size(self):
-        if self.trim_size <= 0:
-            self.trim_size = 100
-        current: int = 0
-        for key in self.__cache_map.keys() and current != self.trim_size:
-            del self.__cache_map[key]
-            self.__evict_count += 1
-            self.__put_count -= 1
-            current += 1
+        """Evicts the trim_size least recently used entries."""
+        with self.__lock:
+            if self.trim_size <= 0:
+                self.trim_size = 100
+            for key in list(self.__cache_map.keys())[:self.trim_size]:
+                self._remove(key)
+                self.__evict_count += 1
         self.__logger.log(f"Trimmed the cache size till {self.trim_size}")
 
-    def add_val(self, key, value):
+    def _find_victims(self, key, size: int):
+        """
+        Least recently used entries which have to go for the key to fit.
+
+        :return list of keys, None when the key is too big or not admitted:
+        """
+        if self.__max_bytes is not None and size > self.__max_bytes:
+            return None
+        excess_count = len(self.__cache_map) + 1 - self.__max_size
+        excess_bytes = self.__bytes + size - self.__max_bytes if self.__max_bytes is not None else 0
+        victims = []
+        frequency = self.__sketch.estimate(key) if self.__sketch is not None else None
+        for victim, (_, victim_size) in self.__cache_map.items():
+            if excess_count <= 0 and excess_bytes <= 0:
+                break
+            if victim == key:
+                continue
+            if frequency is not None and self.__sketch.estimate(victim) >= frequency:
+                return None
+            victims.append(victim)
+            excess_count -= 1
+            excess_bytes -= victim_size
+        return victims
+
+    def should_admit(self, key, size: int = 0):
+        """
+        Checks whether add_val would store the key, lets a caller skip
+        producing a value the cache would reject.
+
+        :param  key:
+        :param  size:
+        :return bool:
+        """
+        with self.__lock:
+            return self._find_victims(key, size) is not None
+
+    def get_epoch(self):
+        """
+        The epoch grows with every invalidation, a value read before an
+        invalidation is refused by add_val when given the older epoch.
+
+        :return int:
+        """
+        with self.__lock:
+            return self.__epoch
+
+    def add_val(self, key, value, size: int = 0, epoch: int = None):
         if key is None or value is None:
             raise NullKeyValueException()
-        if self.__cache_map.get(key) is not value:
-            if len(self.__cache_map) == self.__max_size:
-                self.trim_to_size()
-            self.__cache_map[key] = value
+        with self.__lock:
+            if epoch is not None and epoch != self.__epoch:
+                return False
+            existing = self.__cache_map.get(key)
+            if existing is not None and existing[0] is value:
+                return False
+            victims = self._find_victims(key, size)
+            if victims is None:
+                self.__reject_count += 1
+                return False
+            for victim in victims:
+                self._remove(victim)
+                self.__evict_count += 1
+            if existing is not None:
+                self._remove(key)
+            self.__cache_map[key] = (value, size)
+            self.__bytes += size
             self.__put_count += 1
-            self.__logger.log(f"The key {key} and value {value} added successfully")
             return True
-        else:
-            return False
 
-    def update_value(self, key, value):
+    def update_value(self, key, value, size: int = 0):
         if key is None or value is None:
             raise NullKeyValueException()
-        if self.__cache_map.get(key) is None:
-            self.add_val(key, value)
-        else:
-            self.__logger.log(f"The key's {key} value {self.__cache_map[key]} is updated with {value}")
-            self.__cache_map[key] = value
+        with self.__lock:
+            if key in self.__cache_map:
+                self._remove(key)
+                self.__cache_map[key] = (value, size)
+                self.__bytes += size
+            else:
+                self.add_val(key, value, size)
 
     def get_value(self, key):
         if key is None:
             raise NullKeyValueException()
-        if self.__cache_map.get(key) is None:
-            self.__logger.log(f"Read the key {key} successfully")
-            self.__miss_count += 1
-            return None
-        self.__hit_count += 1
-        return self.__cache_map[key]
+        with self.__lock:
+            if self.__sketch is not None:
+                self.__sketch.increment(key)
+            entry = self.__cache_map.get(key)
+            if entry is None:
+                self.__miss_count += 1
+                return None
+            self.__cache_map.move_to_end(key)
+            self.__hit_count += 1
+            return entry[0]
+
+    def invalidate(self, key):
+        """
+        Drops the key from the cache.
+
+        :param  key:
+        :return bool, whether the key was cached:
+        """
+        with self.__lock:
+            self.__epoch += 1
+            if key not in self.__cache_map:
+                return False
+            self._remove(key)
+            return True
+
+    def get_stats(self):
+        """
+        :return dict of the cache counters:
+        """
+        with self.__lock:
+            requests = self.__hit_count + self.__miss_count
+            return {
+                "entries": len(self.__cache_map),
+                "bytes": self.__bytes,
+                "max_bytes": self.__max_bytes,
+                "hits": self.__hit_count,
+                "misses": self.__miss_count,
+                "hit_ratio": self.__hit_count / requests if requests else 0.0,
+                "puts": self.__put_count,
+                "evictions": self.__evict_count,
+                "rejections": self.__reject_count,
+            }
 
 
 class Bucket:
     """
     Represents a storage bucket with operations like creation, deletion,
     metadata management, and logging.
+
+    With dedup enabled objects are split into content defined chunks
+    which are stored once in a content addressed chunk store, each
+    object then only keeps a manifest of its chunks.
+
+    With a small_object_threshold objects up to that size are appended
+    to packed segment files instead of getting their own directory,
+    which saves inodes and metadata syscalls for small objects.
+
+    With erasure set to (data shards, parity shards) objects are
+    striped over shard directories with Reed-Solomon parity, any data
+    shards of the shards are enough to read an object back.
+
+    Index and meta data mutations are recorded in a write-ahead log
+    with group commit before they are acknowledged, the log is replayed
+    when the bucket is opened so they survive a crash.
+
+    With cache_bytes hot objects are kept in memory by a byte bounded
+    LRU cache with TinyLFU admission and served without disk reads.
+
+    With a compression codec objects are compressed while they are
+    streamed to disk, compression_by_type overrides the codec per object
+    type or major content type (None disables it). Objects whose
+    compressed flag is off and deduplicated objects, which must keep
+    their raw chunks to deduplicate, are stored uncompressed.
     """
 
-    def __init__(self, bck_name: str, is_private: bool) -> None:
+    def __init__(self, bck_name: str, is_private: bool, dedup: bool = False,
+                 small_object_threshold: int = None, compression: str = None,
+                 compression_by_type: dict = None, erasure: tuple = None,
+                 durability: str = DURABILITY_SYNC, cache_bytes: int = 0) -> None:
         if bck_name is None or is_private is None:
             raise NullException()
+        for codec in [compression] + list((compression_by_type or {}).values()):
+            if codec is not None and codec not in get_codecs():
+                raise UnknownCodecException(f"Compression codec '{codec}' is not available")
         self.__bck_name = bck_name
         self.__meta_data = MetaData()
         self.__base_meta_data = {
@@ -535,6 +1079,30 @@ class Bucket:
         }
         self.__meta_data.add_all_meta_data(self.__base_meta_data)
         self.logger = FileLogger(f"Bucket_{self.__bck_name}.log")
+        self.__index = None
+        self.__dedup = dedup
+        self.__chunk_store = None
+        self.__small_object_threshold = small_object_threshold
+        self.__segment_store = None
+        self.__segment_lock = threading.RLock()
+        self.__packing = set()
+        self.__compaction_thread = None
+        self.__compression = compression
+        self.__compression_by_type = compression_by_type or {}
+        self.__erasure = erasure
+        self.__erasure_store = None
+        self.__durability = durability
+        self.__wal = None
+        self.__wal_lock = threading.Lock()
+        self.__wal_records = 0
+        self.__mutations = 0
+        self.__merkle_tree = None
+        self.__merkle_lock = threading.Lock()
+        self.__geo_index = None
+        self.__geo_lock = threading.Lock()
+        self.__cache = None
+        if cache_bytes:
+            self.__cache = LruCache(CACHE_MAX_ENTRIES, trim_size=0, max_bytes=cache_bytes, admission=True)
 
     def create_bucket(self):
         """Creates the bucket."""
@@ -543,10 +1111,277 @@ class Bucket:
             self.logger.log(f"Bucket {self.__bck_name} created successfully")
         except FileExistsError:
             self.logger.log(f"Failed to create bucket '{self.__bck_name}': Already exists")
+        self.get_index()
+        self.recover()
+
+    def get_index(self):
+        """
+        Returns the object index of the bucket, opening it on first use.
+        A missing or outdated index is rebuilt from the objects on disk.
+
+        :return ObjectIndex:
+        """
+        if self.__index is None:
+            self.__index = ObjectIndex(self.__bck_name)
+        return self.__index
+
+    def get_chunk_store(self):
+        """
+        Returns the chunk store of the bucket, opening it on first use.
+
+        :return ChunkStore:
+        """
+        if self.__chunk_store is None:
+            self.__chunk_store = ChunkStore(os.path.join(self.__bck_name, ".chunks"))
+        return self.__chunk_store
+
+    def get_wal(self):
+        """
+        Returns the write-ahead log of the bucket, opening it on first use.
+
+        :return WriteAheadLog:
+        """
+        if self.__wal is None:
+            with self.__wal_lock:
+                if self.__wal is None:
+                    self.__wal = WriteAheadLog(os.path.join(self.__bck_name, WAL_FILE_NAME), self.__durability)
+        return self.__wal
+
+    @contextlib.contextmanager
+    def _log_mutation(self, record: dict):
+        """
+        Logs a mutation before it is applied, the block applying it runs
+        inside the context so a checkpoint never drops a logged but not
+        yet applied record.
+
+        :param  record:
+        :return context yielding the lsn of the record:
+        """
+        with self.__wal_lock:
+            self.__mutations += 1
+        try:
+            yield self.get_wal().append(record)
+        finally:
+            with self.__wal_lock:
+                self.__mutations -= 1
+                self.__wal_records += 1
+                run_checkpoint = self.__wal_records >= WAL_CHECKPOINT_RECORDS
+        if run_checkpoint:
+            self.checkpoint()
+
+    def _log_put(self, object_name, object_type, object_uuid, data_file, size, digest, meta_data, layout,
+                 data_offset: int = 0, staging_dir=None):
+        return self._log_mutation({
+            "op": "put", "object_name": object_name, "object_type": object_type, "uuid": str(object_uuid),
+            "data_file": data_file, "data_offset": data_offset, "size": size, "digest": digest,
+            "meta_data": meta_data, "layout": layout, "staging_dir": staging_dir,
+        })
+
+    def _log_meta_data(self, action, key=None, value=None):
+        with self._log_mutation({"op": "meta", "action": action, "key": key, "value": value}):
+            pass
+
+    def checkpoint(self):
+        """
+        Makes the index and the bucket meta data durable on their own and
+        drops the log records they cover. Skipped while mutations are in
+        flight, the last of them retries it.
+
+        :return bool, whether the checkpoint ran:
+        """
+        with self.__wal_lock:
+            if self.__mutations:
+                return False
+            lsn = self.get_wal().get_last_lsn()
+            self.__wal_records = 0
+            meta_data = dict(self.__meta_data.get_all_meta_data())
+        self.get_index().checkpoint()
+        temp_path = os.path.join(self.__bck_name, f"{BUCKET_META_DATA_FILE_NAME}.tmp")
+        with open(temp_path, "w") as meta_file:
+            json.dump(meta_data, meta_file, default=str)
+            meta_file.flush()
+            started = time.perf_counter()
+            os.fsync(meta_file.fileno())
+            DISK_FSYNC_DURATION.observe(time.perf_counter() - started, ("checkpoint",))
+        os.replace(temp_path, os.path.join(self.__bck_name, BUCKET_META_DATA_FILE_NAME))
+        fsync_path(self.__bck_name)
+        self.get_wal().checkpoint(lsn)
+        return True
+
+    def recover(self):
+        """
+        Replays the write-ahead log after a restart. Bucket meta data
+        changes are applied in order on top of the last snapshot, for
+        objects only the last logged change counts and is applied again
+        idempotently, brings the index forward after a crash without
+        rebuilding it from the directories. Puts are logged before their
+        staging directory is renamed, puts which never got published are
+        skipped and their staging directory is removed. Published puts
+        whose data does not match the logged size and digest are replayed
+        as deletes.
+
+        :return int, the number of replayed records:
+        """
+        try:
+            with open(os.path.join(self.__bck_name, BUCKET_META_DATA_FILE_NAME), "r") as meta_file:
+                snapshot = json.load(meta_file)
+            for key, value in snapshot.items():
+                if key not in self.__base_meta_data:
+                    self.__meta_data.add_meta_data(key, value)
+        except FileNotFoundError:
+            pass
+
+        records = list(self.get_wal().replay())
+        last_changes = {}
+        for _, record in records:
+            if record["op"] == "meta":
+                self._apply_meta_data_record(record)
+            elif record["op"] == "put" and not self._is_published(record):
+                # cut short before its rename or lost the race to another
+                # upload, the upload was never acknowledged
+                if record.get("staging_dir"):
+                    shutil.rmtree(os.path.join(self.__bck_name, record["staging_dir"]), ignore_errors=True)
+            elif record["op"] == "put" and not self._has_logged_data(record):
+                # published, but its data did not survive the crash
+                self.logger.log(f"Dropping object '{record['object_name']}' of type '{record['object_type']}', "
+                                f"its data does not match the write-ahead log")
+                last_changes[ObjectIndex.get_object_key(record["object_name"], record["object_type"])] = {
+                    **record, "op": "delete"}
+            else:
+                last_changes[ObjectIndex.get_object_key(record["object_name"], record["object_type"])] = record
+        index = self.get_index()
+        for object_key, record in last_changes.items():
+            if record["op"] == "put":
+                index.put(record["object_name"], record["object_type"], record["uuid"], record["data_file"],
+                          record["size"], record["digest"], record["meta_data"], record["layout"],
+                          record["data_offset"], replace=True)
+            elif record["op"] == "delete":
+                # chunks and shards are not released again, at worst they leak
+                index.delete(record["object_name"], record["object_type"])
+                if record["layout"] == LAYOUT_PACKED:
+                    self.get_segment_store().append_tombstone(object_key)
+                else:
+                    shutil.rmtree(self.get_path(record["object_name"], record["object_type"]), ignore_errors=True)
+        if records:
+            self.logger.log(f"Replayed {len(records)} write-ahead log records of bucket '{self.__bck_name}'")
+            self.checkpoint()
+        return len(records)
+
+    def _is_published(self, record):
+        """
+        Checks that the object of a logged put is on disk. The object
+        directory must hold the meta data of this very upload, a losing
+        concurrent upload logs the same manifest path as the winner.
+
+        :param  record: put record of the write-ahead log
+        :return bool:
+        """
+        data_path = os.path.join(self.__bck_name, record["data_file"])
+        if record["layout"] == LAYOUT_PACKED:
+            return os.path.exists(data_path)
+        try:
+            with open(os.path.join(os.path.dirname(data_path), "meta_data.json"), "r") as meta_file:
+                meta_data = json.load(meta_file)
+        except (FileNotFoundError, ValueError):
+            return False
+        return meta_data.get("uuid") == record["uuid"] and os.path.exists(data_path)
+
+    def _has_logged_data(self, record):
+        """
+        Checks the data of a logged put, below the sync durability level
+        nothing fsyncs it and a crash may leave it truncated or zeroed.
+        Objects up to RECOVERY_VERIFY_MAX_SIZE are read back and compared
+        with the logged digest, larger ones only by their size.
+
+        :param  record: put record of the write-ahead log
+        :return bool:
+        """
+        data_record = {"meta_data": record["meta_data"], "size": record["size"], "layout": record["layout"],
+                       "data_path": os.path.join(self.__bck_name, record["data_file"]),
+                       "data_offset": record["data_offset"]}
+        stored_size = record["meta_data"].get("compressed_size", record["size"])
+        try:
+            if record["size"] > RECOVERY_VERIFY_MAX_SIZE:
+                if record["layout"] == LAYOUT_FILE:
+                    return os.path.getsize(data_record["data_path"]) == stored_size
+                # the manifest lists the chunks or shards, reading them all is too slow here
+                with open(data_record["data_path"], "r") as manifest_file:
+                    json.load(manifest_file)
+                return True
+            size = 0
+            digest = hashlib.sha256()
+            for chunk in self.iter_object_data(data_record):
+                size += len(chunk)
+                digest.update(chunk)
+            return size == record["size"] and digest.hexdigest() == record["digest"]
+        except Exception:
+            # missing chunks or shards, a torn manifest, a truncated compressed stream
+            return False
+
+    def _apply_meta_data_record(self, record):
+        try:
+            if record["action"] == "add":
+                self.__meta_data.add_meta_data(record["key"], record["value"])
+            elif record["action"] == "update":
+                self.__meta_data.update_meta_data(record["key"], record["value"])
+            elif record["action"] == "delete":
+                self.__meta_data.delete_meta_data(record["key"])
+            elif record["action"] == "add_all":
+                self.__meta_data.add_all_meta_data(record["value"])
+        except (NotFoundException, NullKeyValueException):
+            pass
+
+    def get_erasure_store(self):
+        """
+        Returns the erasure coded store of the bucket, opening it on first use.
+
+        :return ErasureStore:
+        """
+        if self.__erasure_store is None:
+            # objects keep their geometry in their manifest, so stored
+            # objects stay readable when the bucket is reconfigured
+            data_shards, parity_shards = self.__erasure or (DATA_SHARDS, PARITY_SHARDS)
+            self.__erasure_store = ErasureStore(os.path.join(self.__bck_name, ".shards"),
+                                                data_shards, parity_shards)
+        return self.__erasure_store
+
+    def get_segment_store(self):
+        """
+        Returns the packed segment store of the bucket, opening it on first use.
+
+        :return SegmentStore:
+        """
+        if self.__segment_store is None:
+            with self.__segment_lock:
+                if self.__segment_store is None:
+                    self.__segment_store = SegmentStore(os.path.join(self.__bck_name, SEGMENTS_DIR_NAME))
+        return self.__segment_store
+
+    def rebuild_index(self):
+        """
+        Rebuilds the object index from the objects on disk.
+
+        :return int, the number of indexed objects:
+        """
+        count = self.get_index().rebuild()
+        self.logger.log(f"Rebuilt the index of bucket '{self.__bck_name}' with {count} objects")
+        return count
 
     def delete_bucket(self):
         """Deletes the bucket."""
         if os.path.exists(self.__bck_name):
+            if self.__wal is not None:
+                self.__wal.close()
+                self.__wal = None
+            if self.__index is not None:
+                self.__index.close()
+                self.__index = None
+            if self.__chunk_store is not None:
+                self.__chunk_store.close()
+                self.__chunk_store = None
+            if self.__segment_store is not None:
+                self.__segment_store.close()
+                self.__segment_store = None
             shutil.rmtree(self.__bck_name)
             self.logger.log(f"Bucket '{self.__bck_name}' deleted successfully")
         else:
@@ -560,6 +1395,7 @@ class Bucket:
         """Updates metadata with the provided key-value pair."""
         try:
             self.__meta_data.update_meta_data(key, value)
+            self._log_meta_data("update", key=key, value=value)
             self.logger.log(f"Metadata updated successfully: '{key}': '{value}'")
         except NotFoundException as e:
             self.logger.log(f"Failed to update metadata: {e}")
@@ -570,6 +1406,7 @@ class Bucket:
         """Deletes metadata associated with the given key."""
         try:
             self.__meta_data.delete_meta_data(key)
+            self._log_meta_data("delete", key=key)
             self.logger.log(f"Metadata '{key}' deleted successfully")
         except NotFoundException as e:
             self.logger.log(f"Failed to delete metadata: {e}")
@@ -580,6 +1417,7 @@ class Bucket:
         """Adds multiple metadata entries."""
         try:
             self.__meta_data.add_all_meta_data(meta_data)
+            self._log_meta_data("add_all", value=meta_data)
             self.logger.log("All metadata added successfully")
         except NotFoundException as e:
             self.logger.log(f"Failed to add metadata: {e}")
@@ -590,63 +1428,1112 @@ class Bucket:
         """Adds a single metadata entry."""
         try:
             self.__meta_data.add_meta_data(key, value)
+            self._log_meta_data("add", key=key, value=value)
             self.logger.log(f"Metadata added successfully: '{key}': '{value}'")
         except NotFoundException as e:
             self.logger.log(f"Failed to add metadata: {e}")
         except NullKeyValueException as e:
             self.logger.log(f"Failed to add metadata: {e}")
 
+    def get_bucket_name(self):
+        return self.__bck_name
+
     def get_path(self, object_name, object_type):
         return os.path.join(self.__bck_name, f"{object_name}.{object_type}")
 
-    async def upload_object(self, obj):
-        """ Handling the upload logic for big data """
-        path = self.get_path(obj.get_object_name(), obj.get_object_type())
+    def get_compression_codec(self, obj):
+        """
+        Picks the codec an object is stored with.
 
-        # Check if the object already exists
-        if os.path.exists(path):
-            self.logger.log(f"Object '{obj.get_object_name()}' already exists in the bucket.")
-            return
+        :param  obj:
+        :return str or None for uncompressed:
+        """
+        if self.__dedup or not obj.get_object_compressed_flag():
+            return None
+        content_type = obj.get_object_meta_data().get("content_type") or ""
+        for key in (obj.get_object_type(), content_type.split("/")[0]):
+            if key in self.__compression_by_type:
+                return self.__compression_by_type[key]
+        return self.__compression
 
-        # If the object doesn't exist, proceed with the upload
-        os.makedirs(path, exist_ok=True)  # Use makedirs to create intermediate directories if they don't exist
-        meta_data = obj.get_object_meta_data()
+    async def upload_object(self, obj):
+        """
+        Handling the upload logic for big data.
+        The data is streamed in chunks to a staging directory inside
+        the bucket while the size and sha256 digest are computed, the
+        staging directory is then renamed to the object path so that
+        readers never see a partially written object.
+
+        :param  obj:
+        :return dict of the stored object meta data:
+        :raise  ObjectAlreadyExistsException:
+        """
+        with span("check_not_exists"):
+            self._check_not_exists(obj.get_object_name(), obj.get_object_type())
+
+        object_data = obj.get_object_data()
+        codec = self.get_compression_codec(obj)
+        if self.__small_object_threshold:
+            with span("read_small_object"):
+                small_data, object_data = await read_small_object(object_data, self.__small_object_threshold)
+            if small_data is not None:
+                with span("publish_packed", size=len(small_data)):
+                    # fsyncs and log waits block, concurrent uploads share them from worker threads
+                    return await asyncio.to_thread(self._publish_packed, obj, small_data, codec)
+
+        staging_path = os.path.join(self.__bck_name, f".{obj.get_uuid()}.partial")
+        with span("create_staging_dir"):
+            os.makedirs(staging_path)
+        if self.__dedup:
+            layout, data_file_name = LAYOUT_CHUNKED, MANIFEST_FILE_NAME
+            writer = ChunkedObjectWriter(self.get_chunk_store())
+        elif self.__erasure is not None:
+            layout, data_file_name = LAYOUT_ERASURE, SHARDS_FILE_NAME
+            writer = self.get_erasure_store().open_writer(str(obj.get_uuid()))
+        else:
+            layout, data_file_name = LAYOUT_FILE, str(obj.get_uuid())
+            writer = None
+        compressor = get_compressor(codec) if codec is not None else None
+        try:
+            size = 0
+            stored_size = 0
+            digest = hashlib.sha256()
+            data_file = None
+            if writer is None:
+                # Open file for writing in binary mode
+                with span("open_data_file"):
+                    data_file = await aiofiles.open(os.path.join(staging_path, data_file_name), "wb")
+
+            async def write(data):
+                with span("write_chunk", size=len(data)):
+                    started = time.perf_counter()
+                    if data_file is not None:
+                        await data_file.write(data)
+                    else:
+                        await asyncio.to_thread(writer.write, data)
+                    DISK_WRITE_DURATION.observe(time.perf_counter() - started, ("object",))
+
+            try:
+                async for chunk in traced_aiter(iter_chunks(object_data), "read_chunk"):
+                    size += len(chunk)
+                    digest.update(chunk)
+                    if compressor is not None:
+                        # the codecs release the GIL, keep them off the event loop
+                        with span("compress_chunk", size=len(chunk)):
+                            chunk = await asyncio.to_thread(compressor.compress, chunk)
+                    stored_size += len(chunk)
+                    await write(chunk)
+                if compressor is not None:
+                    chunk = compressor.flush()
+                    stored_size += len(chunk)
+                    await write(chunk)
+            finally:
+                if data_file is not None:
+                    with span("close_data_file"):
+                        await data_file.close()
+
+            if writer is not None:
+                with span("close_writer", layout=layout):
+                    manifest = await asyncio.to_thread(writer.close, self.__durability == DURABILITY_SYNC)
+                    if layout == LAYOUT_CHUNKED:
+                        manifest = {"chunks": manifest}
+                    with open(os.path.join(staging_path, data_file_name), "w") as manifest_file:
+                        json.dump(manifest, manifest_file)
+
+            encoding_meta_data = None
+            if compressor is not None:
+                encoding_meta_data = {"compression": codec, "compressed_size": stored_size}
+        except BaseException:
+            if writer is not None:
+                writer.abort()
+            shutil.rmtree(staging_path, ignore_errors=True)
+            raise
+
+        def publish():
+            try:
+                return self._publish_staged(obj, staging_path, layout, data_file_name, size, digest.hexdigest(),
+                                            encoding_meta_data)
+            except BaseException:
+                if writer is not None:
+                    writer.abort()
+                shutil.rmtree(staging_path, ignore_errors=True)
+                raise
+
+        with span("publish", size=size):
+            # the worker thread owns the staged object from here on, it
+            # finishes or cleans up even when the request is cancelled
+            return await asyncio.to_thread(publish)
+
+    def _check_not_exists(self, object_name, object_type):
+        """
+        :raise ObjectAlreadyExistsException when the object is indexed:
+        """
+        if self.get_index().contains(object_name, object_type):
+            self.logger.log(f"Object '{object_name}' already exists in the bucket.")
+            raise ObjectAlreadyExistsException(
+                f"Object '{object_name}' of type '{object_type}' already exists")
 
-        # import json
+    def _publish_staged(self, obj, staging_path, layout, data_file_name, size: int, digest: str,
+                        encoding_meta_data: dict = None):
+        """
+        Writes the meta data of a fully staged object, logs the put,
+        renames the staging directory to the object path and adds the
+        object to the index. The put is logged first, so recovery after a
+        crash either indexes the renamed directory or removes the staging
+        directory, a published directory is never left unindexed. With
+        sync durability the staged files are fsynced before the put is
+        logged and the bucket directory after the rename.
+
+        :param  obj:
+        :param  staging_path:
+        :param  layout:
+        :param  data_file_name:
+        :param  size: of the original data
+        :param  digest: of the original data
+        :param  encoding_meta_data: codec and compressed size of compressed data
+        :return dict of the stored object meta data:
+        :raise  ObjectAlreadyExistsException:
+        """
+        path = self.get_path(obj.get_object_name(), obj.get_object_type())
+        meta_data = dict(obj.get_object_meta_data())
+        meta_data["size"] = size
+        meta_data["sha256"] = digest
+        meta_data.update(encoding_meta_data or {})
 
         # Write metadata to file in JSON format
-        with open(os.path.join(path, "meta_data.json"), "w") as meta_file:
-            json.dump(meta_data, meta_file)
+        with span("write_meta_data"):
+            with open(os.path.join(staging_path, "meta_data.json"), "w") as meta_file:
+                json.dump(meta_data, meta_file)
+        if self.__durability == DURABILITY_SYNC:
+            # the logged put must never point at data a crash can lose
+            with span("fsync_staged"):
+                started = time.perf_counter()
+                for file_name in os.listdir(staging_path):
+                    fsync_path(os.path.join(staging_path, file_name))
+                fsync_path(staging_path)
+                DISK_FSYNC_DURATION.observe(time.perf_counter() - started, ("object",))
+
+        data_file = os.path.join(os.path.basename(path), data_file_name)
+        with span("log_and_index"), self._log_put(obj.get_object_name(), obj.get_object_type(), obj.get_uuid(),
+                                                  data_file, size, digest, meta_data, layout,
+                                                  staging_dir=os.path.basename(staging_path)):
+            # Publish the object, fails if another upload won the race
+            try:
+                with span("rename_staging_dir"):
+                    os.rename(staging_path, path)
+                    if self.__durability == DURABILITY_SYNC:
+                        fsync_path(self.__bck_name)
+            except OSError:
+                raise ObjectAlreadyExistsException(
+                    f"Object '{obj.get_object_name()}' of type '{obj.get_object_type()}' already exists")
+            try:
+                with self.__segment_lock:
+                    # a packed upload of the same object won the race
+                    if (ObjectIndex.get_object_key(obj.get_object_name(), obj.get_object_type()) in self.__packing
+                            or not self.get_index().put(obj.get_object_name(), obj.get_object_type(),
+                                                        obj.get_uuid(), data_file, size, digest, meta_data, layout)):
+                        raise ObjectAlreadyExistsException(
+                            f"Object '{obj.get_object_name()}' of type '{obj.get_object_type()}' already exists")
+            except BaseException:
+                # not published after all, recovery skips the logged put
+                shutil.rmtree(path, ignore_errors=True)
+                raise
+        with span("update_object_caches"):
+            self._object_changed(obj.get_object_name(), obj.get_object_type())
+        self.logger.log(f"Object '{obj.get_object_name()}' uploaded successfully ({size} bytes)")
+        return meta_data
+
+    def _publish_packed(self, obj, data, codec=None):
+        """
+        Appends a small object to the active segment and indexes it,
+        no directory or file is created for the object. Compressed data
+        is only kept when it is actually smaller. The object is reserved
+        while the segment lock is held, the fsync and the logging run
+        outside of it so concurrent uploads share them.
 
-        async with aiofiles.open(os.path.join(path, str(obj.get_uuid())),
-                                 "wb") as data_file:  # Open file for writing in binary mode
-            await data_file.write(obj.get_object_data())  # Write data to file
+        :param  obj:
+        :param  data:
+        :param  codec:
+        :return dict of the stored object meta data:
+        :raise  ObjectAlreadyExistsException:
+        """
+        object_key = ObjectIndex.get_object_key(obj.get_object_name(), obj.get_object_type())
+        meta_data = dict(obj.get_object_meta_data())
+        meta_data["size"] = len(data)
+        meta_data["sha256"] = hashlib.sha256(data).hexdigest()
+        if codec is not None:
+            compressed = compress(codec, data)
+            if len(compressed) < len(data):
+                meta_data["compression"] = codec
+                meta_data["compressed_size"] = len(compressed)
+                data = compressed
+
+        with self.__segment_lock:
+            # checked again under the lock, the segments must never hold
+            # two live records for the same object
+            self._check_not_exists(obj.get_object_name(), obj.get_object_type())
+            if object_key in self.__packing:
+                raise ObjectAlreadyExistsException(
+                    f"Object '{obj.get_object_name()}' of type '{obj.get_object_type()}' already exists")
+            segment_name, offset = self.get_segment_store().append(object_key, meta_data, data)
+            self.__packing.add(object_key)
+        try:
+            self._sync_segment(segment_name)
+            data_file = os.path.join(SEGMENTS_DIR_NAME, segment_name)
+            with self._log_put(obj.get_object_name(), obj.get_object_type(), obj.get_uuid(), data_file,
+                               meta_data["size"], meta_data["sha256"], meta_data, LAYOUT_PACKED, offset):
+                self.get_index().put(obj.get_object_name(), obj.get_object_type(), obj.get_uuid(), data_file,
+                                     meta_data["size"], meta_data["sha256"], meta_data, LAYOUT_PACKED, offset)
+        except BaseException:
+            with self.__segment_lock:
+                self.get_segment_store().append_tombstone(object_key)
+            raise
+        finally:
+            with self.__segment_lock:
+                self.__packing.discard(object_key)
+        self._object_changed(obj.get_object_name(), obj.get_object_type())
+        self.logger.log(f"Object '{obj.get_object_name()}' packed into segment {segment_name} "
+                        f"({meta_data['size']} bytes)")
+        return meta_data
+
+    def _sync_segment(self, segment_name):
+        """
+        Fsyncs the records appended to a segment before their put is
+        logged, unless the bucket trades durability for speed.
 
-    async def download_object(self, object_name, object_type):
-        """Handles the download logic for objects."""
-        path = self.get_path(object_name, object_type)
-        if not os.path.exists(path):
-            raise NotFoundException(
-                f"Object '{object_name}' of type '{object_type}' not found in bucket '{self.__bck_name}'")
+        :param  segment_name:
+        :return None:
+        """
+        if self.__durability != DURABILITY_SYNC:
+            return
+        started = time.perf_counter()
+        self.get_segment_store().sync(segment_name)
+        DISK_FSYNC_DURATION.observe(time.perf_counter() - started, ("segment",))
+
+    def compact_segments(self):
+        """
+        Compacts sealed segments in which at least COMPACTION_GARBAGE_RATIO
+        of the bytes belong to deleted objects, then removes segments
+        compacted long enough ago.
+
+        :return int, the number of compacted segments:
+        """
+        store = self.get_segment_store()
+        index = self.get_index()
+
+        def relocate(kind, object_key, meta_data, data_offset, read):
+            with self.__segment_lock:
+                if kind != RECORD_PUT:
+                    # keep deletes of objects which may still exist in older segments
+                    object_name, _, object_type = object_key.partition(".")
+                    if index.contains(object_name, object_type):
+                        return False
+                    store.append_tombstone(object_key)
+                    return True
+                record = index.get(meta_data["object name"], meta_data["object_type"])
+                if (record is None or record["layout"] != LAYOUT_PACKED
+                        or os.path.basename(record["data_path"]) != segment_name
+                        or record["data_offset"] != data_offset):
+                    return False
+                new_segment, new_offset = store.append(object_key, meta_data, read())
+                self._sync_segment(new_segment)
+                new_data_file = os.path.join(SEGMENTS_DIR_NAME, new_segment)
+                with self._log_put(record["object_name"], record["object_type"], record["uuid"], new_data_file,
+                                   record["size"], record["digest"], record["meta_data"], LAYOUT_PACKED,
+                                   new_offset):
+                    return index.relocate(object_key, os.path.join(SEGMENTS_DIR_NAME, segment_name), data_offset,
+                                          new_data_file, new_offset)
+
+        compacted = 0
+        live_bytes = index.get_packed_live_bytes(RECORD_HEADER.size)
+        for segment_name, size in store.get_segment_sizes().items():
+            if segment_name == store.get_active_segment() or not size:
+                continue
+            live = live_bytes.get(os.path.join(SEGMENTS_DIR_NAME, segment_name), 0)
+            if 1 - live / size >= COMPACTION_GARBAGE_RATIO:
+                moved = store.compact_segment(segment_name, relocate)
+                self.logger.log(f"Compacted segment {segment_name}, moved {moved} records")
+                compacted += 1
+        store.collect_garbage()
+        return compacted
+
+    def start_compaction(self, interval: float = COMPACTION_INTERVAL):
+        """
+        Starts a daemon thread compacting the packed segments every interval seconds.
+
+        :param  interval:
+        :return None:
+        """
+        if self.__compaction_thread is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.compact_segments()
+                except Exception as e:
+                    self.logger.log(f"Segment compaction failed: {e}")
+
+        self.__compaction_thread = threading.Thread(target=run, name=f"compaction-{self.__bck_name}", daemon=True)
+        self.__compaction_thread.start()
+
+    def get_upload_path(self, upload_id):
+        """
+        Directory holding the parts of a multipart upload.
+
+        :param  upload_id:
+        :return str:
+        :raise  UploadNotFoundException:
+        """
+        if not isinstance(upload_id, str) or len(upload_id) != 32 or not upload_id.isalnum():
+            raise UploadNotFoundException(f"Upload '{upload_id}' not found")
+        return os.path.join(self.__bck_name, ".multipart", upload_id)
+
+    def _read_upload(self, upload_id, object_name, object_type):
+        """
+        :return upload state dict and upload path:
+        :raise  UploadNotFoundException:
+        """
+        upload_path = self.get_upload_path(upload_id)
+        try:
+            with open(os.path.join(upload_path, "upload.json"), "r") as upload_file:
+                upload = json.load(upload_file)
+        except FileNotFoundError:
+            raise UploadNotFoundException(f"Upload '{upload_id}' not found")
+        if upload["object_name"] != object_name or upload["object_type"] != object_type:
+            raise UploadNotFoundException(
+                f"Upload '{upload_id}' does not belong to object '{object_name}.{object_type}'")
+        return upload, upload_path
+
+    def create_multipart_upload(self, object_name, object_type, object_meta_data: dict):
+        """
+        Starts a multipart upload, parts can then be uploaded in parallel
+        and in any order before the upload is completed or aborted.
+
+        :param  object_name:
+        :param  object_type:
+        :param  object_meta_data:
+        :return str, the upload id:
+        :raise  ObjectAlreadyExistsException:
+        """
+        self._check_not_exists(object_name, object_type)
+        upload_id = uuid.uuid4().hex
+        upload_path = self.get_upload_path(upload_id)
+        os.makedirs(upload_path)
+        with open(os.path.join(upload_path, "upload.json"), "w") as upload_file:
+            json.dump({
+                "object_name": object_name,
+                "object_type": object_type,
+                "meta_data": object_meta_data,
+                "created": datetime.datetime.now().isoformat(),
+            }, upload_file)
+        self.logger.log(f"Multipart upload '{upload_id}' started for '{object_name}.{object_type}'")
+        return upload_id
+
+    async def upload_part(self, upload_id, object_name, object_type, part_number: int, data,
+                          expected_sha256=None, expected_md5=None):
+        """
+        Streams one part of a multipart upload to disk. The part is only
+        kept when it matches the checksums sent by the client, a part
+        uploaded again replaces the previous one.
+
+        :param  upload_id:
+        :param  object_name:
+        :param  object_type:
+        :param  part_number: 1 to MAX_PART_NUMBER
+        :param  data: bytes, file like object or async iterable
+        :param  expected_sha256: hex digest
+        :param  expected_md5: base64 digest as sent in Content-MD5
+        :return dict with the part number, size and etag (sha256 hex):
+        :raise  UploadNotFoundException, InvalidPartException and ChecksumMismatchException:
+        """
+        _, upload_path = self._read_upload(upload_id, object_name, object_type)
+        if not 1 <= part_number <= MAX_PART_NUMBER:
+            raise InvalidPartException(f"Part number must be between 1 and {MAX_PART_NUMBER}")
+
+        part_path = os.path.join(upload_path, f"part-{part_number:05d}")
+        temp_path = f"{part_path}.{uuid.uuid4().hex}.tmp"
+        size = 0
+        sha256 = hashlib.sha256()
+        md5 = hashlib.md5() if expected_md5 else None
+        try:
+            async with aiofiles.open(temp_path, "wb") as part_file:
+                async for chunk in iter_chunks(data):
+                    size += len(chunk)
+                    sha256.update(chunk)
+                    if md5 is not None:
+                        md5.update(chunk)
+                    await part_file.write(chunk)
+
+            if expected_sha256 and expected_sha256.lower() != sha256.hexdigest():
+                raise ChecksumMismatchException(f"Part {part_number} does not match its sha256 checksum")
+            if md5 is not None and expected_md5 != base64.b64encode(md5.digest()).decode():
+                raise ChecksumMismatchException(f"Part {part_number} does not match its Content-MD5")
+
+            with open(f"{temp_path}.json", "w") as part_meta_file:
+                json.dump({"part_number": part_number, "size": size, "etag": sha256.hexdigest()},
+                          part_meta_file)
+            os.replace(f"{temp_path}.json", f"{part_path}.json")
+            os.replace(temp_path, part_path)
+        except BaseException:
+            for path in (temp_path, f"{temp_path}.json"):
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+        return {"part_number": part_number, "size": size, "etag": sha256.hexdigest()}
+
+    def list_parts(self, upload_id, object_name, object_type):
+        """
+        Lists the parts uploaded so far, lets clients resume an upload.
+
+        :param  upload_id:
+        :param  object_name:
+        :param  object_type:
+        :return list of part dicts sorted by part number:
+        :raise  UploadNotFoundException:
+        """
+        _, upload_path = self._read_upload(upload_id, object_name, object_type)
+        parts = []
+        for entry in os.scandir(upload_path):
+            if entry.name.startswith("part-") and entry.name.endswith(".json") and entry.name.count(".") == 1:
+                with open(entry.path, "r") as part_meta_file:
+                    parts.append(json.load(part_meta_file))
+        return sorted(parts, key=lambda part: part["part_number"])
+
+    async def complete_multipart_upload(self, upload_id, object_name, object_type, parts=None):
+        """
+        Stitches the uploaded parts into the final object.
+
+        For the plain file layout parts are concatenated inside the kernel
+        with copy_file_range, the parts are only read to compute the sha256
+        of the object, which is the same content digest every other upload
+        path stores. Objects that are compressed or small enough to be
+        packed, and those of deduplicated and erasure coded buckets, stream
+        the parts through the regular upload path.
+
+        :param  upload_id:
+        :param  object_name:
+        :param  object_type:
+        :param  parts: optional list of {"part_number", "etag"} to verify,
+                       defaults to every uploaded part
+        :return dict of the stored object meta data:
+        :raise  UploadNotFoundException, InvalidPartException and ObjectAlreadyExistsException:
+        """
+        upload, upload_path = self._read_upload(upload_id, object_name, object_type)
+        uploaded = {part["part_number"]: part for part in self.list_parts(upload_id, object_name, object_type)}
+        if parts is None:
+            parts = list(uploaded.values())
+        if not parts:
+            raise InvalidPartException("A multipart upload needs at least one part")
+
+        numbers = [part["part_number"] for part in parts]
+        if numbers != sorted(set(numbers)):
+            raise InvalidPartException("Parts must be listed in ascending order without duplicates")
+        for part in parts:
+            stored = uploaded.get(part["part_number"])
+            if stored is None or part.get("etag", stored["etag"]) != stored["etag"]:
+                raise InvalidPartException(f"Part {part['part_number']} was not uploaded or has changed")
+        part_paths = [os.path.join(upload_path, f"part-{number:05d}") for number in numbers]
+
+        obj = Object(object_name, self.__bck_name, object_type, iter_files(part_paths), upload["meta_data"])
+        size = sum(os.path.getsize(path) for path in part_paths)
+        if (self.__dedup or self.__erasure is not None or self.get_compression_codec(obj) is not None
+                or (self.__small_object_threshold and size <= self.__small_object_threshold)):
+            meta_data = await self.upload_object(obj)
+        else:
+            self._check_not_exists(object_name, object_type)
+            staging_path = os.path.join(self.__bck_name, f".{obj.get_uuid()}.partial")
+            data_file_name = str(obj.get_uuid())
+            os.makedirs(staging_path)
+
+            def concat_and_publish():
+                try:
+                    size, digest = concat_files(part_paths, os.path.join(staging_path, data_file_name))
+                    return self._publish_staged(obj, staging_path, LAYOUT_FILE, data_file_name, size, digest)
+                except BaseException:
+                    shutil.rmtree(staging_path, ignore_errors=True)
+                    raise
+
+            # the worker thread owns the staging directory, a cancelled request leaves it to finish
+            meta_data = await asyncio.to_thread(concat_and_publish)
+
+        shutil.rmtree(upload_path, ignore_errors=True)
+        self.logger.log(f"Multipart upload '{upload_id}' completed with {len(numbers)} parts")
+        return meta_data
+
+    def abort_multipart_upload(self, upload_id, object_name, object_type):
+        """
+        Aborts a multipart upload and removes its parts.
+
+        :param  upload_id:
+        :param  object_name:
+        :param  object_type:
+        :return None:
+        :raise  UploadNotFoundException:
+        """
+        _, upload_path = self._read_upload(upload_id, object_name, object_type)
+        shutil.rmtree(upload_path, ignore_errors=True)
+        self.logger.log(f"Multipart upload '{upload_id}' aborted")
+
+    def get_cache(self):
+        return self.__cache
+
+    def get_cached_object(self, object_name, object_type):
+        """
+        Resolves an object through the object cache, hot objects are
+        returned with their data without touching the index or the disk.
 
-        object_data = None
-        object_meta_data = None
+        :param  object_name:
+        :param  object_type:
+        :return record dict and the object data, None when not cached:
+        :raise  NotFoundException:
+        """
+        if self.__cache is None:
+            return self.get_object_record(object_name, object_type), None
+        object_key = ObjectIndex.get_object_key(object_name, object_type)
+        # taken before the lookup, data read after an invalidation is not cached
+        epoch = self.__cache.get_epoch()
+        cached = self.__cache.get_value(object_key)
+        if cached is not None:
+            return cached
+        record = self.get_object_record(object_name, object_type)
+        record["cache_epoch"] = epoch
+        return record, None
+
+    def load_cached_object(self, record):
+        """
+        Reads an object into the cache if it is small enough and the
+        admission policy ranks it above the entries it would evict.
 
-        for root, dirs, files in os.walk(path):
-            for file in files:
-                if file == "meta_data.json":
-                    async with aiofiles.open(os.path.join(root, file), "r") as meta_file:
-                        object_meta_data = await meta_file.read()
+        :param  record: as returned by get_cached_object
+        :return the object data or None when it is not cached:
+        """
+        if self.__cache is None or record["size"] > CACHE_MAX_OBJECT_SIZE:
+            return None
+        object_key = ObjectIndex.get_object_key(record["object_name"], record["object_type"])
+        if not self.__cache.should_admit(object_key, record["size"]):
+            return None
+        data = b"".join(self.iter_object_data(record))
+        if not self.__cache.add_val(object_key, (record, data), len(data), record.get("cache_epoch")):
+            return None
+        return data
+
+    def _object_changed(self, object_name, object_type):
+        """
+        Called once an object was published or deleted, drops it from
+        the cache, marks its merkle tree leaf for recomputation and
+        moves it in the geo index.
+
+        :param  object_name:
+        :param  object_type:
+        :return None:
+        """
+        object_key = ObjectIndex.get_object_key(object_name, object_type)
+        if self.__cache is not None:
+            self.__cache.invalidate(object_key)
+        with self.__merkle_lock:
+            if self.__merkle_tree is not None:
+                self.__merkle_tree.mark_dirty(object_key)
+        with self.__geo_lock:
+            if self.__geo_index is not None:
+                # the index is authoritative whatever order changes arrive in
+                record = self.get_index().get(object_name, object_type)
+                meta_data = record["meta_data"] if record is not None else {}
+                if "lat" in meta_data and "lon" in meta_data:
+                    self.__geo_index.insert(object_key, meta_data["lat"], meta_data["lon"])
                 else:
-                    async with aiofiles.open(os.path.join(root, file), "rb") as data_file:
-                        object_data = await data_file.read()
+                    self.__geo_index.delete(object_key)
+
+    def get_geo_index(self):
+        """
+        Returns the spatial index of the geo-tagged objects, built from
+        the metadata index on first use and kept up to date afterwards.
+
+        :return GeoIndex:
+        """
+        with self.__geo_lock:
+            if self.__geo_index is None:
+                geo_index = GeoIndex()
+                locations = self.get_index().get_locations()
+                geo_index.insert_many([location[0] for location in locations],
+                                      [location[1] for location in locations],
+                                      [location[2] for location in locations])
+                self.__geo_index = geo_index
+            return self.__geo_index
+
+    def get_merkle_tree(self):
+        """
+        Returns the merkle tree of the (object key, digest) pairs used
+        for anti-entropy repair. The tree is built from the index on
+        first use and its changed leaves are recomputed on every call.
+
+        :return MerkleTree:
+        """
+        with self.__merkle_lock:
+            if self.__merkle_tree is None:
+                tree = MerkleTree()
+                tree.build(self.get_index().get_digests())
+                self.__merkle_tree = tree
+            self.__merkle_tree.refresh(self.get_index().get_digests)
+            return self.__merkle_tree
+
+    def get_leaf_entries(self, leaves):
+        """
+        (object key, digest) pairs of merkle tree leaves.
+
+        :param  leaves: leaf indexes
+        :return list of (object key, digest):
+        """
+        tree = self.get_merkle_tree()
+        entries = []
+        for leaf in leaves:
+            entries += self.get_index().get_digests(*tree.get_leaf_range(leaf))
+        return entries
+
+    def get_object_record(self, object_name, object_type):
+        """
+        Resolves an object through the index without touching its data.
+        For objects with the file layout the data_path of the record can
+        be served directly with sendfile or read by byte ranges.
+
+        :param  object_name:
+        :param  object_type:
+        :return record dict with data_path, size, layout and meta_data:
+        :raise  NotFoundException:
+        """
+        record = self.get_index().get(object_name, object_type)
+        if record is None:
+            raise NotFoundException(
+                f"Object '{object_name}' of type '{object_type}' not found in bucket '{self.__bck_name}'")
+        return record
+
+    def iter_object_data(self, record, start: int = 0, end=None):
+        """
+        Streams the bytes [start, end) of an object whatever its layout,
+        compressed objects are decompressed on the fly.
+
+        :param  record: as returned by get_object_record
+        :param  start:
+        :param  end: exclusive, defaults to the object size
+        :return generator of bytes:
+        """
+        codec = record["meta_data"].get("compression")
+        if codec is None:
+            yield from self.iter_stored_data(record, start, end)
+            return
+        end = record["size"] if end is None else end
+        yield from iter_decompressed(codec, self.iter_stored_data(record), start, end)
+
+    def iter_stored_data(self, record, start: int = 0, end=None):
+        """
+        Streams the bytes [start, end) of an object as they are stored,
+        compressed objects are not decompressed.
+
+        :param  record: as returned by get_object_record
+        :param  start:
+        :param  end: exclusive, defaults to the stored size
+        :return generator of bytes:
+        """
+        end = record["meta_data"].get("compressed_size", record["size"]) if end is None else end
+        if record["layout"] == LAYOUT_PACKED:
+            if end > start:
+                yield self.get_segment_store().read(os.path.basename(record["data_path"]),
+                                                    record["data_offset"] + start, end - start)
+            return
+        if record["layout"] == LAYOUT_CHUNKED:
+            if "chunks" not in record:
+                with open(record["data_path"], "r") as manifest_file:
+                    record["chunks"] = json.load(manifest_file)["chunks"]
+            yield from self.get_chunk_store().iter_range(record["chunks"], start, end)
+            return
+        if record["layout"] == LAYOUT_ERASURE:
+            if "shards" not in record:
+                with open(record["data_path"], "r") as manifest_file:
+                    record["shards"] = json.load(manifest_file)
+            yield from self.get_erasure_store().iter_range(record["shards"], start, end)
+            return
+
+        with open(record["data_path"], "rb") as data_file:
+            data_file.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                chunk = data_file.read(min(DOWNLOAD_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    def delete_object(self, object_name, object_type):
+        """
+        Deletes an object, chunks of deduplicated objects are released
+        and removed once no other object references them.
 
-        if object_data is None:
+        :param  object_name:
+        :param  object_type:
+        :return None:
+        :raise  NotFoundException:
+        """
+        record = self.get_object_record(object_name, object_type)
+        delete_record = {"op": "delete", "object_name": object_name, "object_type": object_type,
+                         "layout": record["layout"]}
+        if record["layout"] == LAYOUT_PACKED:
+            with self.__segment_lock, self._log_mutation(delete_record):
+                if self.get_index().delete(object_name, object_type):
+                    self.get_segment_store().append_tombstone(ObjectIndex.get_object_key(object_name, object_type))
+            self._object_changed(object_name, object_type)
+            self.logger.log(f"Object '{object_name}' of type '{object_type}' deleted successfully")
+            return
+        chunks = []
+        shards = None
+        if record["layout"] == LAYOUT_CHUNKED:
+            with open(record["data_path"], "r") as manifest_file:
+                chunks = json.load(manifest_file)["chunks"]
+        elif record["layout"] == LAYOUT_ERASURE:
+            with open(record["data_path"], "r") as manifest_file:
+                shards = json.load(manifest_file)
+        with self._log_mutation(delete_record):
+            self.get_index().delete(object_name, object_type)
+            self._object_changed(object_name, object_type)
+            shutil.rmtree(self.get_path(object_name, object_type), ignore_errors=True)
+        if chunks:
+            self.get_chunk_store().release_chunks([chunk_digest for chunk_digest, _ in chunks])
+        if shards is not None:
+            self.get_erasure_store().delete(shards)
+        self.logger.log(f"Object '{object_name}' of type '{object_type}' deleted successfully")
+
+    def get_storage_stats(self):
+        """
+        Object count and size of the bucket, plus the dedup ratio and
+        ingest throughput of the chunk store when dedup is enabled.
+
+        :return dict:
+        """
+        index = self.get_index()
+        stats = {
+            "bucket": self.__bck_name,
+            "objects": index.count(),
+            "bytes": index.total_size(),
+            "dedup": None,
+            "compression": self.__compression,
+            "wal": self.get_wal().get_stats(),
+            "cache": self.__cache.get_stats() if self.__cache is not None else None,
+        }
+        if self.__dedup:
+            stats["dedup"] = self.get_chunk_store().get_stats()
+        if self.__erasure is not None:
+            stats["erasure"] = self.get_erasure_store().get_stats()
+        if self.__small_object_threshold:
+            segment_sizes = self.get_segment_store().get_segment_sizes()
+            stats["segments"] = {
+                "count": len(segment_sizes),
+                "bytes": sum(segment_sizes.values()),
+                "live_bytes": sum(index.get_packed_live_bytes(RECORD_HEADER.size).values()),
+            }
+        return stats
+
+    def list_objects(self, prefix: str = "", start_after: str = "", limit: int = MAX_LIST_LIMIT,
+                     continuation_token=None):
+        """
+        Lists the objects of the bucket in lexicographic key order.
+        Pages are served from the sorted object index, so a page costs
+        O(log n + limit) and memory does not grow with the bucket size.
+
+        :param  prefix: only keys starting with the prefix are listed
+        :param  start_after: only keys after this key are listed
+        :param  limit: page size, capped at MAX_LIST_LIMIT
+        :param  continuation_token: token returned by the previous page
+        :return dict with the objects and the next continuation token:
+        :raise  ValueError for an invalid continuation token:
+        """
+        if continuation_token:
+            try:
+                start_after = max(start_after,
+                                  base64.urlsafe_b64decode(continuation_token.encode()).decode())
+            except (ValueError, UnicodeDecodeError):
+                raise ValueError("Invalid continuation token")
+        limit = max(1, min(int(limit), MAX_LIST_LIMIT))
+
+        # one extra row tells whether another page exists
+        records = self.get_index().list(prefix, start_after, limit + 1)
+        is_truncated = len(records) > limit
+        records = records[:limit]
+        objects = [self._to_listing(record) for record in records]
+
+        next_token = None
+        if is_truncated:
+            next_token = base64.urlsafe_b64encode(objects[-1]["key"].encode()).decode()
+        return {
+            "objects": objects,
+            "is_truncated": is_truncated,
+            "next_continuation_token": next_token,
+        }
+
+    @staticmethod
+    def _to_listing(record):
+        return {
+            "key": ObjectIndex.get_object_key(record["object_name"], record["object_type"]),
+            "object_name": record["object_name"],
+            "object_type": record["object_type"],
+            "size": record["size"],
+            "sha256": record["digest"],
+        }
+
+    def query_objects(self, filters, limit: int = MAX_LIST_LIMIT, continuation_token=None):
+        """
+        Finds objects by their metadata through the inverted metadata
+        index of the object index, no meta_data.json is opened.
+
+        :param  filters: list of (key, operator, value), operators are
+                         eq, prefix, gt, gte, lt and lte
+        :param  limit: page size, capped at MAX_LIST_LIMIT
+        :param  continuation_token: token returned by the previous page
+        :return dict with the objects and the next continuation token:
+        :raise  ValueError for invalid filters or continuation token:
+        """
+        start_after = None
+        if continuation_token:
+            try:
+                start_after = json.loads(base64.urlsafe_b64decode(continuation_token.encode()))
+            except (ValueError, UnicodeDecodeError):
+                raise ValueError("Invalid continuation token")
+            if not isinstance(start_after, list) or len(start_after) != 2:
+                raise ValueError("Invalid continuation token")
+        limit = max(1, min(int(limit), MAX_LIST_LIMIT))
+
+        # one extra row tells whether another page exists
+        rows = self.get_index().query(filters, start_after, limit + 1)
+        is_truncated = len(rows) > limit
+        rows = rows[:limit]
+        objects = [dict(self._to_listing(record), meta_data=record["meta_data"]) for _, record in rows]
+
+        next_token = None
+        if is_truncated:
+            value, record = rows[-1]
+            last = [value, ObjectIndex.get_object_key(record["object_name"], record["object_type"])]
+            next_token = base64.urlsafe_b64encode(json.dumps(last).encode()).decode()
+        return {
+            "objects": objects,
+            "is_truncated": is_truncated,
+            "next_continuation_token": next_token,
+        }
+
+    def query_near(self, latitude: float, longitude: float, radius: float, limit: int = MAX_LIST_LIMIT,
+                   continuation_token=None):
+        """
+        Finds the geo-tagged objects within a distance of a location,
+        nearest first, through the geo index of the bucket.
+
+        :param  latitude:
+        :param  longitude:
+        :param  radius: meters
+        :param  limit: page size, capped at MAX_LIST_LIMIT
+        :param  continuation_token: token returned by the previous page
+        :return dict with the objects and the next continuation token:
+        :raise  ValueError for an invalid continuation token:
+        """
+        start_after = None
+        if continuation_token:
+            try:
+                start_after = tuple(json.loads(base64.urlsafe_b64decode(continuation_token.encode())))
+            except (ValueError, TypeError, UnicodeDecodeError):
+                raise ValueError("Invalid continuation token")
+            if len(start_after) != 2:
+                raise ValueError("Invalid continuation token")
+        limit = max(1, min(int(limit), MAX_LIST_LIMIT))
+
+        # ordered by (distance, key) so pages are stable for equal distances
+        points = sorted(self.get_geo_index().query_radius(latitude, longitude, radius),
+                        key=lambda point: (point[3], point[0]))
+        if start_after is not None:
+            points = [point for point in points if (point[3], point[0]) > start_after]
+        objects = []
+        for object_key, lat, lon, distance in points:
+            if len(objects) > limit:
+                break
+            record = self.get_index().get(*split_object_name(object_key))
+            if record is not None:
+                objects.append(dict(self._to_listing(record), meta_data=record["meta_data"], distance=distance))
+
+        # one extra object tells whether another page exists
+        is_truncated = len(objects) > limit
+        objects = objects[:limit]
+        next_token = None
+        if is_truncated:
+            last = [objects[-1]["distance"], objects[-1]["key"]]
+            next_token = base64.urlsafe_b64encode(json.dumps(last).encode()).decode()
+        return {
+            "objects": objects,
+            "is_truncated": is_truncated,
+            "next_continuation_token": next_token,
+        }
+
+    async def download_object(self, object_name, object_type):
+        """Handles the download logic for objects."""
+        with span("lookup"):
+            record, object_data = self.get_cached_object(object_name, object_type)
+        try:
+            if object_data is None:
+                with span("load_cached_object", size=record["size"]):
+                    object_data = await asyncio.to_thread(self.load_cached_object, record)
+            if object_data is None:
+                with span("read_object_data", size=record["size"], layout=record["layout"]):
+                    object_data = await asyncio.to_thread(lambda: b"".join(self.iter_object_data(record)))
+        except FileNotFoundError:
             raise Exception("Failed to read object data")
-        if object_meta_data is None:
-            raise Exception("Failed to read object metadata")
-        meta_data_dict = json.loads(object_meta_data)
-        return object_data, meta_data_dict
+        return object_data, record["meta_data"]
+
+
+async def read_small_object(data, limit: int):
+    """
+    Reads up to limit bytes of the object data to find out whether the
+    object is small. Small objects are returned whole, otherwise the
+    already read bytes are chained in front of the rest of the stream.
+
+    :param  data:
+    :param  limit:
+    :return the object bytes or None, and the data to stream otherwise:
+    """
+    chunks = iter_chunks(data)
+    head = bytearray()
+    async for chunk in chunks:
+        head += chunk
+        if len(head) > limit:
+            break
+    else:
+        return bytes(head), None
+
+    async def chained():
+        yield bytes(head)
+        async for rest in chunks:
+            yield rest
+
+    return None, chained()
+
+
+async def iter_files(paths):
+    """
+    Yields the contents of several files one after the other.
+
+    :param  paths:
+    :return async generator of bytes:
+    """
+    for path in paths:
+        async with aiofiles.open(path, "rb") as data_file:
+            while True:
+                chunk = await data_file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+
+
+def concat_files(paths, target_path):
+    """
+    Concatenates files into target_path and computes the sha256 of the
+    result. copy_file_range keeps the copy inside the kernel (and lets
+    filesystems share extents), the digest is computed from reads of the
+    sources, which just were written and come from the page cache.
+    Platforms without copy_file_range fall back to a buffered copy.
+
+    :param  paths:
+    :param  target_path:
+    :return int, the size of the target file, and str, its sha256 hex digest:
+    """
+    size = 0
+    digest = hashlib.sha256()
+    buffer = bytearray(UPLOAD_CHUNK_SIZE)
+    with open(target_path, "wb") as target_file:
+        for path in paths:
+            with open(path, "rb") as source_file:
+                while True:
+                    read = source_file.readinto(buffer)
+                    if not read:
+                        break
+                    digest.update(memoryview(buffer)[:read])
+                source_file.seek(0)
+                remaining = os.fstat(source_file.fileno()).st_size
+                try:
+                    while remaining > 0 and hasattr(os, "copy_file_range"):
+                        copied = os.copy_file_range(source_file.fileno(), target_file.fileno(), remaining)
+                        if copied == 0:
+                            break
+                        remaining -= copied
+                        size += copied
+                except OSError:
+                    # e.g. filesystems which do not support it
+                    pass
+                if remaining > 0:
+                    shutil.copyfileobj(source_file, target_file, UPLOAD_CHUNK_SIZE)
+                    size += remaining
+    return size, digest.hexdigest()
+
+
+def parse_byte_ranges(range_header, size: int):
+    """
+    Resolves an HTTP Range header against an object of the given size.
+
+    :param  range_header:
+    :param  size:
+    :return None when the header is absent, invalid or should be ignored,
+            otherwise a list of (start, end) with end exclusive, the list
+            is empty when none of the ranges is satisfiable:
+    """
+    if not range_header:
+        return None
+    parsed = parse_range_header(range_header)
+    if parsed is None or parsed.units != "bytes" or len(parsed.ranges) > MAX_BYTE_RANGES:
+        return None
+
+    ranges = []
+    for start, end in parsed.ranges:
+        if start < 0:
+            # suffix range, the last -start bytes of the object
+            start = max(size + start, 0)
+            end = size
+        else:
+            end = size if end is None else min(end, size)
+        if start < end:
+            ranges.append((start, end))
+    return ranges
+
+
+def plan_multipart_byteranges(ranges, size: int, content_type: str, boundary: str):
+    """
+    Lays out a multipart/byteranges body without reading any data,
+    so the body can be streamed from disk with a known length.
+
+    :param  ranges:
+    :param  size:
+    :param  content_type:
+    :param  boundary:
+    :return list of (part header, start, end), closing bytes and total length:
+    """
+    parts = []
+    length = 0
+    for start, end in ranges:
+        header = (f"--{boundary}\r\n"
+                  f"Content-Type: {content_type}\r\n"
+                  f"Content-Range: bytes {start}-{end - 1}/{size}\r\n\r\n").encode()
+        parts.append((header, start, end))
+        length += len(header) + (end - start) + 2
+    closing = f"--{boundary}--\r\n".encode()
+    return parts, closing, length + len(closing)
+
+
+def iter_multipart_byteranges(read_range, parts, closing):
+    """
+    Streams a planned multipart/byteranges body.
+
+    :param  read_range: callable(start, end) yielding the bytes of a range
+    :param  parts:
+    :param  closing:
+    :return generator of bytes:
+    """
+    for header, start, end in parts:
+        yield header
+        yield from read_range(start, end)
+        yield b"\r\n"
+    yield closing
 
 
 class FileMimeTypes:
@@ -657,9 +2544,31 @@ class FileMimeTypes:
     def __init__(self) -> None:
         self.mime_db = [
             "image",
-            "videos"
+            "videos",
+            "video",
+            "audio"
+        ]
+        # object types whose formats are compressed already
+        self.compressed_types = [
+            "gz", "tgz", "bz2", "xz", "zst", "lz4", "zip", "7z", "rar",
+            "jpg", "jpeg", "png", "gif", "webp", "heic",
+            "mp3", "aac", "ogg", "flac", "mp4", "mkv", "webm", "mov", "avi",
+            "pdf", "docx", "xlsx", "pptx", "jar", "apk"
         ]
 
+    def is_compressible(self, object_type, content_type=None):
+        """
+        Checks whether compressing an object can pay off, media and
+        archives are compressed already.
+
+        :param  object_type:
+        :param  content_type: e.g. 'text/plain', may be None
+        :return bool:
+        """
+        if content_type and content_type.split("/")[0] in self.mime_db:
+            return False
+        return str(object_type).lower() not in self.compressed_types
+
 
 class Object:
     """
@@ -674,6 +2583,9 @@ class Object:
     object_id
     object_bucket_name
     object_data
+
+    The compressed flag allows the bucket to compress the object, it is
+    cleared for types FileMimeTypes knows to be compressed already.
     """
 
     def __init__(self,
@@ -681,7 +2593,8 @@ class Object:
                  object_bucket_name,
                  object_type,
                  object_data,
-                 object_meta_data) -> None:
+                 object_meta_data,
+                 object_compressed_flag: bool = True) -> None:
 
         self.__mime_db = FileMimeTypes()
 
@@ -695,16 +2608,14 @@ class Object:
         if not os.path.exists(object_bucket_name):
             raise BucketNotFoundException()
 
-        if object_name in os.listdir():
-            raise ObjectAlreadyExistsException()
-
         self.__uuid = uuid.uuid4()
         self.__object_name = object_name
         self.__object_type = object_type
         self.__object_data = object_data
         self.__object_bucket_name = object_bucket_name
         self.__object_meta_data = object_meta_data
-        self.__logger = FileLogger(str(self.get_object_name()))
+        self.__object_compressed_flag = object_compressed_flag and self.__mime_db.is_compressible(
+            object_type, object_meta_data.get("content_type"))
         self.__meta_data_manager = MetaData()
 
         base_meta_data = {
@@ -714,8 +2625,9 @@ class Object:
             "object_type": self.__object_type,
         }
 
+        self.__meta_data_manager.add_all_meta_data({key: value for key, value in self.__object_meta_data.items()
+                                                    if key not in RESERVED_META_DATA_KEYS})
         self.__meta_data_manager.add_all_meta_data(base_meta_data)
-        self.__meta_data_manager.add_all_meta_data(self.__object_meta_data)
 
     def get_object_name(self):
         return self.__object_name
@@ -735,25 +2647,100 @@ class Object:
     def get_uuid(self):
         return self.__uuid
 
-    # def encode_object_data(self):
-    #     encoder = ReedSolomonEncoder(data_shards=6, parity_shards=3)  # Example parameters, adjust as needed
-    #     self.__object_data = encoder.encode(self.__object_data)
-    #
-    # def decode_object_data(self):
-    #     encoder = ReedSolomonEncoder(data_shards=6, parity_shards=3)  # Example parameters, adjust as needed
-    #     self.__object_data = encoder.decode(self.__object_data)
+    def get_object_compressed_flag(self):
+        return self.__object_compressed_flag
+
+
+def get_bucket_metrics(_bucket):
+    """
+    Metrics collector of a bucket, read from its stats when /metrics is
+    scraped.
+
+    :param  _bucket:
+    :return list of (name, kind, documentation, [(labels, value)]):
+    """
+    stats = _bucket.get_storage_stats()
+    labels = {"bucket": stats["bucket"]}
+    families = [
+        ("datadepot_bucket_objects", GAUGE, "Objects stored in the bucket", [(labels, stats["objects"])]),
+        ("datadepot_bucket_bytes", GAUGE, "Bytes of the objects stored in the bucket", [(labels, stats["bytes"])]),
+        ("datadepot_wal_batches_total", COUNTER, "Write-ahead log batches written",
+         [(labels, stats["wal"]["batches"])]),
+        ("datadepot_wal_fsyncs_total", COUNTER, "Write-ahead log fsyncs", [(labels, stats["wal"]["fsyncs"])]),
+    ]
+    cache = stats["cache"]
+    if cache is not None:
+        families += [
+            ("datadepot_cache_entries", GAUGE, "Objects in the cache", [(labels, cache["entries"])]),
+            ("datadepot_cache_bytes", GAUGE, "Bytes of the objects in the cache", [(labels, cache["bytes"])]),
+        ]
+        for counter in ("hits", "misses", "puts", "evictions", "rejections"):
+            families.append((f"datadepot_cache_{counter}_total", COUNTER, f"Cache {counter}",
+                             [(labels, cache[counter])]))
+    return families
+
+
+def instrument_app(flask_app):
+    """
+    Records the count, latency, body bytes and in-flight requests of
+    every endpoint of a Flask app. The latency runs until the response
+    is closed, after its body was sent. Files sent with send_file are
+    handed to the server as they are to keep its sendfile path, for
+    them it ends when the file is handed over.
+
+    :param  flask_app:
+    :return None:
+    """
+    @flask_app.before_request
+    def start_request_metrics():
+        g.metrics_endpoint = request.endpoint or "unknown"
+        g.metrics_started = time.perf_counter()
+        HTTP_REQUESTS_IN_FLIGHT.inc((g.metrics_endpoint,))
+
+    @flask_app.after_request
+    def finish_request_metrics(response):
+        started = g.pop("metrics_started", None)
+        if started is None:
+            return response
+        endpoint, method, status = g.metrics_endpoint, request.method, response.status_code
+        request_bytes, response_bytes = request.content_length or 0, response.content_length or 0
+
+        def finish():
+            record_request(endpoint, method, status, time.perf_counter() - started, request_bytes, response_bytes)
+            HTTP_REQUESTS_IN_FLIGHT.dec((endpoint,))
+
+        if response.direct_passthrough:
+            # werkzeug does not run the close callbacks of these
+            finish()
+        else:
+            response.call_on_close(finish)
+        return response
 
 
 app = Flask(__name__)
+instrument_app(app)
 
 # Create a bucket
-bucket_name = "test_bucket"
-bucket = Bucket(bucket_name, is_private=False)
+bucket_name = os.environ.get("DATADEPOT_BUCKET", "test_bucket")
+bucket = Bucket(bucket_name, is_private=False, dedup=os.environ.get("DATADEPOT_DEDUP") == "1",
+                small_object_threshold=int(os.environ.get("DATADEPOT_SMALL_OBJECT_THRESHOLD", 0)) or None,
+                compression=os.environ.get("DATADEPOT_COMPRESSION") or None,
+                erasure=tuple(map(int, os.environ["DATADEPOT_ERASURE"].split("+")))
+                if os.environ.get("DATADEPOT_ERASURE") else None,
+                durability=os.environ.get("DATADEPOT_WAL_DURABILITY", DURABILITY_SYNC),
+                cache_bytes=int(os.environ.get("DATADEPOT_CACHE_BYTES", 0)))
 bucket.create_bucket()
+if os.environ.get("DATADEPOT_SMALL_OBJECT_THRESHOLD"):
+    bucket.start_compaction()
+
+# Traces a fraction of the uploads and downloads, off by default
+tracer = Tracer(os.environ.get("DATADEPOT_TRACE_FILE", TRACE_FILE_NAME),
+                sample_rate=float(os.environ.get("DATADEPOT_TRACE_SAMPLE_RATE", 0)))
 
 
 # Endpoint for uploading an object
 @app.route('/upload/<object_name>', methods=['POST'])
+@tracer.traced("POST /upload")
 def upload_object(object_name):
     """
     Takes in a file and name and uploads to the storage bucket
@@ -762,23 +2749,40 @@ def upload_object(object_name):
     :return json-resp and status code:
     """
 
-    # Get object data from request
-    object_data = request.files['object_data'].read()
-    index = object_name.index(".")
-    object_type = str(object_name)[index + 1:]
-    _object_name = str(object_name)[:index]
-    object_meta_data = {"type": object_type}
+    # Stream the object data from the request, multipart uploads are
+    # spooled to disk by werkzeug while raw bodies are read directly
+    with span("parse_request"):
+        if request.mimetype == "multipart/form-data":
+            object_data = request.files['object_data'].stream
+            content_type = request.files['object_data'].mimetype
+        else:
+            object_data = request.stream
+            content_type = request.mimetype
+        _object_name, object_type = split_object_name(object_name)
+    try:
+        object_meta_data = get_user_meta_data(request.headers.items())
+        object_meta_data.update({"type": object_type, "content_type": content_type})
+        add_geo_meta_data(object_meta_data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    # Create and encode the object
-    obj = Object(_object_name, bucket_name, object_type, object_data, object_meta_data)
-    # obj.encode_object_data()  # Encode object data using Reed-Solomon
-    asyncio.run(bucket.upload_object(obj))
+    try:
+        # Create and encode the object
+        with span("create_object"):
+            obj = Object(_object_name, bucket_name, object_type, object_data, object_meta_data)
+        with span("bucket_upload"):
+            meta_data = asyncio.run(bucket.upload_object(obj))
+    except ObjectAlreadyExistsException as e:
+        return jsonify({"error": str(e)}), 409
 
-    return jsonify({"message": "Object uploaded successfully"}), 200
+    return jsonify({"message": "Object uploaded successfully",
+                    "size": meta_data["size"],
+                    "sha256": meta_data["sha256"]}), 200
 
 
 # Modify the download endpoint to decode object data after downloading
 @app.route('/download/<object_name>/<object_t>/<object_type>', methods=['GET'])
+@tracer.traced("GET /download")
 def download_object(object_t, object_name, object_type):
     """
     End Point for downloading the object from the bucket
@@ -791,26 +2795,504 @@ def download_object(object_t, object_name, object_type):
     :return metadata and object_data:
     """
     try:
-        # Download the object
-        object_data, meta_data = asyncio.run(bucket.download_object(object_name, object_type))
-
-        # Decode object data using Reed-Solomon
-        obj = Object(object_name, bucket_name, object_type, object_data, meta_data)
-        # obj.decode_object_data()
+        with span("lookup"):
+            record, data = bucket.get_cached_object(object_name, object_type)
+    except NotFoundException as e:
+        return jsonify({"error": str(e)}), 404
 
-        # Create a response
-        object_extension = meta_data["type"]
+    meta_data = record["meta_data"]
+    size = record["size"]
+    object_extension = meta_data["type"]
+    mimetype = f'{object_t}/{object_extension}'  # Adjust the mimetype as per your image type
+    ranges = parse_byte_ranges(request.headers.get("Range"), size)
+    if ranges is not None and "If-Range" in request.headers and request.if_range.etag != meta_data["sha256"]:
+        # the copy of the client is stale, it gets the full object
+        ranges = None
+    if ranges is None:
+        # an ignored Range header must not be parsed again by werkzeug
+        request.environ.pop("HTTP_RANGE", None)
+    codec = meta_data.get("compression")
+    content_encoding = CONTENT_ENCODINGS.get(codec)
+    passthrough = accepts_encoding(request.headers.get("Accept-Encoding"), content_encoding)
+    if data is None and not passthrough:
+        with span("load_cached_object", size=size):
+            data = bucket.load_cached_object(record)
+
+    if passthrough:
+        # The stored bytes already are the encoded representation
+        if record["layout"] == LAYOUT_FILE:
+            response = make_response(send_file(
+                os.path.abspath(record["data_path"]),
+                mimetype=mimetype,
+                conditional=True,
+                etag=f'{meta_data["sha256"]}-{content_encoding}',
+            ))
+        else:
+            response = Response(bucket.iter_stored_data(record), mimetype=mimetype)
+            response.headers['Content-Length'] = str(meta_data["compressed_size"])
+        response.headers['Content-Encoding'] = content_encoding
+    elif ranges is not None and not ranges:
+        response = Response(status=416)
+        response.headers['Content-Range'] = f"bytes */{size}"
+    elif ranges is not None and len(ranges) > 1:
+        # Multi-range requests are streamed as multipart/byteranges
+        boundary = uuid.uuid4().hex
+        parts, closing, length = plan_multipart_byteranges(ranges, size, mimetype, boundary)
+        if data is not None:
+            read_range = lambda start, end: [data[start:end]]
+        else:
+            read_range = functools.partial(bucket.iter_object_data, record)
+        response = Response(iter_multipart_byteranges(read_range, parts, closing), status=206,
+                            mimetype=f"multipart/byteranges; boundary={boundary}")
+        response.headers['Content-Length'] = str(length)
+        response.headers['Accept-Ranges'] = "bytes"
+    elif ranges is not None:
+        # The single satisfiable range, werkzeug would answer 416 to a
+        # multi-range header of which only one range is satisfiable
+        start, end = ranges[0]
+        if data is not None:
+            body = [data[start:end]]
+        else:
+            body = bucket.iter_object_data(record, start, end)
+        response = Response(body, status=206, mimetype=mimetype)
+        response.set_etag(meta_data["sha256"])
+        response.headers['Content-Range'] = f"bytes {start}-{end - 1}/{size}"
+        response.headers['Content-Length'] = str(end - start)
+        response.headers['Accept-Ranges'] = "bytes"
+    elif data is not None:
+        # Cached objects are served from memory, werkzeug handles
+        # conditional requests
+        response = Response(data, mimetype=mimetype)
+        response.set_etag(meta_data["sha256"])
+        response.make_conditional(request, accept_ranges=True, complete_length=size)
+    elif record["layout"] == LAYOUT_FILE and codec is None:
+        # Conditional requests and full downloads are served from the
+        # data file path so werkzeug can use the sendfile path
         response = make_response(send_file(
-            io.BytesIO(obj.get_object_data()),
-            mimetype=f'{object_t}/{object_extension}',  # Adjust the mimetype as per your image type
+            os.path.abspath(record["data_path"]),
+            mimetype=mimetype,
+            conditional=True,
+            etag=meta_data.get("sha256", True),
         ))
+    else:
+        response = Response(bucket.iter_object_data(record), mimetype=mimetype)
+        response.headers['Content-Length'] = str(size)
+        response.headers['Accept-Ranges'] = "bytes"
 
-        # Include metadata as custom headers
-        response.headers['X-Metadata'] = json.dumps(meta_data)
+    if codec is not None:
+        response.vary.add("Accept-Encoding")
 
-        return response
+    # Include metadata as custom headers
+    response.headers['X-Metadata'] = json.dumps(meta_data)
+
+    return response
+
+
+def get_user_meta_data(headers):
+    """
+    Collects the user metadata sent as X-Meta-<key> request headers.
+
+    :param  headers: iterable of (name, value)
+    :return dict with the lower cased keys:
+    :raise  ValueError for a key the bucket sets itself:
+    """
+    meta_data = {name[len(USER_META_DATA_HEADER_PREFIX):].lower(): value
+                 for name, value in headers
+                 if name.lower().startswith(USER_META_DATA_HEADER_PREFIX)
+                 and len(name) > len(USER_META_DATA_HEADER_PREFIX)}
+    for key in meta_data:
+        if key in RESERVED_USER_META_DATA_KEYS:
+            raise ValueError(f"Metadata key '{key}' is reserved")
+    return meta_data
+
+
+def add_geo_meta_data(meta_data: dict):
+    """
+    Geo-tags the metadata of an upload carrying lat and lon, their
+    values become numbers and the geohash of the location is added.
+
+    :param  meta_data: user metadata
+    :return the metadata:
+    :raise  ValueError for a partial or invalid location:
+    """
+    if "lat" not in meta_data and "lon" not in meta_data:
+        return meta_data
+    try:
+        latitude, longitude = float(meta_data["lat"]), float(meta_data["lon"])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("Geo-tagged objects need numeric lat and lon metadata")
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError("lat must be within [-90, 90] and lon within [-180, 180]")
+    meta_data.update({"lat": latitude, "lon": longitude,
+                      "geohash": encode(latitude, longitude, GEOHASH_PRECISION)})
+    return meta_data
+
+
+def parse_location(args):
+    """
+    Parses the lat, lon and radius query parameters of a /near query.
+
+    :param  args: query parameters
+    :return latitude, longitude and radius in meters:
+    :raise  ValueError:
+    """
+    try:
+        latitude, longitude, radius = float(args["lat"]), float(args["lon"]), float(args["radius"])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("lat, lon and radius (meters) are required numbers")
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180) or not radius >= 0:
+        raise ValueError("lat must be within [-90, 90], lon within [-180, 180] and radius positive")
+    return latitude, longitude, radius
+
+
+def parse_query_filter(value):
+    """
+    Parses a filter=<key>:<operator>:<value> query parameter, values of
+    range operators are compared as numbers when they look like one.
+
+    :param  value:
+    :return (key, operator, value):
+    :raise  ValueError:
+    """
+    parts = value.split(":", 2)
+    if len(parts) != 3 or not parts[0]:
+        raise ValueError(f"Invalid filter '{value}', expected <key>:<operator>:<value>")
+    key, operator, operand = parts
+    if operator not in ("eq", "prefix"):
+        operand = parse_query_value(operand)
+    return key, operator, operand
+
+
+def parse_merkle_nodes(body, depth: int):
+    """
+    Parses the json body {"level": 3, "indexes": [0, 5]} of a request
+    for merkle tree node hashes.
+
+    :param  body:
+    :param  depth: of the merkle tree
+    :return level and list of node indexes:
+    :raise  ValueError:
+    """
+    try:
+        level = int(body["level"])
+        indexes = [int(index) for index in body.get("indexes", [])]
+    except (KeyError, TypeError, ValueError, AttributeError) as e:
+        raise ValueError(f"Invalid request: {e}")
+    if not 0 <= level <= depth or any(not 0 <= index < 1 << level for index in indexes):
+        raise ValueError("Invalid request: Node out of range")
+    return level, indexes
+
+
+def parse_merkle_leaves(body, depth: int):
+    """
+    Parses the json body {"leaves": [7, 9]} of a request for the
+    entries of merkle tree leaves.
+
+    :param  body:
+    :param  depth: of the merkle tree
+    :return list of leaf indexes:
+    :raise  ValueError:
+    """
+    try:
+        leaves = [int(leaf) for leaf in body.get("leaves", [])]
+    except (TypeError, ValueError, AttributeError) as e:
+        raise ValueError(f"Invalid request: {e}")
+    if any(not 0 <= leaf < 1 << depth for leaf in leaves):
+        raise ValueError("Invalid request: Leaf out of range")
+    return leaves
+
+
+def split_object_name(object_name):
+    """
+    Splits 'name.type' as used in the endpoint urls.
+
+    :param  object_name:
+    :return object name and object type:
+    :raise  InvalidObjectNameException:
+    """
+    object_name, separator, object_type = object_name.partition(".")
+    if not separator:
+        raise InvalidObjectNameException("Object name must include the object type")
+    return object_name, object_type
+
+
+@app.errorhandler(InvalidObjectNameException)
+def invalid_object_name(e):
+    """
+    Object names without a type are rejected the same way by every view.
+
+    :param  e:
+    :return json-resp and status code:
+    """
+    return jsonify({"error": str(e)}), 400
+
+
+@app.route('/multipart/<object_name>', methods=['POST'])
+def create_multipart_upload(object_name):
+    """
+    Starts a multipart upload for the object
+
+    :param  object_name:
+    :return json-resp with the upload id and status code:
+    """
+    _object_name, object_type = split_object_name(object_name)
+    try:
+        upload_id = bucket.create_multipart_upload(_object_name, object_type, {"type": object_type})
+    except ObjectAlreadyExistsException as e:
+        return jsonify({"error": str(e)}), 409
+    return jsonify({"upload_id": upload_id}), 200
+
+
+@app.route('/multipart/<object_name>/<upload_id>/<int:part_number>', methods=['PUT'])
+def upload_part(object_name, upload_id, part_number):
+    """
+    Uploads one part, the raw request body is the part data.
+    Parts are verified against the optional X-Checksum-Sha256
+    and Content-MD5 headers.
+
+    :param  object_name:
+    :param  upload_id:
+    :param  part_number:
+    :return json-resp with the part etag and status code:
+    """
+    _object_name, object_type = split_object_name(object_name)
+    try:
+        part = asyncio.run(bucket.upload_part(upload_id, _object_name, object_type, part_number, request.stream,
+                                              expected_sha256=request.headers.get("X-Checksum-Sha256"),
+                                              expected_md5=request.headers.get("Content-MD5")))
+    except UploadNotFoundException as e:
+        return jsonify({"error": str(e)}), 404
+    except (InvalidPartException, ChecksumMismatchException) as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(part), 200
+
+
+@app.route('/multipart/<object_name>/<upload_id>', methods=['GET'])
+def list_parts(object_name, upload_id):
+    """
+    Lists the parts uploaded so far
+
+    :param  object_name:
+    :param  upload_id:
+    :return json-resp and status code:
+    """
+    _object_name, object_type = split_object_name(object_name)
+    try:
+        parts = bucket.list_parts(upload_id, _object_name, object_type)
+    except UploadNotFoundException as e:
+        return jsonify({"error": str(e)}), 404
+    return jsonify({"upload_id": upload_id, "parts": parts}), 200
+
+
+@app.route('/multipart/<object_name>/<upload_id>/complete', methods=['POST'])
+def complete_multipart_upload(object_name, upload_id):
+    """
+    Completes a multipart upload. The optional json body
+    {"parts": [{"part_number": 1, "etag": "..."}, ...]} selects and
+    verifies the parts, by default every uploaded part is used.
+
+    :param  object_name:
+    :param  upload_id:
+    :return json-resp and status code:
+    """
+    _object_name, object_type = split_object_name(object_name)
+    body = request.get_json(silent=True) or {}
+    try:
+        meta_data = asyncio.run(bucket.complete_multipart_upload(upload_id, _object_name, object_type,
+                                                                 body.get("parts")))
+    except UploadNotFoundException as e:
+        return jsonify({"error": str(e)}), 404
+    except InvalidPartException as e:
+        return jsonify({"error": str(e)}), 400
+    except ObjectAlreadyExistsException as e:
+        return jsonify({"error": str(e)}), 409
+    return jsonify({"message": "Object uploaded successfully",
+                    "size": meta_data["size"],
+                    "sha256": meta_data["sha256"]}), 200
+
+
+@app.route('/multipart/<object_name>/<upload_id>', methods=['DELETE'])
+def abort_multipart_upload(object_name, upload_id):
+    """
+    Aborts a multipart upload and removes its parts
+
+    :param  object_name:
+    :param  upload_id:
+    :return json-resp and status code:
+    """
+    _object_name, object_type = split_object_name(object_name)
+    try:
+        bucket.abort_multipart_upload(upload_id, _object_name, object_type)
+    except UploadNotFoundException as e:
+        return jsonify({"error": str(e)}), 404
+    return jsonify({"message": "Upload aborted"}), 200
+
+
+@app.route('/delete/<object_name>', methods=['DELETE'])
+def delete_object(object_name):
+    """
+    Deletes an object from the storage bucket
+
+    :param  object_name:
+    :return json-resp and status code:
+    """
+    try:
+        bucket.delete_object(*split_object_name(object_name))
     except NotFoundException as e:
         return jsonify({"error": str(e)}), 404
+    return jsonify({"message": "Object deleted successfully"}), 200
+
+
+@app.route('/stats', methods=['GET'])
+def storage_stats():
+    """
+    Object counts and sizes of the bucket, including the dedup ratio
+    and ingest throughput when dedup is enabled.
+
+    :return json-resp and status code:
+    """
+    return jsonify(bucket.get_storage_stats()), 200
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Request, store and cache metrics in the Prometheus text format.
+
+    :return text-resp:
+    """
+    return Response(REGISTRY.render([functools.partial(get_bucket_metrics, bucket)]), content_type=CONTENT_TYPE)
+
+
+@app.route('/admin/profile', methods=['GET'])
+def get_profile():
+    """
+    Samples the stacks of every thread of this worker for a while and
+    returns them in the collapsed format of flame graph tools, e.g.
+    /admin/profile?seconds=10 | flamegraph.pl > profile.svg
+
+    Query parameters: seconds, interval (seconds between samples),
+    idle (1 to keep threads waiting for work)
+
+    :return text-resp and status code:
+    """
+    try:
+        stacks, rounds = sample_stacks(float(request.args.get("seconds", 10)),
+                                       float(request.args.get("interval", PROFILE_INTERVAL)),
+                                       include_idle=request.args.get("idle") == "1")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except ProfilerBusyException as e:
+        return jsonify({"error": str(e)}), 409
+    response = Response(format_collapsed(stacks), mimetype="text/plain")
+    response.headers['X-Profile-Samples'] = str(rounds)
+    return response
+
+
+@app.route('/list', methods=['GET'])
+def list_objects():
+    """
+    Lists the objects of the bucket in lexicographic order, paged with
+    continuation tokens.
+
+    Query parameters: prefix, start_after, limit, continuation_token
+
+    :return json-resp and status code:
+    """
+    try:
+        result = bucket.list_objects(
+            prefix=request.args.get("prefix", ""),
+            start_after=request.args.get("start_after", ""),
+            limit=request.args.get("limit", MAX_LIST_LIMIT),
+            continuation_token=request.args.get("continuation_token"),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(result), 200
+
+
+@app.route('/query', methods=['GET'])
+def query_objects():
+    """
+    Finds objects by metadata, e.g.
+    /query?filter=type:eq:mp4&filter=size:gte:1048576
+
+    Query parameters: filter (repeatable, <key>:<operator>:<value> with
+    the operators eq, prefix, gt, gte, lt, lte), limit, continuation_token
+
+    :return json-resp and status code:
+    """
+    try:
+        result = bucket.query_objects(
+            [parse_query_filter(value) for value in request.args.getlist("filter")],
+            limit=request.args.get("limit", MAX_LIST_LIMIT),
+            continuation_token=request.args.get("continuation_token"),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(result), 200
+
+
+@app.route('/near', methods=['GET'])
+def query_near():
+    """
+    Finds geo-tagged objects by distance, nearest first, e.g.
+    /near?lat=48.8566&lon=2.3522&radius=2000
+
+    Query parameters: lat, lon, radius (meters), limit, continuation_token
+
+    :return json-resp and status code:
+    """
+    try:
+        result = bucket.query_near(
+            *parse_location(request.args),
+            limit=request.args.get("limit", MAX_LIST_LIMIT),
+            continuation_token=request.args.get("continuation_token"),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(result), 200
+
+
+@app.route('/merkle', methods=['GET'])
+def get_merkle_root():
+    """
+    Depth and root hash of the merkle tree of the bucket, replicas with
+    the same root hold the same objects.
+
+    :return json-resp and status code:
+    """
+    tree = bucket.get_merkle_tree()
+    return jsonify({"depth": tree.get_depth(), "root": tree.get_root()}), 200
+
+
+@app.route('/merkle/hashes', methods=['POST'])
+def get_merkle_hashes():
+    """
+    Hashes of merkle tree nodes, json body {"level": 3, "indexes": [0, 5]}.
+
+    :return json-resp and status code:
+    """
+    tree = bucket.get_merkle_tree()
+    try:
+        level, indexes = parse_merkle_nodes(request.get_json(silent=True) or {}, tree.get_depth())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"hashes": tree.get_hashes(level, indexes)}), 200
+
+
+@app.route('/merkle/leaves', methods=['POST'])
+def get_merkle_leaves():
+    """
+    Object keys and digests of merkle tree leaves, json body {"leaves": [7, 9]}.
+
+    :return json-resp and status code:
+    """
+    try:
+        leaves = parse_merkle_leaves(request.get_json(silent=True) or {}, bucket.get_merkle_tree().get_depth())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"entries": bucket.get_leaf_entries(leaves)}), 200
 
 
 class Configuration:
@@ -820,7 +3302,8 @@ class Configuration:
         if not os.path.exists(os.path.join(os.getcwd(), config_file)):
             raise NotFoundException()
         self.__config_file = config_file
-        self.__consistent_hashing = ConsistentHashing(self.get_config_capacity())
+        self.__consistent_hashing = ConsistentHashing(self.get_config_capacity(),
+                                                      load_factor=self.read_config().get("load_factor"))
         self.add_hosts_to_ring()
         
     def read_config(self) -> dict:
@@ -841,12 +3324,18 @@ class Configuration:
         else:
             raise NotFoundException()
 
+    def get_consistent_hashing(self):
+        return self.__consistent_hashing
+
     def add_hosts_to_ring(self):
         hosts = self.get_config_host()
         for host in hosts:
-            print(host)
-            self.__consistent_hashing.put(host)
+            self.__consistent_hashing.put(ConsistentNode(host))
 
 
 if __name__ == '__main__':
-    app.run(host="0.0.0.0", port=5000)
+    parser = argparse.ArgumentParser(description="DataDepot storage node")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    args = parser.parse_args()
+    app.run(host=args.host, port=args.port, threaded=True)
@@ -0,0 +1,130 @@
+import hashlib
+
+import numpy as np
+
+# The tree has 2**LEAF_BITS leaves, an object lives in the leaf given by
+# the top LEAF_BITS bits of the 64-bit hash of its key
+LEAF_BITS = 16
+
+# Node hashes are 128 bits, kept as two uint64 words
+HASH_BYTES = 16
+
+
+def get_key_point(object_key):
+    """
+    64-bit hash of an object key, the same point the consistent hashing
+    ring places the key at.
+
+    :param  object_key: 'name.type'
+    :return int in [0, 2**64):
+    """
+    return int.from_bytes(hashlib.blake2b(str(object_key).encode(), digest_size=8).digest(), "big")
+
+
+def get_entry_hash(object_key, digest):
+    """
+    :param  object_key:
+    :param  digest: sha256 of the object data
+    :return numpy array of two uint64:
+    """
+    entry = hashlib.blake2b(f"{object_key}\0{digest}".encode(), digest_size=HASH_BYTES).digest()
+    return np.frombuffer(entry, dtype=np.uint64)
+
+
+class MerkleTree:
+    """
+    Merkle tree over the (object key, digest) pairs of a bucket.
+
+    A leaf is the XOR of the entry hashes of its objects and an inner
+    node the XOR of its two children, so the tree is independent of the
+    order objects were added in and a change costs one update per level.
+    Changed leaves are only marked dirty, refresh() recomputes them from
+    the authoritative (key, digest) source, which keeps the tree right
+    whatever order concurrent writers and a rebuild run in.
+    """
+
+    def __init__(self, leaf_bits: int = LEAF_BITS) -> None:
+        self.__leaf_bits = leaf_bits
+        self.__levels = [np.zeros((1 << level, 2), dtype=np.uint64) for level in range(leaf_bits + 1)]
+        self.__dirty = set()
+
+    def get_depth(self):
+        return self.__leaf_bits
+
+    def get_leaf(self, object_key):
+        return get_key_point(object_key) >> (64 - self.__leaf_bits)
+
+    def get_leaf_range(self, leaf: int):
+        """
+        :param  leaf:
+        :return inclusive (low, high) key points of the leaf:
+        """
+        shift = 64 - self.__leaf_bits
+        return leaf << shift, ((leaf + 1) << shift) - 1
+
+    def build(self, entries):
+        """
+        Computes the whole tree.
+
+        :param  entries: iterable of (object key, digest)
+        :return None:
+        """
+        leaves = np.zeros((1 << self.__leaf_bits, 2), dtype=np.uint64)
+        for object_key, digest in entries:
+            leaves[self.get_leaf(object_key)] ^= get_entry_hash(object_key, digest)
+        self.__levels[-1] = leaves
+        for level in range(self.__leaf_bits - 1, -1, -1):
+            children = self.__levels[level + 1]
+            self.__levels[level] = children[0::2] ^ children[1::2]
+        self.__dirty.clear()
+
+    def mark_dirty(self, object_key):
+        """
+        Records that an object was added, changed or removed.
+
+        :param  object_key:
+        :return None:
+        """
+        self.__dirty.add(self.get_leaf(object_key))
+
+    def set_leaf(self, leaf: int, value):
+        """
+        Replaces a leaf hash and updates the path to the root.
+
+        :param  leaf:
+        :param  value: numpy array of two uint64
+        :return None:
+        """
+        delta = self.__levels[-1][leaf] ^ value
+        if not delta.any():
+            return
+        for level in range(self.__leaf_bits, -1, -1):
+            self.__levels[level][leaf >> (self.__leaf_bits - level)] ^= delta
+
+    def refresh(self, get_leaf_entries):
+        """
+        Recomputes the dirty leaves.
+
+        :param  get_leaf_entries: callable(low point, high point) returning
+                                  the (object key, digest) pairs of the range
+        :return int, the number of recomputed leaves:
+        """
+        dirty, self.__dirty = self.__dirty, set()
+        for leaf in dirty:
+            value = np.zeros(2, dtype=np.uint64)
+            for object_key, digest in get_leaf_entries(*self.get_leaf_range(leaf)):
+                value ^= get_entry_hash(object_key, digest)
+            self.set_leaf(leaf, value)
+        return len(dirty)
+
+    def get_root(self):
+        return self.__levels[0][0].tobytes().hex()
+
+    def get_hashes(self, level: int, indexes):
+        """
+        :param  level: 0 is the root, get_depth() the leaves
+        :param  indexes: node positions within the level
+        :return list of hex strings:
+        """
+        nodes = self.__levels[level]
+        return [nodes[index].tobytes().hex() for index in indexes]
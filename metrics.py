@@ -0,0 +1,346 @@
+import bisect
+import math
+import threading
+
+# Upper bounds in seconds of the buckets of latency histograms
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Content type of the Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Shards of finished threads are folded together every this many new
+# shards, thread per request servers would pile them up otherwise
+SHARD_FOLD_INTERVAL = 64
+
+COUNTER = "counter"
+GAUGE = "gauge"
+HISTOGRAM = "histogram"
+
+
+class ThreadShards:
+    """
+    Per thread values of a metric. A thread only ever writes its own
+    shard, a dict of label values to state, so recording takes no lock.
+    Collecting sums the shards, those of finished threads are folded
+    into a single retired shard since nothing writes to them anymore.
+    """
+
+    def __init__(self, fold) -> None:
+        """
+        :param  fold: callable(target shard, shard) adding a shard to another
+        """
+        self.__fold = fold
+        self.__local = threading.local()
+        self.__lock = threading.Lock()
+        self.__shards = []
+        self.__retired = {}
+        self.__created = 0
+
+    def get(self):
+        """
+        :return the shard of the calling thread:
+        """
+        try:
+            return self.__local.shard
+        except AttributeError:
+            return self._add_shard()
+
+    def _add_shard(self):
+        shard = {}
+        with self.__lock:
+            self.__created += 1
+            if self.__created % SHARD_FOLD_INTERVAL == 0:
+                self._fold_finished()
+            self.__shards.append((threading.current_thread(), shard))
+        self.__local.shard = shard
+        return shard
+
+    def _fold_finished(self):
+        live = []
+        for thread, shard in self.__shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                self.__fold(self.__retired, shard)
+        self.__shards = live
+
+    def collect(self):
+        """
+        :return dict of label values to the state summed over all threads:
+        """
+        total = {}
+        with self.__lock:
+            self._fold_finished()
+            self.__fold(total, self.__retired)
+            for _, shard in self.__shards:
+                self.__fold(total, dict(shard))
+        return total
+
+
+def _fold_values(target, shard):
+    for labels, value in shard.items():
+        target[labels] = target.get(labels, 0) + value
+
+
+def _fold_histograms(target, shard):
+    for labels, counts in shard.items():
+        existing = target.get(labels)
+        if existing is None:
+            target[labels] = list(counts)
+        else:
+            for index, count in enumerate(counts):
+                existing[index] += count
+
+
+class Metric:
+    """
+    A named metric with a fixed list of label names. Label values are
+    passed as a tuple in the order of the names.
+    """
+
+    kind = None
+
+    def __init__(self, name, documentation, label_names=()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+
+    def get_samples(self):
+        """
+        :return list of (sample name, labels dict, value):
+        """
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """A value which only goes up, e.g. requests served."""
+
+    kind = COUNTER
+
+    def __init__(self, name, documentation, label_names=()) -> None:
+        super().__init__(name, documentation, label_names)
+        self.__shards = ThreadShards(_fold_values)
+
+    def inc(self, labels=(), amount=1):
+        """
+        :param  labels: tuple of label values
+        :param  amount:
+        :return None:
+        """
+        shard = self.__shards.get()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def get_values(self):
+        """
+        :return dict of label values to the value:
+        """
+        return self.__shards.collect()
+
+    def get_samples(self):
+        return [(self.name, dict(zip(self.label_names, labels)), value)
+                for labels, value in sorted(self.get_values().items())]
+
+
+class Gauge(Counter):
+    """A value which goes up and down, e.g. requests in flight."""
+
+    kind = GAUGE
+
+    def dec(self, labels=(), amount=1):
+        self.inc(labels, -amount)
+
+
+class Histogram(Metric):
+    """
+    Counts observations by bucket, the state of a label set is a list of
+    one count per bucket, one for the observations above the last bucket
+    and their sum.
+    """
+
+    kind = HISTOGRAM
+
+    def __init__(self, name, documentation, label_names=(), buckets=LATENCY_BUCKETS) -> None:
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+        self.__shards = ThreadShards(_fold_histograms)
+
+    def observe(self, value, labels=()):
+        """
+        :param  value:
+        :param  labels: tuple of label values
+        :return None:
+        """
+        shard = self.__shards.get()
+        counts = shard.get(labels)
+        if counts is None:
+            counts = shard[labels] = [0] * (len(self.buckets) + 2)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def get_values(self):
+        """
+        :return dict of label values to (cumulative bucket counts, count, sum):
+        """
+        values = {}
+        for labels, counts in self.__shards.collect().items():
+            cumulative, total = [], 0
+            for count in counts[:-2]:
+                total += count
+                cumulative.append(total)
+            values[labels] = (cumulative, total + counts[-2], counts[-1])
+        return values
+
+    def get_samples(self):
+        samples = []
+        for labels, (cumulative, count, total) in sorted(self.get_values().items()):
+            labels = dict(zip(self.label_names, labels))
+            for bound, bucket_count in zip(self.buckets, cumulative):
+                samples.append((f"{self.name}_bucket", {**labels, "le": format_value(bound)}, bucket_count))
+            samples.append((f"{self.name}_bucket", {**labels, "le": "+Inf"}, count))
+            samples.append((f"{self.name}_count", labels, count))
+            samples.append((f"{self.name}_sum", labels, total))
+        return samples
+
+
+class Registry:
+    """
+    The metrics of a process. Besides metrics recorded as they happen it
+    holds collectors, callables returning values read at scrape time
+    such as object counts, as a list of (name, kind, documentation,
+    [(labels dict, value)]).
+    """
+
+    def __init__(self) -> None:
+        self.__lock = threading.Lock()
+        self.__metrics = {}
+        self.__collectors = []
+
+    def register(self, metric: Metric):
+        """
+        :param  metric:
+        :return the metric:
+        :raise  ValueError when the name is taken:
+        """
+        with self.__lock:
+            if metric.name in self.__metrics:
+                raise ValueError(f"Metric '{metric.name}' is already registered")
+            self.__metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, label_names=()):
+        return self.register(Counter(name, documentation, label_names))
+
+    def gauge(self, name, documentation, label_names=()):
+        return self.register(Gauge(name, documentation, label_names))
+
+    def histogram(self, name, documentation, label_names=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, label_names, buckets))
+
+    def add_collector(self, collector):
+        """
+        :param  collector: callable without arguments
+        :return None:
+        """
+        with self.__lock:
+            self.__collectors.append(collector)
+
+    def remove_collector(self, collector):
+        with self.__lock:
+            if collector in self.__collectors:
+                self.__collectors.remove(collector)
+
+    def get_families(self, collectors=()):
+        """
+        :param  collectors: collected in addition to the registered ones
+        :return list of (name, kind, documentation, [(sample name, labels dict, value)]):
+        """
+        with self.__lock:
+            metrics = list(self.__metrics.values())
+            collectors = self.__collectors + list(collectors)
+        families = [(metric.name, metric.kind, metric.documentation, metric.get_samples()) for metric in metrics]
+        for collector in collectors:
+            for name, kind, documentation, samples in collector():
+                families.append((name, kind, documentation,
+                                 [(name, labels, value) for labels, value in samples]))
+        return families
+
+    def render(self, collectors=()):
+        """
+        :param  collectors: collected in addition to the registered ones
+        :return str in the Prometheus text exposition format:
+        """
+        lines = []
+        for name, kind, documentation, samples in self.get_families(collectors):
+            lines.append(f"# HELP {name} {escape_documentation(documentation)}")
+            lines.append(f"# TYPE {name} {kind}")
+            for sample_name, labels, value in samples:
+                lines.append(f"{sample_name}{format_labels(labels)} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def escape_documentation(text):
+    return str(text).replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def format_labels(labels: dict):
+    if not labels:
+        return ""
+    pairs = []
+    for name, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def format_value(value):
+    if value is None:
+        return "NaN"
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+# The registry served by /metrics
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.counter(
+    "datadepot_http_requests_total", "HTTP requests handled", ("endpoint", "method", "status"))
+HTTP_REQUEST_DURATION = REGISTRY.histogram(
+    "datadepot_http_request_duration_seconds", "Time from receiving a request to sending its last byte",
+    ("endpoint", "method"))
+HTTP_REQUEST_BYTES = REGISTRY.counter(
+    "datadepot_http_request_bytes_total", "Request body bytes received", ("endpoint",))
+HTTP_RESPONSE_BYTES = REGISTRY.counter(
+    "datadepot_http_response_bytes_total", "Response body bytes sent", ("endpoint",))
+HTTP_REQUESTS_IN_FLIGHT = REGISTRY.gauge(
+    "datadepot_http_requests_in_flight", "HTTP requests being handled", ("endpoint",))
+RING_LOOKUPS = REGISTRY.counter(
+    "datadepot_ring_lookups_total", "Nodes returned by consistent hashing ring lookups", ("node",))
+DISK_WRITE_DURATION = REGISTRY.histogram(
+    "datadepot_disk_write_seconds", "Latency of writes to disk", ("kind",))
+DISK_FSYNC_DURATION = REGISTRY.histogram(
+    "datadepot_disk_fsync_seconds", "Latency of fsyncs", ("kind",))
+
+
+def record_request(endpoint, method, status: int, duration: float, request_bytes: int, response_bytes: int):
+    """
+    Records a finished HTTP request.
+
+    :param  endpoint: name of the view, 'unknown' for unrouted requests
+    :param  method:
+    :param  status:
+    :param  duration: seconds
+    :param  request_bytes:
+    :param  response_bytes:
+    :return None:
+    """
+    HTTP_REQUESTS.inc((endpoint, method, str(status)))
+    HTTP_REQUEST_DURATION.observe(duration, (endpoint, method))
+    if request_bytes:
+        HTTP_REQUEST_BYTES.inc((endpoint,), request_bytes)
+    if response_bytes:
+        HTTP_RESPONSE_BYTES.inc((endpoint,), response_bytes)
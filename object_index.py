@@ -0,0 +1,541 @@
+import json
+import os
+import sqlite3
+import threading
+
+from merkle import get_key_point
+from segment_store import SEGMENTS_DIR_NAME, RECORD_PUT, iter_segment_records
+
+# Bump whenever the schema changes, an index with a different
+# version is dropped and rebuilt from the objects on disk.
+SCHEMA_VERSION = 5
+
+INDEX_FILE_NAME = ".index.sqlite3"
+
+# How the data of an object is laid out on disk
+LAYOUT_FILE = "file"
+LAYOUT_CHUNKED = "chunked"
+LAYOUT_PACKED = "packed"
+LAYOUT_ERASURE = "erasure"
+
+# Written next to meta_data.json for chunked objects
+MANIFEST_FILE_NAME = "manifest.json"
+
+# Written next to meta_data.json for erasure coded objects
+SHARDS_FILE_NAME = "shards.json"
+
+# Operators of metadata queries, eq matches text and numbers alike
+QUERY_OPERATORS = ("eq", "prefix", "gt", "gte", "lt", "lte")
+RANGE_OPERATORS = {"gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
+
+# Longer string values (digests aside) are not worth an index entry
+MAX_INDEXED_VALUE_LENGTH = 256
+
+
+def get_indexed_values(meta_data: dict):
+    """
+    The metadata key/value pairs which go to the inverted index,
+    only scalar values are indexed and booleans are stored as 0/1.
+
+    :param  meta_data:
+    :return list of (key, value):
+    """
+    values = []
+    for key, value in meta_data.items():
+        if isinstance(value, str):
+            if len(value) <= MAX_INDEXED_VALUE_LENGTH:
+                values.append((key, value))
+        elif isinstance(value, (bool, int, float)):
+            values.append((key, value))
+    return values
+
+
+def parse_query_value(value: str):
+    """
+    Numeric query values compare as numbers, everything else as text.
+
+    :param  value:
+    :return int, float or str:
+    """
+    for convert in (int, float):
+        try:
+            return convert(value)
+        except ValueError:
+            pass
+    return value
+
+
+def get_key_hash(object_key):
+    """
+    The key point of an object shifted into the signed 64-bit range of
+    SQLite integers, the order of the points is kept.
+
+    :param  object_key:
+    :return int:
+    """
+    return get_key_point(object_key) - (1 << 63)
+
+
+def get_prefix_upper_bound(prefix: str):
+    """
+    Smallest string greater than every string starting with prefix.
+
+    :param  prefix:
+    :return str or None when no such bound exists:
+    """
+    while prefix and ord(prefix[-1]) == 0x10FFFF:
+        prefix = prefix[:-1]
+    if not prefix:
+        return None
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class ObjectIndex:
+    """
+    Persistent per-bucket index of the stored objects.
+
+    Maps the object name and type to the uuid, data file, size, digest
+    and metadata of the object so the request path does not have to
+    stat, list or walk the bucket directory. The index lives in an
+    embedded SQLite database inside the bucket and can always be
+    rebuilt from the object directories.
+    """
+
+    def __init__(self, bucket_path) -> None:
+        self.__bucket_path = bucket_path
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(os.path.join(bucket_path, INDEX_FILE_NAME),
+                                            check_same_thread=False, isolation_level=None)
+        self.__connection.execute("PRAGMA journal_mode=WAL")
+        self.__connection.execute("PRAGMA synchronous=NORMAL")
+        version = self.__connection.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            self._create_schema()
+            self.rebuild()
+
+    @staticmethod
+    def get_object_key(object_name, object_type):
+        return f"{object_name}.{object_type}"
+
+    def _create_schema(self):
+        """
+        Drops any existing tables and creates the current schema.
+
+        :return None:
+        """
+        with self.__lock:
+            self.__connection.executescript(f"""
+                BEGIN;
+                DROP TABLE IF EXISTS objects;
+                DROP TABLE IF EXISTS object_meta;
+                CREATE TABLE objects (
+                    object_key  TEXT PRIMARY KEY,
+                    object_name TEXT NOT NULL,
+                    object_type TEXT NOT NULL,
+                    uuid        TEXT NOT NULL,
+                    data_file   TEXT NOT NULL,
+                    data_offset INTEGER NOT NULL,
+                    size        INTEGER NOT NULL,
+                    digest      TEXT,
+                    meta_data   TEXT NOT NULL,
+                    layout      TEXT NOT NULL,
+                    key_hash    INTEGER NOT NULL
+                ) WITHOUT ROWID;
+                CREATE INDEX objects_by_key_hash ON objects (key_hash, object_key, digest);
+                CREATE TABLE object_meta (
+                    meta_key    TEXT NOT NULL,
+                    value       NOT NULL,
+                    object_key  TEXT NOT NULL,
+                    PRIMARY KEY (meta_key, value, object_key)
+                ) WITHOUT ROWID;
+                CREATE INDEX object_meta_by_object ON object_meta (object_key, meta_key, value);
+                PRAGMA user_version = {SCHEMA_VERSION};
+                COMMIT;
+            """)
+
+    def _to_record(self, row):
+        object_name, object_type, object_uuid, data_file, data_offset, size, digest, meta_data, layout = row
+        return {
+            "object_name": object_name,
+            "object_type": object_type,
+            "uuid": object_uuid,
+            "data_path": os.path.join(self.__bucket_path, data_file),
+            "data_offset": data_offset,
+            "size": size,
+            "digest": digest,
+            "meta_data": json.loads(meta_data),
+            "layout": layout,
+        }
+
+    def get(self, object_name, object_type):
+        """
+        Looks up an object by name and type.
+
+        :param  object_name:
+        :param  object_type:
+        :return record dict or None:
+        """
+        with self.__lock:
+            row = self.__connection.execute(
+                "SELECT object_name, object_type, uuid, data_file, data_offset, size, digest, meta_data, layout "
+                "FROM objects WHERE object_key = ?",
+                (self.get_object_key(object_name, object_type),)).fetchone()
+        return None if row is None else self._to_record(row)
+
+    def contains(self, object_name, object_type):
+        """
+        Checks whether an object is indexed.
+
+        :param  object_name:
+        :param  object_type:
+        :return bool:
+        """
+        with self.__lock:
+            row = self.__connection.execute(
+                "SELECT 1 FROM objects WHERE object_key = ?",
+                (self.get_object_key(object_name, object_type),)).fetchone()
+        return row is not None
+
+    def put(self, object_name, object_type, object_uuid, data_file, size, digest, meta_data,
+            layout=LAYOUT_FILE, data_offset: int = 0, replace: bool = False):
+        """
+        Adds an object to the index.
+
+        :param  object_name:
+        :param  object_type:
+        :param  object_uuid:
+        :param  data_file: path of the data file relative to the bucket
+        :param  size:
+        :param  digest:
+        :param  meta_data:
+        :param  layout:
+        :param  data_offset: offset of the data inside a packed segment
+        :param  replace: overwrite an indexed object, used when replaying the log
+        :return bool, False when the object is already indexed:
+        """
+        object_key = self.get_object_key(object_name, object_type)
+        with self.__lock:
+            self.__connection.execute("BEGIN")
+            try:
+                cursor = self.__connection.execute(
+                    f"INSERT OR {'REPLACE' if replace else 'IGNORE'} INTO objects "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (object_key, object_name, object_type, str(object_uuid), data_file, data_offset, size,
+                     digest, json.dumps(meta_data), layout, get_key_hash(object_key)))
+                added = cursor.rowcount == 1
+                if added:
+                    self._index_meta_data(object_key, meta_data, replace)
+                self.__connection.execute("COMMIT")
+            except BaseException:
+                self.__connection.execute("ROLLBACK")
+                raise
+        return added
+
+    def _index_meta_data(self, object_key, meta_data: dict, replace: bool = False):
+        if replace:
+            self.__connection.execute("DELETE FROM object_meta WHERE object_key = ?", (object_key,))
+        self.__connection.executemany(
+            "INSERT OR IGNORE INTO object_meta VALUES (?, ?, ?)",
+            [(key, value, object_key) for key, value in get_indexed_values(meta_data)])
+
+    def relocate(self, object_key, data_file, data_offset: int, new_data_file, new_data_offset: int):
+        """
+        Moves a packed object to a new segment location, only if it
+        still lives at the old one.
+
+        :param  object_key:
+        :param  data_file:
+        :param  data_offset:
+        :param  new_data_file:
+        :param  new_data_offset:
+        :return bool, whether the object was moved:
+        """
+        with self.__lock:
+            cursor = self.__connection.execute(
+                "UPDATE objects SET data_file = ?, data_offset = ? "
+                "WHERE object_key = ? AND data_file = ? AND data_offset = ?",
+                (new_data_file, new_data_offset, object_key, data_file, data_offset))
+        return cursor.rowcount == 1
+
+    def get_packed_live_bytes(self, record_overhead: int = 0):
+        """
+        Bytes of live records per segment file, the key and meta data
+        stored with each record are counted along with its stored,
+        possibly compressed, data.
+
+        :param  record_overhead: fixed size of a record header
+        :return dict of data file to bytes:
+        """
+        with self.__lock:
+            rows = self.__connection.execute(
+                "SELECT data_file, SUM(COALESCE(json_extract(meta_data, '$.compressed_size'), size) "
+                "+ LENGTH(CAST(object_key AS BLOB)) "
+                "+ LENGTH(CAST(meta_data AS BLOB)) + ?) "
+                "FROM objects WHERE layout = ? GROUP BY data_file",
+                (record_overhead, LAYOUT_PACKED)).fetchall()
+        return dict(rows)
+
+    def delete(self, object_name, object_type):
+        """
+        Removes an object from the index.
+
+        :param  object_name:
+        :param  object_type:
+        :return bool, False when the object was not indexed:
+        """
+        object_key = self.get_object_key(object_name, object_type)
+        with self.__lock:
+            self.__connection.execute("BEGIN")
+            try:
+                cursor = self.__connection.execute("DELETE FROM objects WHERE object_key = ?", (object_key,))
+                self.__connection.execute("DELETE FROM object_meta WHERE object_key = ?", (object_key,))
+                self.__connection.execute("COMMIT")
+            except BaseException:
+                self.__connection.execute("ROLLBACK")
+                raise
+        return cursor.rowcount == 1
+
+    def list(self, prefix: str = "", start_after: str = "", limit: int = 1000):
+        """
+        Lists objects in lexicographic key order, walking the primary key
+        B-tree so a page costs O(log n + limit) whatever the bucket size.
+
+        :param  prefix: only keys starting with the prefix are returned
+        :param  start_after: only keys strictly greater are returned
+        :param  limit:
+        :return list of record dicts:
+        """
+        # a single lower and upper bound so SQLite seeks straight to the page
+        query = "SELECT object_name, object_type, uuid, data_file, data_offset, size, digest, meta_data, layout FROM objects"
+        if prefix > start_after:
+            query += " WHERE object_key >= ?"
+            params = [prefix]
+        else:
+            query += " WHERE object_key > ?"
+            params = [start_after]
+        upper = get_prefix_upper_bound(prefix)
+        if upper is not None:
+            query += " AND object_key < ?"
+            params.append(upper)
+        query += " ORDER BY object_key LIMIT ?"
+        params.append(limit)
+        with self.__lock:
+            rows = self.__connection.execute(query, params).fetchall()
+        return [self._to_record(row) for row in rows]
+
+    @staticmethod
+    def _get_value_conditions(column, conditions):
+        """
+        SQL conditions on an indexed value. Numbers sort before text in
+        SQLite, so open ranges are closed with '' (the smallest text)
+        to keep numbers and strings from matching each other.
+
+        :param  column:
+        :param  conditions: list of (operator, value)
+        :return sql and params:
+        """
+        sql, params = [], []
+        for operator, value in conditions:
+            if operator == "eq":
+                sql.append(f"{column} IN (?, ?)")
+                params += [value if isinstance(value, str) else str(value), parse_query_value(str(value))]
+                continue
+            if operator == "prefix":
+                value = str(value)
+                sql.append(f"{column} >= ?")
+                params.append(value)
+                upper = get_prefix_upper_bound(value)
+                sql.append(f"{column} < ?" if upper is not None else f"typeof({column}) = 'text'")
+                if upper is not None:
+                    params.append(upper)
+                continue
+            sql.append(f"{column} {RANGE_OPERATORS[operator]} ?")
+            params.append(value)
+            if isinstance(value, str):
+                if operator in ("lt", "lte"):
+                    sql.append(f"{column} >= ''")
+            elif operator in ("gt", "gte"):
+                sql.append(f"{column} < ''")
+        return " AND ".join(sql), params
+
+    def query(self, filters, start_after=None, limit: int = 1000):
+        """
+        Finds objects by metadata through the inverted index. The
+        filters on one key drive an index range scan, the filters on
+        the other keys are checked per candidate through the per-object
+        index, so a page costs O(log n + limit) for selective filters.
+
+        Results are ordered by the value of the driving key, then by
+        object key, start_after is the (value, object key) of the last
+        result of the previous page.
+
+        :param  filters: list of (key, operator, value), see QUERY_OPERATORS
+        :param  start_after: (value, object key) or None
+        :param  limit:
+        :return list of (driving value, record dict):
+        :raise  ValueError for an unknown operator or no filters:
+        """
+        conditions = {}
+        for key, operator, value in filters:
+            if operator not in QUERY_OPERATORS:
+                raise ValueError(f"Unknown query operator '{operator}'")
+            conditions.setdefault(key, []).append((operator, value))
+        if not conditions:
+            raise ValueError("A query needs at least one filter")
+        # equality is the most selective scan, otherwise the first key drives
+        driving_key = next((key for key, items in conditions.items()
+                            if any(operator == "eq" for operator, _ in items)), next(iter(conditions)))
+
+        sql, params = self._get_value_conditions("m.value", conditions[driving_key])
+        query = ("SELECT m.value, o.object_name, o.object_type, o.uuid, o.data_file, o.data_offset, o.size, "
+                 "o.digest, o.meta_data, o.layout FROM object_meta m "
+                 "JOIN objects o ON o.object_key = m.object_key "
+                 f"WHERE m.meta_key = ? AND {sql}")
+        params = [driving_key] + params
+        for key, items in conditions.items():
+            if key == driving_key:
+                continue
+            sql, key_params = self._get_value_conditions("f.value", items)
+            query += (" AND EXISTS (SELECT 1 FROM object_meta f "
+                      f"WHERE f.object_key = m.object_key AND f.meta_key = ? AND {sql})")
+            params += [key] + key_params
+        if start_after is not None:
+            query += " AND (m.value, m.object_key) > (?, ?)"
+            params += list(start_after)
+        query += " ORDER BY m.value, m.object_key LIMIT ?"
+        params.append(limit)
+        with self.__lock:
+            rows = self.__connection.execute(query, params).fetchall()
+        return [(row[0], self._to_record(row[1:])) for row in rows]
+
+    def get_digests(self, low_point: int = 0, high_point: int = (1 << 64) - 1):
+        """
+        (object key, digest) pairs of the objects whose key point lies
+        in [low_point, high_point], served from the key hash index.
+
+        :param  low_point:
+        :param  high_point:
+        :return list of (object key, digest):
+        """
+        with self.__lock:
+            return self.__connection.execute(
+                "SELECT object_key, digest FROM objects WHERE key_hash BETWEEN ? AND ?",
+                (low_point - (1 << 63), high_point - (1 << 63))).fetchall()
+
+    def get_locations(self):
+        """
+        Coordinates of the geo-tagged objects, those with a geohash in
+        their metadata, read from the inverted metadata index.
+
+        :return list of (object key, lat, lon):
+        """
+        with self.__lock:
+            return self.__connection.execute(
+                "SELECT g.object_key, lat.value, lon.value FROM object_meta g "
+                "JOIN object_meta lat ON lat.object_key = g.object_key AND lat.meta_key = 'lat' "
+                "JOIN object_meta lon ON lon.object_key = g.object_key AND lon.meta_key = 'lon' "
+                "WHERE g.meta_key = 'geohash'").fetchall()
+
+    def count(self):
+        """
+        Number of indexed objects.
+
+        :return int:
+        """
+        with self.__lock:
+            return self.__connection.execute("SELECT COUNT(*) FROM objects").fetchone()[0]
+
+    def total_size(self):
+        """
+        Sum of the sizes of the indexed objects.
+
+        :return int:
+        """
+        with self.__lock:
+            return self.__connection.execute("SELECT COALESCE(SUM(size), 0) FROM objects").fetchone()[0]
+
+    def rebuild(self):
+        """
+        Rebuilds the index from the object directories on disk,
+        staging directories and hidden files are skipped.
+
+        :return int, the number of indexed objects:
+        """
+        with self.__lock:
+            self.__connection.execute("BEGIN")
+            try:
+                self.__connection.execute("DELETE FROM objects")
+                self._rebuild_segments()
+                for entry in os.scandir(self.__bucket_path):
+                    if entry.name.startswith(".") or not entry.is_dir():
+                        continue
+                    try:
+                        with open(os.path.join(entry.path, "meta_data.json"), "r") as meta_file:
+                            meta_data = json.load(meta_file)
+                    except (FileNotFoundError, ValueError):
+                        continue
+                    if os.path.exists(os.path.join(entry.path, MANIFEST_FILE_NAME)):
+                        layout, data_file = LAYOUT_CHUNKED, MANIFEST_FILE_NAME
+                    elif os.path.exists(os.path.join(entry.path, SHARDS_FILE_NAME)):
+                        layout, data_file = LAYOUT_ERASURE, SHARDS_FILE_NAME
+                    else:
+                        layout, data_file = LAYOUT_FILE, meta_data["uuid"]
+                    data_path = os.path.join(entry.path, data_file)
+                    if not os.path.exists(data_path):
+                        continue
+                    object_name = meta_data["object name"]
+                    object_type = meta_data["object_type"]
+                    meta_data.setdefault("size", os.path.getsize(data_path))
+                    self.__connection.execute(
+                        "INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (entry.name, object_name, object_type, meta_data["uuid"],
+                         os.path.join(entry.name, data_file), 0, meta_data["size"],
+                         meta_data.get("sha256"), json.dumps(meta_data), layout, get_key_hash(entry.name)))
+                self.__connection.execute("DELETE FROM object_meta")
+                for object_key, meta_data in self.__connection.execute(
+                        "SELECT object_key, meta_data FROM objects").fetchall():
+                    self._index_meta_data(object_key, json.loads(meta_data))
+                self.__connection.execute("COMMIT")
+            except BaseException:
+                self.__connection.execute("ROLLBACK")
+                raise
+            return self.__connection.execute("SELECT COUNT(*) FROM objects").fetchone()[0]
+
+    def _rebuild_segments(self):
+        """
+        Replays the packed segments in order, later records (including
+        tombstones) override earlier ones.
+
+        :return None:
+        """
+        segments_path = os.path.join(self.__bucket_path, SEGMENTS_DIR_NAME)
+        if not os.path.isdir(segments_path):
+            return
+        for segment_name in sorted(os.listdir(segments_path)):
+            if not segment_name.endswith(".dat"):
+                continue
+            records = iter_segment_records(os.path.join(segments_path, segment_name))
+            for kind, key, meta_data, data_offset, data_length in records:
+                if kind != RECORD_PUT:
+                    self.__connection.execute("DELETE FROM objects WHERE object_key = ?", (key,))
+                    continue
+                self.__connection.execute(
+                    "INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key, meta_data["object name"], meta_data["object_type"], meta_data["uuid"],
+                     os.path.join(SEGMENTS_DIR_NAME, segment_name), data_offset,
+                     meta_data.get("size", data_length),
+                     meta_data.get("sha256"), json.dumps(meta_data), LAYOUT_PACKED, get_key_hash(key)))
+
+    def checkpoint(self):
+        """
+        Moves the committed transactions into the database file and
+        syncs it, after which they survive a power loss.
+
+        :return None:
+        """
+        with self.__lock:
+            self.__connection.execute("PRAGMA wal_checkpoint(FULL)")
+
+    def close(self):
+        with self.__lock:
+            self.__connection.close()
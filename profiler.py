@@ -0,0 +1,110 @@
+import collections
+import os
+import sys
+import threading
+import time
+
+# Seconds between two stack samples
+PROFILE_INTERVAL = 0.005
+
+# Longest profile a caller may ask for
+MAX_PROFILE_SECONDS = 60.0
+
+# (function, file) of the innermost frames of threads which are blocked
+# waiting for work, a lock or the network rather than running
+IDLE_FRAMES = {
+    ("wait", "threading.py"),
+    ("_wait_for_tstate_lock", "threading.py"),
+    ("get", "queue.py"),
+    ("_worker", "thread.py"),
+    ("select", "selectors.py"),
+    ("accept", "socket.py"),
+    ("readinto", "socket.py"),
+    ("dequeue", "handlers.py"),
+}
+
+
+class ProfilerBusyException(Exception):
+    """Exception raised when a profile is requested while another one runs."""
+
+
+# Only one profile runs at a time, sampling is cheap but not free
+_profile_lock = threading.Lock()
+
+
+def get_frame_name(code):
+    """
+    :param  code: code object of a frame
+    :return 'function (file:line)' without the separators of collapsed stacks:
+    """
+    name = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    return name.replace(";", ":")
+
+
+def sample_stacks(duration: float, interval: float = PROFILE_INTERVAL, include_idle: bool = False):
+    """
+    Statistical profile of every thread of the process. The stacks of all
+    threads are sampled every interval seconds for duration seconds from
+    a separate thread, the profiled code is not instrumented at all.
+
+    :param  duration: seconds
+    :param  interval: seconds between samples
+    :param  include_idle: also count threads waiting in a lock, select or sleep
+    :return (collections.Counter of stacks, root frame first, to samples, sample rounds):
+    :raise  ValueError for a duration or interval out of range,
+            ProfilerBusyException when a profile is already running:
+    """
+    if not 0 < duration <= MAX_PROFILE_SECONDS:
+        raise ValueError(f"The duration must be within (0, {MAX_PROFILE_SECONDS:g}] seconds")
+    if not 0 < interval <= duration:
+        raise ValueError("The interval must be positive and not above the duration")
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusyException("A profile is already running")
+    try:
+        stacks = collections.Counter()
+        rounds = 0
+        own_thread = threading.get_ident()
+        deadline = time.monotonic() + duration
+        next_sample = time.monotonic()
+        while True:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                if not include_idle and is_idle(frame.f_code):
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(get_frame_name(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, f"thread-{thread_id}"))
+                stacks[tuple(reversed(stack))] += 1
+            rounds += 1
+            next_sample += interval
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            time.sleep(max(0.0, min(next_sample, deadline) - now))
+        return stacks, rounds
+    finally:
+        _profile_lock.release()
+
+
+def is_idle(code):
+    """
+    :param  code: code object of the innermost frame of a thread
+    :return bool:
+    """
+    return (code.co_name, os.path.basename(code.co_filename)) in IDLE_FRAMES
+
+
+def format_collapsed(stacks):
+    """
+    Formats stacks in the collapsed format read by flamegraph.pl,
+    speedscope and most flame graph tools, one 'root;...;leaf count'
+    line per distinct stack.
+
+    :param  stacks: mapping of stacks, root frame first, to samples
+    :return str:
+    """
+    return "".join(f"{';'.join(stack)} {count}\n" for stack, count in stacks.most_common())
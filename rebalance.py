@@ -0,0 +1,518 @@
+# Moves objects between nodes after the consistent hashing ring changed.
+#
+# Adding or removing a node only changes the owner of the key ranges next
+# to its virtual nodes. get_owner_changes diffs the old and the new ring
+# into exactly those ranges and a Rebalancer copies the objects hashing
+# into them from their old owner to their new one, rate limited so the
+# migration does not starve foreground requests.
+#
+#     old_ring = consistent_hashing.get_ring().get_ring()
+#     consistent_hashing.put(ConsistentNode("host-4"))
+#     changes = get_owner_changes(old_ring, consistent_hashing.get_ring().get_ring())
+#     rebalancer = Rebalancer(changes, {"host-1": HttpNode("host-1", 5000), ...})
+#     rebalancer.start()
+
+import asyncio
+import bisect
+import http.client
+import json
+import threading
+import time
+import urllib.parse
+
+import numpy as np
+
+from main import (ConsistentHashing, Object, NotFoundException, ObjectAlreadyExistsException, DOWNLOAD_CHUNK_SIZE,
+                  add_geo_meta_data)
+
+# Points live in [0, 2**64), see ConsistentHashing.Hash.get_point
+MAX_POINT = (1 << 64) - 1
+
+# Bytes per second a migration may copy
+MIGRATION_RATE = 32 * 1024 * 1024
+
+# Metadata written by the bucket itself or derived from lat and lon, only
+# the rest is sent with a copy
+SYSTEM_META_DATA_KEYS = ("uuid", "object name", "bucket_name", "object_type", "size", "sha256",
+                         "compression", "compressed_size", "geohash")
+
+# Failures kept in the progress report
+MAX_REPORTED_ERRORS = 20
+
+
+class RebalanceException(Exception):
+    """Exception raised when an object could not be moved."""
+
+
+def get_owner_changes(old_ring, new_ring):
+    """
+    Diffs two rings into the key ranges whose owner changed. Between two
+    consecutive points of either ring both rings have a single owner, so
+    comparing the owners of every such interval is exact.
+
+    :param  old_ring: (point, node) pairs as returned by Ring.get_ring
+    :param  new_ring: (point, node) pairs as returned by Ring.get_ring
+    :return list of (low, high, old node id, new node id), inclusive point
+            ranges sorted by low:
+    """
+    if not old_ring or not new_ring:
+        return []
+    get_node_id = ConsistentHashing.Ring.get_node_id
+    old_points = [point for point, _ in old_ring]
+    old_owners = [get_node_id(node) for _, node in old_ring]
+    new_points = [point for point, _ in new_ring]
+    new_owners = [get_node_id(node) for _, node in new_ring]
+
+    def get_owners(point):
+        # a key belongs to the first point at or after its hash
+        return (old_owners[bisect.bisect_left(old_points, point) % len(old_owners)],
+                new_owners[bisect.bisect_left(new_points, point) % len(new_owners)])
+
+    boundaries = sorted(set(old_points) | set(new_points))
+    # (previous boundary, boundary] as inclusive ranges, the first one wraps around zero
+    ranges = [(0, boundaries[0])]
+    ranges += [(low + 1, high) for low, high in zip(boundaries, boundaries[1:])]
+    if boundaries[-1] < MAX_POINT:
+        ranges.append((boundaries[-1] + 1, MAX_POINT))
+
+    changes = []
+    for low, high in ranges:
+        # hashes above the last point wrap around to the first one
+        old_owner, new_owner = get_owners(high)
+        if old_owner == new_owner:
+            continue
+        if changes and changes[-1][1] + 1 == low and changes[-1][2:] == (old_owner, new_owner):
+            changes[-1] = (changes[-1][0], high, old_owner, new_owner)
+        else:
+            changes.append((low, high, old_owner, new_owner))
+    return changes
+
+
+def get_moved_fraction(changes):
+    """
+    Fraction of the key space which changes owner.
+
+    :param  changes: as returned by get_owner_changes
+    :return float:
+    """
+    return sum(high - low + 1 for low, high, _, _ in changes) / (MAX_POINT + 1)
+
+
+class RateLimiter:
+    """
+    Token bucket limiting the bytes per second of a migration. Reads
+    larger than the bucket go into debt which the next acquire sleeps off.
+    """
+
+    def __init__(self, rate: float) -> None:
+        self.__rate = rate
+        self.__tokens = rate
+        self.__last = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def acquire(self, amount: int):
+        """
+        Takes amount tokens, sleeping until they are available.
+
+        :param  amount:
+        :return None:
+        """
+        if not self.__rate:
+            return
+        with self.__lock:
+            now = time.monotonic()
+            self.__tokens = min(self.__rate, self.__tokens + (now - self.__last) * self.__rate)
+            self.__last = now
+            self.__tokens -= amount
+            wait = -self.__tokens / self.__rate if self.__tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class RateLimitedReader:
+    """
+    File like view of a chunk iterator, every read is paid for with the
+    rate limiter so both ends of a copy are throttled.
+    """
+
+    def __init__(self, chunks, limiter: RateLimiter) -> None:
+        self.__chunks = iter(chunks)
+        self.__limiter = limiter
+        self.__buffer = b""
+        self.bytes_read = 0
+
+    def read(self, size: int = -1):
+        while size < 0 or len(self.__buffer) < size:
+            chunk = next(self.__chunks, None)
+            if chunk is None:
+                break
+            self.__buffer += bytes(chunk)
+        if size < 0:
+            data, self.__buffer = self.__buffer, b""
+        else:
+            data, self.__buffer = self.__buffer[:size], self.__buffer[size:]
+        self.__limiter.acquire(len(data))
+        self.bytes_read += len(data)
+        return data
+
+
+def get_user_meta_data(meta_data: dict):
+    return {key: value for key, value in meta_data.items() if key not in SYSTEM_META_DATA_KEYS}
+
+
+class BucketNode:
+    """
+    A node backed by a local Bucket, used when every node is a bucket
+    directory on one machine. Nodes are shared with anti-entropy repair,
+    which reads their merkle trees.
+    """
+
+    def __init__(self, bucket) -> None:
+        self.__bucket = bucket
+
+    def iter_keys(self):
+        """
+        :return generator of (object name, object type):
+        """
+        start_after = ""
+        while True:
+            records = self.__bucket.get_index().list(start_after=start_after)
+            if not records:
+                return
+            for record in records:
+                yield record["object_name"], record["object_type"]
+            last = records[-1]
+            start_after = f"{last['object_name']}.{last['object_type']}"
+
+    def read(self, object_name, object_type):
+        """
+        :return meta data dict and an iterator of the object bytes:
+        :raise  NotFoundException:
+        """
+        record = self.__bucket.get_object_record(object_name, object_type)
+        return record["meta_data"], self.__bucket.iter_object_data(record)
+
+    def stat(self, object_name, object_type):
+        """
+        :return meta data dict with size and sha256:
+        :raise  NotFoundException:
+        """
+        return self.__bucket.get_object_record(object_name, object_type)["meta_data"]
+
+    def write(self, object_name, object_type, data, meta_data: dict):
+        """
+        :param  data: file like object
+        :return stored meta data dict:
+        :raise  ObjectAlreadyExistsException:
+        """
+        obj = Object(object_name, self.__bucket.get_bucket_name(), object_type, data,
+                     add_geo_meta_data(get_user_meta_data(meta_data)))
+        return asyncio.run(self.__bucket.upload_object(obj))
+
+    def delete(self, object_name, object_type):
+        self.__bucket.delete_object(object_name, object_type)
+
+    def get_tree_root(self):
+        """
+        :return depth and root hash of the merkle tree:
+        """
+        tree = self.__bucket.get_merkle_tree()
+        return tree.get_depth(), tree.get_root()
+
+    def get_tree_hashes(self, level: int, indexes):
+        return self.__bucket.get_merkle_tree().get_hashes(level, indexes)
+
+    def get_leaf_entries(self, leaves):
+        return self.__bucket.get_leaf_entries(leaves)
+
+
+class HttpNode:
+    """
+    A node reached through the HTTP endpoints of a DataDepot server,
+    e.g. local processes on different ports.
+    """
+
+    def __init__(self, host, port: int = 5000, timeout: float = 30.0) -> None:
+        self.__host = host
+        self.__port = port
+        self.__timeout = timeout
+
+    def _request(self, method, path, body=None, headers=None):
+        connection = http.client.HTTPConnection(self.__host, self.__port, timeout=self.__timeout)
+        connection.request(method, path, body=body, headers=headers or {})
+        return connection, connection.getresponse()
+
+    def _request_json(self, method, path, body=None, headers=None):
+        connection, response = self._request(method, path, body, headers)
+        try:
+            payload = json.loads(response.read() or b"{}")
+        finally:
+            connection.close()
+        if response.status == 404:
+            raise NotFoundException(payload.get("error"))
+        if response.status == 409:
+            raise ObjectAlreadyExistsException(payload.get("error"))
+        if response.status >= 300:
+            raise RebalanceException(f"{method} {path} failed with {response.status}: {payload.get('error')}")
+        return payload
+
+    def iter_keys(self):
+        """
+        :return generator of (object name, object type):
+        """
+        token = None
+        while True:
+            query = {"continuation_token": token} if token else {}
+            page = self._request_json("GET", f"/list?{urllib.parse.urlencode(query)}")
+            for listed in page["objects"]:
+                yield listed["object_name"], listed["object_type"]
+            token = page.get("next_continuation_token")
+            if not page.get("is_truncated") or not token:
+                return
+
+    def read(self, object_name, object_type):
+        """
+        :return meta data dict and an iterator of the object bytes:
+        :raise  NotFoundException:
+        """
+        path = f"/download/{urllib.parse.quote(object_name)}/application/{urllib.parse.quote(object_type)}"
+        connection, response = self._request("GET", path)
+        if response.status != 200:
+            connection.close()
+            if response.status == 404:
+                raise NotFoundException(f"Object '{object_name}' of type '{object_type}' not found")
+            raise RebalanceException(f"GET {path} failed with {response.status}")
+        meta_data = json.loads(response.getheader("X-Metadata", "{}"))
+
+        def iter_body():
+            try:
+                while True:
+                    chunk = response.read(DOWNLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        return
+                    yield chunk
+            finally:
+                connection.close()
+        return meta_data, iter_body()
+
+    def stat(self, object_name, object_type):
+        """
+        Reads size and digest from the listing, the object itself is not downloaded.
+
+        :return dict with size and sha256:
+        :raise  NotFoundException:
+        """
+        object_key = f"{object_name}.{object_type}"
+        page = self._request_json("GET", f"/list?{urllib.parse.urlencode({'prefix': object_key, 'limit': 1})}")
+        if not page["objects"] or page["objects"][0]["key"] != object_key:
+            raise NotFoundException(f"Object '{object_name}' of type '{object_type}' not found")
+        return page["objects"][0]
+
+    def write(self, object_name, object_type, data, meta_data: dict):
+        """
+        :param  data: file like object
+        :return stored meta data dict with size and sha256:
+        :raise  ObjectAlreadyExistsException:
+        """
+        headers = {"Content-Type": meta_data.get("content_type") or "application/octet-stream",
+                   "Content-Length": str(meta_data["size"])}
+        for key, value in get_user_meta_data(meta_data).items():
+            if key not in ("type", "content_type"):
+                headers[f"X-Meta-{key}"] = str(value)
+        return self._request_json("POST", f"/upload/{urllib.parse.quote(f'{object_name}.{object_type}')}",
+                                  body=data, headers=headers)
+
+    def delete(self, object_name, object_type):
+        self._request_json("DELETE", f"/delete/{urllib.parse.quote(f'{object_name}.{object_type}')}")
+
+    def get_tree_root(self):
+        """
+        :return depth and root hash of the merkle tree:
+        """
+        tree = self._request_json("GET", "/merkle")
+        return tree["depth"], tree["root"]
+
+    def get_tree_hashes(self, level: int, indexes):
+        body = json.dumps({"level": level, "indexes": list(indexes)})
+        return self._request_json("POST", "/merkle/hashes", body=body,
+                                  headers={"Content-Type": "application/json"})["hashes"]
+
+    def get_leaf_entries(self, leaves):
+        body = json.dumps({"leaves": list(leaves)})
+        entries = self._request_json("POST", "/merkle/leaves", body=body,
+                                     headers={"Content-Type": "application/json"})["entries"]
+        return [tuple(entry) for entry in entries]
+
+
+class Rebalancer:
+    """
+    Copies the objects of changed key ranges to their new owners in a
+    background thread. Each object is written to the new owner, checked
+    and only then deleted from the old one, so an interrupted migration
+    leaves at most a duplicate behind and can simply be run again.
+    """
+
+    def __init__(self, changes, nodes: dict, max_bytes_per_second: float = MIGRATION_RATE) -> None:
+        """
+        :param  changes: as returned by get_owner_changes
+        :param  nodes: dict of node id to BucketNode, HttpNode or alike
+        :param  max_bytes_per_second: 0 disables the limit
+        """
+        self.__changes = changes
+        self.__nodes = nodes
+        self.__limiter = RateLimiter(max_bytes_per_second)
+        self.__lows = np.array([low for low, _, _, _ in changes], dtype=np.uint64)
+        self.__highs = np.array([high for _, high, _, _ in changes], dtype=np.uint64)
+        self.__lock = threading.Lock()
+        self.__stopped = threading.Event()
+        self.__thread = None
+        self.__progress = {
+            "state": "pending",
+            "moved_fraction": get_moved_fraction(changes),
+            "scanned_objects": 0,
+            "total_objects": 0,
+            "moved_objects": 0,
+            "moved_bytes": 0,
+            "failed_objects": 0,
+            "errors": [],
+            "started_at": None,
+            "finished_at": None,
+        }
+
+    def plan(self, source_id):
+        """
+        Lists the objects of a node which have to move.
+
+        :param  source_id:
+        :return list of (object name, object type, target node id):
+        """
+        keys = list(self.__nodes[source_id].iter_keys())
+        if not keys or not self.__changes:
+            return []
+        points = np.fromiter((ConsistentHashing.Hash.get_point(f"{name}.{object_type}") for name, object_type in keys),
+                             dtype=np.uint64, count=len(keys))
+        indexes = np.searchsorted(self.__lows, points, side="right") - 1
+        in_range = (indexes >= 0) & (points <= self.__highs[np.maximum(indexes, 0)])
+        moves = []
+        for position in np.nonzero(in_range)[0].tolist():
+            _, _, old_owner, new_owner = self.__changes[indexes[position]]
+            if old_owner == source_id:
+                name, object_type = keys[position]
+                moves.append((name, object_type, new_owner))
+        with self.__lock:
+            self.__progress["scanned_objects"] += len(keys)
+        return moves
+
+    def move_object(self, source_id, object_name, object_type, target_id):
+        """
+        Copies one object to its new owner and deletes the old copy.
+
+        :return int, the bytes copied:
+        :raise  RebalanceException when the copy does not match:
+        """
+        source, target = self.__nodes[source_id], self.__nodes[target_id]
+        meta_data, chunks = source.read(object_name, object_type)
+        reader = RateLimitedReader(chunks, self.__limiter)
+        try:
+            stored = target.write(object_name, object_type, reader, meta_data)
+        except ObjectAlreadyExistsException:
+            # copied by an earlier, interrupted run
+            stored = target.stat(object_name, object_type)
+        if stored.get("size") != meta_data.get("size") or stored.get("sha256") != meta_data.get("sha256"):
+            raise RebalanceException(f"Copy of '{object_name}.{object_type}' on '{target_id}' does not match")
+        source.delete(object_name, object_type)
+        return reader.bytes_read
+
+    def run(self):
+        """
+        Plans and runs the whole migration in the calling thread.
+
+        :return dict, the final progress:
+        """
+        with self.__lock:
+            self.__progress["state"] = "running"
+            self.__progress["started_at"] = time.time()
+        sources = sorted({old_owner for _, _, old_owner, _ in self.__changes if old_owner in self.__nodes})
+        moves = []
+        for source_id in sources:
+            source_moves = [(source_id,) + move for move in self.plan(source_id)]
+            moves += source_moves
+            with self.__lock:
+                self.__progress["total_objects"] += len(source_moves)
+
+        for source_id, object_name, object_type, target_id in moves:
+            if self.__stopped.is_set():
+                break
+            try:
+                if target_id not in self.__nodes:
+                    raise RebalanceException(f"Unknown node '{target_id}'")
+                moved_bytes = self.move_object(source_id, object_name, object_type, target_id)
+            except NotFoundException:
+                continue  # deleted since it was listed
+            except Exception as e:
+                with self.__lock:
+                    self.__progress["failed_objects"] += 1
+                    if len(self.__progress["errors"]) < MAX_REPORTED_ERRORS:
+                        self.__progress["errors"].append(f"{object_name}.{object_type}: {e}")
+                continue
+            with self.__lock:
+                self.__progress["moved_objects"] += 1
+                self.__progress["moved_bytes"] += moved_bytes
+
+        with self.__lock:
+            self.__progress["state"] = "stopped" if self.__stopped.is_set() else "done"
+            self.__progress["finished_at"] = time.time()
+        return self.get_progress()
+
+    def start(self):
+        """
+        Runs the migration in a background thread.
+
+        :return None:
+        """
+        self.__thread = threading.Thread(target=self.run, name="rebalancer", daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        """
+        Stops after the object being moved, a stopped migration can be
+        resumed by running a new Rebalancer with the same changes.
+
+        :return None:
+        """
+        self.__stopped.set()
+
+    def wait(self, timeout: float = None):
+        if self.__thread is not None:
+            self.__thread.join(timeout)
+        return self.get_progress()
+
+    def get_progress(self):
+        """
+        :return dict with the state, object and byte counts and the rate:
+        """
+        with self.__lock:
+            progress = dict(self.__progress, errors=list(self.__progress["errors"]))
+        if progress["started_at"] is not None:
+            elapsed = (progress["finished_at"] or time.time()) - progress["started_at"]
+            progress["bytes_per_second"] = progress["moved_bytes"] / elapsed if elapsed > 0 else 0.0
+        return progress
+
+
+def rebalance(consistent_hashing, change, nodes: dict, max_bytes_per_second: float = MIGRATION_RATE):
+    """
+    Applies a membership change to a ring and starts moving the objects
+    it affects.
+
+    :param  consistent_hashing: ConsistentHashing
+    :param  change: callable changing the ring, e.g. lambda: ring.put(node)
+    :param  nodes: dict of node id to node
+    :param  max_bytes_per_second:
+    :return the started Rebalancer:
+    """
+    old_ring = consistent_hashing.get_ring().get_ring()
+    change()
+    rebalancer = Rebalancer(get_owner_changes(old_ring, consistent_hashing.get_ring().get_ring()),
+                            nodes, max_bytes_per_second)
+    rebalancer.start()
+    return rebalancer
@@ -0,0 +1,696 @@
+# Routing tier in front of several DataDepot storage nodes.
+#
+# Objects are placed on the first REPLICAS distinct nodes following their
+# key on the consistent hashing ring of the hosts in the configuration
+# file. Uploads and deletes are forwarded to every replica and
+# acknowledged once a write quorum succeeded, downloads go to the fastest
+# healthy replica and are hedged with a second replica when the first one
+# is slow to answer.
+#
+#     python main.py --port 5001   (one process per node, own working directory)
+#
+# The Flask development server closes every connection, nodes served by
+# a keep-alive server (e.g. uvicorn asgi:app --port 5001) let the router
+# reuse its pooled connections.
+#     python router.py --config cluster.json --port 5000
+#
+# where cluster.json is {"hosts": ["127.0.0.1:5001", ...], "capacity": 1000}
+# and an optional "load_factor" (e.g. 0.25) enables bounded loads.
+#
+# With --geo-precision N objects uploaded with X-Meta-Lat and X-Meta-Lon
+# are placed by the first N characters of their geohash instead of their
+# key, so objects near each other share nodes and a /near query only
+# asks the nodes of the cells around the location. Downloads and deletes
+# of such objects pass the location as lat and lon query parameters.
+
+import argparse
+import base64
+import http.client
+import json
+import os
+import queue
+import tempfile
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from flask import Flask, request, jsonify, Response
+
+from main import (Configuration, ConsistentHashing, DOWNLOAD_CHUNK_SIZE, USER_META_DATA_HEADER_PREFIX,
+                  MAX_LIST_LIMIT, parse_location, instrument_app)
+from metrics import REGISTRY, CONTENT_TYPE, COUNTER, GAUGE
+from geo_loc import get_covering_geohashes
+
+# Copies of every object and the acknowledgements a write waits for
+REPLICAS = 3
+WRITE_QUORUM = 2
+
+# A download is sent to the next replica when the first one did not
+# answer within this many seconds
+HEDGE_DELAY = 0.05
+
+# Idle keep-alive connections kept per node
+POOL_SIZE = 16
+
+NODE_TIMEOUT = 30.0
+
+# Seconds between two health checks of the nodes marked down
+HEALTH_CHECK_INTERVAL = 5.0
+
+# Request bodies up to this size are forwarded from memory, larger ones
+# are spooled to a temporary file which every replica reads on its own
+SPOOL_MEMORY_LIMIT = 8 * 1024 * 1024
+
+# Weight of the newest sample in the per node latency average
+LATENCY_SMOOTHING = 0.2
+
+# Headers passed through in either direction
+FORWARDED_REQUEST_HEADERS = ("Content-Type", "Range", "If-None-Match", "Accept-Encoding")
+FORWARDED_RESPONSE_HEADERS = ("Content-Type", "Content-Length", "Content-Range", "Content-Encoding", "ETag",
+                              "Accept-Ranges", "Vary", "X-Metadata")
+
+
+class NodeUnavailableException(Exception):
+    """Exception raised when a storage node cannot be reached."""
+
+
+class ConnectionPool:
+    """
+    Keep-alive HTTP connections to one storage node. Connections are
+    taken for a whole request and response and handed back once the
+    response was read completely, broken ones are dropped.
+    """
+
+    def __init__(self, host, port: int, size: int = POOL_SIZE, timeout: float = NODE_TIMEOUT) -> None:
+        self.__host = host
+        self.__port = port
+        self.__timeout = timeout
+        self.__idle = queue.LifoQueue(maxsize=size)
+        self.__created = 0
+        self.__reused = 0
+        self.__lock = threading.Lock()
+
+    def acquire(self):
+        """
+        :return an idle connection or a new one, and whether it was reused:
+        """
+        try:
+            connection = self.__idle.get_nowait()
+        except queue.Empty:
+            with self.__lock:
+                self.__created += 1
+            return http.client.HTTPConnection(self.__host, self.__port, timeout=self.__timeout), False
+        with self.__lock:
+            self.__reused += 1
+        return connection, True
+
+    def release(self, connection, response=None):
+        """
+        Returns a connection to the pool unless the server closes it.
+
+        :param  connection:
+        :param  response: the fully read response, None for a broken connection
+        :return None:
+        """
+        if response is None or response.will_close:
+            connection.close()
+            return
+        try:
+            self.__idle.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def request(self, method, url, body=None, headers=None):
+        """
+        Sends a request and waits for the response headers. A reused
+        connection the server closed meanwhile is retried once on a new
+        connection, the request is only retried if its body can be sent
+        again.
+
+        :return the connection and the response, the body is not read yet:
+        :raise  NodeUnavailableException:
+        """
+        for _ in range(2):
+            connection, reused = self.acquire()
+            position = body.tell() if hasattr(body, "tell") else None
+            try:
+                connection.request(method, url, body=body, headers=headers or {})
+                return connection, connection.getresponse()
+            except (http.client.HTTPException, OSError) as e:
+                connection.close()
+                if not reused or (hasattr(body, "read") and position is None):
+                    raise NodeUnavailableException(f"{self.__host}:{self.__port} {e}")
+                if position is not None:
+                    body.seek(position)
+        raise NodeUnavailableException(f"{self.__host}:{self.__port} is unavailable")
+
+    def get_stats(self):
+        with self.__lock:
+            return {"created": self.__created, "reused": self.__reused, "idle": self.__idle.qsize()}
+
+
+def spool_request_body(stream, length):
+    """
+    Reads a request body so it can be sent to several replicas.
+
+    :param  stream:
+    :param  length: Content-Length or None
+    :return bytes or the path of a temporary file:
+    """
+    if length is not None and length <= SPOOL_MEMORY_LIMIT:
+        return stream.read()
+    spool = tempfile.NamedTemporaryFile(prefix="datadepot-router-", delete=False)
+    with spool:
+        while True:
+            chunk = stream.read(DOWNLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            spool.write(chunk)
+    return spool.name
+
+
+class Router:
+    """
+    Forwards object requests to the replicas chosen by the ring of the
+    configuration. Nodes failing a request are marked down and skipped
+    until a health check sees them answering again.
+    """
+
+    def __init__(self, configuration: Configuration, replicas: int = REPLICAS, write_quorum: int = WRITE_QUORUM,
+                 hedge_delay: float = HEDGE_DELAY, geo_precision: int = None) -> None:
+        self.__consistent_hashing = configuration.get_consistent_hashing()
+        self.__replicas = replicas
+        self.__geo_precision = geo_precision
+        self.__write_quorum = min(write_quorum, replicas)
+        self.__hedge_delay = hedge_delay
+        self.__pools = {}
+        self.__latencies = {}
+        self.__lock = threading.Lock()
+        self.__executor = ThreadPoolExecutor(max_workers=8 * replicas, thread_name_prefix="router")
+        self.__counters = {"hedged_reads": 0, "hedge_wins": 0, "failed_requests": 0}
+        for node in self.__consistent_hashing.get_ring().get_nodes():
+            host, _, port = node.node.rpartition(":")
+            self.__pools[node.node] = ConnectionPool(host, int(port))
+        self.__health_checker = None
+
+    def get_placement_key(self, object_key, location=None):
+        """
+        :param  object_key: 'name.type'
+        :param  location: (lat, lon) of a geo-tagged object or None
+        :return the key the object is placed by on the ring:
+        """
+        if location is None or self.__geo_precision is None:
+            return object_key
+        return ConsistentHashing.get_geo_placement_key(*location, self.__geo_precision)
+
+    def get_replicas(self, object_key):
+        """
+        :param  object_key: 'name.type'
+        :return list of ConsistentNode, the owner first:
+        """
+        return self.__consistent_hashing.get_request_replicas(object_key, self.__replicas)
+
+    def get_read_order(self, object_key):
+        """
+        Healthy replicas by their average latency, nodes marked down
+        are only tried last. With bounded loads configured replicas at
+        their load capacity come after the others, so a hot key spreads
+        over its replicas instead of piling onto the fastest one.
+
+        :param  object_key:
+        :return list of ConsistentNode:
+        """
+        replicas = self.get_replicas(object_key)
+        with self.__lock:
+            latency = {node.node: self.__latencies.get(node.node, 0.0) for node in replicas}
+        saturated = {node.node: self.__consistent_hashing.is_saturated(node) for node in replicas}
+        return sorted(replicas, key=lambda node: (node.is_down, saturated[node.node], latency[node.node]))
+
+    def _record_latency(self, node, seconds: float):
+        with self.__lock:
+            previous = self.__latencies.get(node.node)
+            self.__latencies[node.node] = seconds if previous is None else (
+                    previous + LATENCY_SMOOTHING * (seconds - previous))
+
+    def _mark_down(self, node):
+        node.is_down = True
+        with self.__lock:
+            self.__counters["failed_requests"] += 1
+
+    def _send(self, node, method, url, body=None, headers=None):
+        """
+        Sends a request to a node and reads the whole response.
+
+        :return status, response headers and body:
+        :raise  NodeUnavailableException:
+        """
+        pool = self.__pools[node.node]
+        started = time.monotonic()
+        self.__consistent_hashing.start_request(node)
+        try:
+            if isinstance(body, str):
+                with open(body, "rb") as body_file:
+                    connection, response = pool.request(method, url, body_file, headers)
+            else:
+                connection, response = pool.request(method, url, body, headers)
+            try:
+                payload = response.read()
+            except (http.client.HTTPException, OSError) as e:
+                # a half read response leaves the connection unusable
+                pool.release(connection)
+                raise NodeUnavailableException(f"{node.node} {e}")
+        finally:
+            self.__consistent_hashing.finish_request(node)
+        pool.release(connection, response)
+        self._record_latency(node, time.monotonic() - started)
+        return response.status, response.getheaders(), payload
+
+    def write(self, object_key, method, url, body=None, headers=None):
+        """
+        Sends a write to every replica and returns once a quorum of them
+        answered alike, the other replicas finish in the background.
+
+        :param  object_key:
+        :param  method:
+        :param  url:
+        :param  body: bytes or the path of a spooled body
+        :param  headers:
+        :return status and json payload:
+        """
+        replicas = self.get_replicas(object_key)
+        futures = {self.__executor.submit(self._send, node, method, url, body, headers): node
+                   for node in replicas}
+        results, errors = {}, []
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                node = futures[future]
+                try:
+                    status, _, payload = future.result()
+                except NodeUnavailableException as e:
+                    self._mark_down(node)
+                    errors.append(str(e))
+                    continue
+                results.setdefault(status, []).append(payload)
+                if len(results[status]) >= self.__write_quorum:
+                    self._cleanup_when_done(pending, body)
+                    return status, json.loads(results[status][0] or b"{}")
+        self._cleanup_when_done(set(), body)
+        statuses = {status: len(payloads) for status, payloads in results.items()}
+        return 503, {"error": f"Write quorum of {self.__write_quorum} not reached",
+                     "responses": statuses, "unavailable": errors}
+
+    @staticmethod
+    def _cleanup_when_done(pending, body):
+        if not isinstance(body, str):
+            return
+        if not pending:
+            os.remove(body)
+            return
+        remaining = [len(pending)]
+        lock = threading.Lock()
+
+        def remove(_):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    os.remove(body)
+        for future in pending:
+            future.add_done_callback(remove)
+
+    def _open(self, node, url, headers):
+        # the request stays in flight on the node until its body was read
+        pool = self.__pools[node.node]
+        started = time.monotonic()
+        self.__consistent_hashing.start_request(node)
+        try:
+            connection, response = pool.request("GET", url, headers=headers)
+        except BaseException:
+            self.__consistent_hashing.finish_request(node)
+            raise
+        self._record_latency(node, time.monotonic() - started)
+        return node, pool, connection, response
+
+    def _discard(self, future):
+        # a hedged request which lost the race, its connection is dropped
+        try:
+            node, _, connection, _ = future.result()
+        except Exception:
+            return
+        connection.close()
+        self.__consistent_hashing.finish_request(node)
+
+    def _iter_body(self, node, pool, connection, response):
+        try:
+            while True:
+                chunk = response.read(DOWNLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            raise
+        finally:
+            self.__consistent_hashing.finish_request(node)
+        pool.release(connection, response)
+
+    def read(self, object_key, url, headers=None):
+        """
+        Opens a download on the fastest replica. When it has not
+        answered after the hedge delay the next replica is asked as
+        well and whichever answers first is used, failed and missing
+        replicas are replaced right away.
+
+        :param  object_key:
+        :param  url:
+        :param  headers:
+        :return node, status, response headers and an iterator of the body,
+                None when no replica could be reached:
+        """
+        candidates = iter(self.get_read_order(object_key))
+        futures, pending, nodes = [], set(), {}
+        miss = None
+
+        def start_next():
+            node = next(candidates, None)
+            if node is None:
+                return False
+            future = self.__executor.submit(self._open, node, url, headers)
+            futures.append(future)
+            pending.add(future)
+            nodes[future] = node
+            return True
+
+        start_next()
+        while pending:
+            can_hedge = len(futures) < self.__replicas
+            done, _ = wait(pending, timeout=self.__hedge_delay if can_hedge else None, return_when=FIRST_COMPLETED)
+            if not done:
+                if start_next():
+                    with self.__lock:
+                        self.__counters["hedged_reads"] += 1
+                continue
+            done = list(done)
+            while done:
+                future = done.pop()
+                pending.discard(future)
+                try:
+                    node, pool, connection, response = future.result()
+                except NodeUnavailableException:
+                    self._mark_down(nodes[future])
+                    start_next()
+                    continue
+                if response.status == 404 or response.status >= 500:
+                    # a replica missing the object, another one may have it
+                    miss = (node, response.status, response.getheaders(), [response.read()])
+                    self.__consistent_hashing.finish_request(node)
+                    pool.release(connection, response)
+                    start_next()
+                    continue
+                for loser in done + list(pending):
+                    loser.add_done_callback(self._discard)
+                if future is not futures[0]:
+                    with self.__lock:
+                        self.__counters["hedge_wins"] += 1
+                return node, response.status, response.getheaders(), self._iter_body(node, pool, connection, response)
+        return miss
+
+    def _query_node(self, nodes, url):
+        # the first of the nodes to answer, replicas are interchangeable
+        for node in nodes:
+            try:
+                status, _, payload = self._send(node, "GET", url)
+            except NodeUnavailableException:
+                self._mark_down(node)
+                continue
+            if status < 500:
+                return status, json.loads(payload or b"{}")
+        return None
+
+    def query_near(self, latitude: float, longitude: float, radius: float, limit: int = MAX_LIST_LIMIT,
+                   continuation_token=None):
+        """
+        Runs a /near query on the nodes holding the cells the circle
+        overlaps and merges their pages by distance. Without geo
+        placement, or for circles larger than the cells, every node is
+        asked.
+
+        :param  latitude:
+        :param  longitude:
+        :param  radius: meters
+        :param  limit:
+        :param  continuation_token:
+        :return status and json payload:
+        """
+        geohashes = None
+        if self.__geo_precision is not None:
+            geohashes = get_covering_geohashes(latitude, longitude, radius, self.__geo_precision)
+        if geohashes is None:
+            groups = [[node] for node in self.__consistent_hashing.get_ring().get_nodes()]
+        else:
+            groups, owners = [], set()
+            for geohash in geohashes:
+                nodes = self.get_read_order(f"geo:{geohash}")
+                if nodes[0].node not in owners:
+                    owners.add(nodes[0].node)
+                    groups.append(nodes)
+
+        limit = max(1, min(int(limit), MAX_LIST_LIMIT))
+        query = {"lat": latitude, "lon": longitude, "radius": radius, "limit": limit}
+        if continuation_token:
+            query["continuation_token"] = continuation_token
+        url = f"/near?{urllib.parse.urlencode(query)}"
+        results = list(self.__executor.map(lambda nodes: self._query_node(nodes, url), groups))
+        if any(result is None for result in results):
+            return 503, {"error": "No replica is available for a part of the area"}
+        for status, payload in results:
+            if status != 200:
+                return status, payload
+
+        # replicas of a cell may answer for other cells too
+        merged = {}
+        for _, payload in results:
+            for item in payload["objects"]:
+                merged[item["key"]] = item
+        objects = sorted(merged.values(), key=lambda item: (item["distance"], item["key"]))
+        is_truncated = len(objects) > limit or any(payload["is_truncated"] for _, payload in results)
+        objects = objects[:limit]
+        next_token = None
+        if is_truncated and objects:
+            # the nodes page by (distance, key) as well
+            last = [objects[-1]["distance"], objects[-1]["key"]]
+            next_token = base64.urlsafe_b64encode(json.dumps(last).encode()).decode()
+        return 200, {"objects": objects, "is_truncated": is_truncated, "next_continuation_token": next_token}
+
+    def start_health_checks(self, interval: float = HEALTH_CHECK_INTERVAL):
+        """
+        Periodically probes the nodes marked down and brings back the
+        ones answering again.
+
+        :param  interval:
+        :return None:
+        """
+        def check():
+            while True:
+                time.sleep(interval)
+                for node in self.__consistent_hashing.get_ring().get_nodes():
+                    if not node.is_down:
+                        continue
+                    try:
+                        status, _, _ = self._send(node, "GET", "/stats")
+                    except NodeUnavailableException:
+                        continue
+                    node.is_down = status >= 500
+
+        if self.__health_checker is None:
+            self.__health_checker = threading.Thread(target=check, name="router-health", daemon=True)
+            self.__health_checker.start()
+
+    def get_stats(self):
+        """
+        :return dict with the nodes, their health, latency and pools:
+        """
+        with self.__lock:
+            counters = dict(self.__counters)
+            latencies = dict(self.__latencies)
+        return {
+            "replicas": self.__replicas,
+            "write_quorum": self.__write_quorum,
+            "geo_precision": self.__geo_precision,
+            "load_capacity": self.__consistent_hashing.get_load_capacity(),
+            "nodes": {node.node: {"is_down": node.is_down,
+                                  "in_flight": self.__consistent_hashing.get_loads().get(node.node, 0),
+                                  "latency": latencies.get(node.node),
+                                  "pool": self.__pools[node.node].get_stats()}
+                      for node in self.__consistent_hashing.get_ring().get_nodes()},
+            **counters,
+        }
+
+    def get_metrics(self):
+        """
+        Metrics collector of the router, the health, requests in flight
+        and latency of every node.
+
+        :return list of (name, kind, documentation, [(labels, value)]):
+        """
+        stats = self.get_stats()
+        nodes = [({"node": node}, node_stats) for node, node_stats in sorted(stats["nodes"].items())]
+        return [
+            ("datadepot_node_up", GAUGE, "Whether the node is marked up",
+             [(labels, not node_stats["is_down"]) for labels, node_stats in nodes]),
+            ("datadepot_node_requests_in_flight", GAUGE, "Requests in flight on the node",
+             [(labels, node_stats["in_flight"]) for labels, node_stats in nodes]),
+            ("datadepot_node_latency_seconds", GAUGE, "Smoothed response latency of the node",
+             [(labels, node_stats["latency"]) for labels, node_stats in nodes]),
+            ("datadepot_router_hedged_reads_total", COUNTER, "Downloads sent to a second replica",
+             [({}, stats["hedged_reads"])]),
+            ("datadepot_router_hedge_wins_total", COUNTER, "Hedged downloads answered first by the second replica",
+             [({}, stats["hedge_wins"])]),
+            ("datadepot_router_failed_requests_total", COUNTER, "Requests to nodes which failed",
+             [({}, stats["failed_requests"])]),
+        ]
+
+
+app = Flask(__name__)
+instrument_app(app)
+router = None
+
+
+def get_location(values, lat_name: str = "lat", lon_name: str = "lon"):
+    """
+    :param  values: request headers or query parameters
+    :param  lat_name:
+    :param  lon_name:
+    :return (lat, lon) or None when no location was given:
+    :raise  ValueError for a partial or invalid location:
+    """
+    if values.get(lat_name) is None and values.get(lon_name) is None:
+        return None
+    try:
+        return float(values[lat_name]), float(values[lon_name])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError(f"{lat_name} and {lon_name} must both be numbers")
+
+
+def get_forwarded_headers():
+    headers = {name: request.headers[name] for name in FORWARDED_REQUEST_HEADERS if name in request.headers}
+    headers.update({name: value for name, value in request.headers.items()
+                    if name.lower().startswith(USER_META_DATA_HEADER_PREFIX)})
+    return headers
+
+
+@app.route('/upload/<object_name>', methods=['POST'])
+def upload_object(object_name):
+    """
+    Stores an object on its replicas, acknowledged by the write quorum.
+
+    :param  object_name:
+    :return json-resp and status code:
+    """
+    try:
+        location = get_location(request.headers, f"{USER_META_DATA_HEADER_PREFIX}lat",
+                                f"{USER_META_DATA_HEADER_PREFIX}lon")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    body = spool_request_body(request.stream, request.content_length)
+    headers = get_forwarded_headers()
+    headers["Content-Length"] = str(len(body) if isinstance(body, bytes) else os.path.getsize(body))
+    status, payload = router.write(router.get_placement_key(object_name, location), "POST",
+                                   f"/upload/{urllib.parse.quote(object_name)}", body, headers)
+    return jsonify(payload), status
+
+
+@app.route('/download/<object_name>/<object_t>/<object_type>', methods=['GET'])
+def download_object(object_name, object_t, object_type):
+    """
+    Streams an object from the first replica to answer.
+
+    :param  object_name:
+    :param  object_t:
+    :param  object_type:
+    :return the response of the replica:
+    """
+    try:
+        location = get_location(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    url = "/download/" + "/".join(urllib.parse.quote(part) for part in (object_name, object_t, object_type))
+    result = router.read(router.get_placement_key(f"{object_name}.{object_type}", location), url,
+                         get_forwarded_headers())
+    if result is None:
+        return jsonify({"error": "No replica is available"}), 503
+    node, status, response_headers, body = result
+    forwarded = {name.lower() for name in FORWARDED_RESPONSE_HEADERS}
+    headers = {name: value for name, value in response_headers if name.lower() in forwarded}
+    headers["X-Replica"] = node.node
+    return Response(body, status=status, headers=headers)
+
+
+@app.route('/delete/<object_name>', methods=['DELETE'])
+def delete_object(object_name):
+    """
+    Deletes an object from its replicas, acknowledged by the write quorum.
+
+    :param  object_name:
+    :return json-resp and status code:
+    """
+    try:
+        location = get_location(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    status, payload = router.write(router.get_placement_key(object_name, location), "DELETE",
+                                   f"/delete/{urllib.parse.quote(object_name)}")
+    return jsonify(payload), status
+
+
+@app.route('/near', methods=['GET'])
+def query_near():
+    """
+    Finds geo-tagged objects by distance on the nodes around the location.
+
+    Query parameters: lat, lon, radius (meters), limit, continuation_token
+
+    :return json-resp and status code:
+    """
+    try:
+        location = parse_location(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    status, payload = router.query_near(*location, limit=request.args.get("limit", MAX_LIST_LIMIT),
+                                        continuation_token=request.args.get("continuation_token"))
+    return jsonify(payload), status
+
+
+@app.route('/stats', methods=['GET'])
+def get_stats():
+    return jsonify(router.get_stats()), 200
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Request metrics of the router, ring lookups per node and the state
+    of the nodes in the Prometheus text format.
+
+    :return text-resp:
+    """
+    return Response(REGISTRY.render([router.get_metrics]), content_type=CONTENT_TYPE)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="DataDepot router")
+    parser.add_argument("--config", required=True, help="json file with the hosts of the storage nodes")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--replicas", type=int, default=REPLICAS)
+    parser.add_argument("--write-quorum", type=int, default=WRITE_QUORUM)
+    parser.add_argument("--hedge-delay", type=float, default=HEDGE_DELAY)
+    parser.add_argument("--geo-precision", type=int, default=None,
+                        help="place geo-tagged objects by this many geohash characters")
+    args = parser.parse_args()
+    router = Router(Configuration(args.config), args.replicas, args.write_quorum, args.hedge_delay,
+                    args.geo_precision)
+    router.start_health_checks()
+    app.run(host=args.host, port=args.port, threaded=True)
@@ -0,0 +1,270 @@
+import functools
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+
+from wal import fsync_path
+
+# Small objects are appended to large segment files instead of getting
+# a directory and two files each. A segment is a sequence of records:
+#
+#     header | key | meta data json | data
+#
+# where the header holds the record kind, the field lengths and a crc32
+# of the payload. Deletes append a tombstone record so the segments
+# alone are enough to rebuild the object index.
+SEGMENTS_DIR_NAME = ".segments"
+
+# Segments are sealed once they grow past this size
+SEGMENT_SIZE = 64 * 1024 * 1024
+
+# Sealed segments with at least this fraction of dead bytes are compacted
+COMPACTION_GARBAGE_RATIO = 0.5
+
+# Compacted segments are kept this long so in-flight reads can finish
+COMPACTION_GRACE_SECONDS = 60.0
+
+RECORD_MAGIC = b"DDSG"
+RECORD_PUT = 0
+RECORD_DELETE = 1
+
+# magic, kind, key length, meta data length, data length, crc32
+RECORD_HEADER = struct.Struct("<4sBHIQI")
+
+
+def get_segment_name(segment_id: int):
+    return f"seg-{segment_id:08d}.dat"
+
+
+def get_segment_id(segment_name):
+    return int(segment_name[4:12])
+
+
+def iter_segment_records(segment_path):
+    """
+    Reads the records of a segment in order. Reading stops at the first
+    torn or corrupted record, which can only be the tail of the segment.
+
+    :param  segment_path:
+    :return generator of (kind, key, meta data, data offset, data length):
+    """
+    with open(segment_path, "rb") as segment_file:
+        offset = 0
+        while True:
+            header = segment_file.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            magic, kind, key_length, meta_length, data_length, crc = RECORD_HEADER.unpack(header)
+            if magic != RECORD_MAGIC:
+                return
+            payload = segment_file.read(key_length + meta_length + data_length)
+            if len(payload) < key_length + meta_length + data_length or zlib.crc32(payload) != crc:
+                return
+            key = payload[:key_length].decode()
+            meta_data = json.loads(payload[key_length:key_length + meta_length]) if meta_length else None
+            data_offset = offset + RECORD_HEADER.size + key_length + meta_length
+            yield kind, key, meta_data, data_offset, data_length
+            offset = data_offset + data_length
+
+
+class SegmentStore:
+    """
+    Append-only segment files for small objects (haystack style).
+
+    Objects are appended to the active segment and located by
+    (segment, offset, length) in the object index, a read is a single
+    pread on a cached file descriptor. Space of deleted objects is
+    reclaimed by compacting segments into the active one.
+    """
+
+    def __init__(self, root, segment_size: int = SEGMENT_SIZE) -> None:
+        self.__root = root
+        self.__segment_size = segment_size
+        self.__lock = threading.Lock()
+        self.__sync_lock = threading.Lock()
+        self.__read_fds = {}
+        os.makedirs(root, exist_ok=True)
+        segments = self.list_segments()
+        self.__active_id = get_segment_id(segments[-1]) if segments else 1
+        self.__active_fd = self._open_active()
+
+    def _open_active(self):
+        fd = os.open(os.path.join(self.__root, get_segment_name(self.__active_id)),
+                     os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        fsync_path(self.__root)
+        self.__active_size = os.fstat(fd).st_size
+        self.__synced_size = 0
+        return fd
+
+    def list_segments(self):
+        """
+        Segment file names in creation order.
+
+        :return list of str:
+        """
+        return sorted(name for name in os.listdir(self.__root)
+                      if name.startswith("seg-") and name.endswith(".dat"))
+
+    def get_segment_path(self, segment_name):
+        return os.path.join(self.__root, segment_name)
+
+    def get_active_segment(self):
+        return get_segment_name(self.__active_id)
+
+    def _append(self, kind, key, meta_data, data):
+        """
+        Appends a record, rolling over to a new segment when the active
+        one is full.
+
+        :return segment name and offset of the data:
+        """
+        key_bytes = key.encode()
+        meta_bytes = json.dumps(meta_data).encode() if meta_data is not None else b""
+        payload = key_bytes + meta_bytes + bytes(data)
+        header = RECORD_HEADER.pack(RECORD_MAGIC, kind, len(key_bytes), len(meta_bytes), len(data),
+                                    zlib.crc32(payload))
+        with self.__lock:
+            if self.__active_size and self.__active_size + len(header) + len(payload) > self.__segment_size:
+                # sealed segments are durable, sync only ever looks at the active one
+                os.fsync(self.__active_fd)
+                os.close(self.__active_fd)
+                self.__active_id += 1
+                self.__active_fd = self._open_active()
+            offset = self.__active_size
+            os.write(self.__active_fd, header + payload)
+            self.__active_size += len(header) + len(payload)
+            return get_segment_name(self.__active_id), offset + len(header) + len(key_bytes) + len(meta_bytes)
+
+    def append(self, key, meta_data: dict, data):
+        """
+        Appends an object.
+
+        :param  key:
+        :param  meta_data:
+        :param  data:
+        :return segment name and offset of the object data:
+        """
+        return self._append(RECORD_PUT, key, meta_data, data)
+
+    def sync(self, segment_name):
+        """
+        Makes the records appended to a segment so far durable. Callers
+        arriving while an fsync runs are covered by the next one, so
+        concurrent appends share fsyncs.
+
+        :param  segment_name: as returned by append
+        :return None:
+        """
+        with self.__sync_lock:
+            with self.__lock:
+                if segment_name != self.get_active_segment() or self.__synced_size >= self.__active_size:
+                    return
+                # the active segment may be sealed and closed meanwhile
+                fd, size = os.dup(self.__active_fd), self.__active_size
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            with self.__lock:
+                if segment_name == self.get_active_segment():
+                    self.__synced_size = max(self.__synced_size, size)
+
+    def append_tombstone(self, key):
+        """
+        Records the deletion of an object.
+
+        :param  key:
+        :return None:
+        """
+        self._append(RECORD_DELETE, key, None, b"")
+
+    def read(self, segment_name, offset: int, length: int):
+        """
+        Reads object data with a single pread.
+
+        :param  segment_name:
+        :param  offset:
+        :param  length:
+        :return bytes:
+        """
+        fd = self.__read_fds.get(segment_name)
+        if fd is None:
+            with self.__lock:
+                fd = self.__read_fds.get(segment_name)
+                if fd is None:
+                    path = self.get_segment_path(segment_name)
+                    try:
+                        fd = os.open(path, os.O_RDONLY)
+                    except FileNotFoundError:
+                        # compacted after the caller looked the object up
+                        fd = os.open(f"{path}.compacted", os.O_RDONLY)
+                    self.__read_fds[segment_name] = fd
+        return os.pread(fd, length, offset)
+
+    def get_segment_sizes(self):
+        """
+        :return dict of segment name to file size:
+        """
+        return {name: os.path.getsize(self.get_segment_path(name)) for name in self.list_segments()}
+
+    def compact_segment(self, segment_name, relocate):
+        """
+        Copies the live objects of a sealed segment into the active one
+        and retires the segment. Tombstones are handed to relocate as
+        well unless this is the oldest segment, since an older segment
+        may still hold the object they delete.
+
+        :param  segment_name:
+        :param  relocate: callable(kind, key, meta data, old data offset, read)
+                          which re-appends the record if it is still needed
+                          and returns whether it did, read() returns the data
+        :return int, the number of records moved:
+        """
+        if segment_name == self.get_active_segment():
+            return 0
+        is_oldest = segment_name == self.list_segments()[0]
+        moved = 0
+        path = self.get_segment_path(segment_name)
+        for kind, key, meta_data, data_offset, data_length in iter_segment_records(path):
+            if kind != RECORD_PUT and is_oldest:
+                continue
+            read = functools.partial(self.read, segment_name, data_offset, data_length)
+            if relocate(kind, key, meta_data, data_offset, read):
+                moved += 1
+        # the moved records must be durable before their old copies go
+        self.sync(self.get_active_segment())
+        # readers may still hold the old location, the file is removed later
+        os.rename(path, f"{path}.compacted")
+        os.utime(f"{path}.compacted")
+        return moved
+
+    def collect_garbage(self, grace_seconds: float = COMPACTION_GRACE_SECONDS):
+        """
+        Removes compacted segments once no read can still reference them.
+
+        :param  grace_seconds:
+        :return None:
+        """
+        now = time.time()
+        for name in os.listdir(self.__root):
+            if not name.endswith(".compacted"):
+                continue
+            path = os.path.join(self.__root, name)
+            if now - os.path.getmtime(path) < grace_seconds:
+                continue
+            segment_name = name[:-len(".compacted")]
+            with self.__lock:
+                fd = self.__read_fds.pop(segment_name, None)
+            if fd is not None:
+                os.close(fd)
+            os.remove(path)
+
+    def close(self):
+        with self.__lock:
+            os.close(self.__active_fd)
+            for fd in self.__read_fds.values():
+                os.close(fd)
+            self.__read_fds.clear()
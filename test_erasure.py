@@ -0,0 +1,49 @@
+import itertools
+import os
+
+import pytest
+
+from erasure import ReedSolomonEncoder, ErasureStore, gf_mul, gf_inv
+
+
+def make_blocks(count: int, length: int):
+    return [os.urandom(length) for _ in range(count)]
+
+
+def test_gf_inverse():
+    for value in range(1, 256):
+        assert gf_mul(value, gf_inv(value)) == 1
+
+
+@pytest.mark.parametrize("lost", list(itertools.combinations(range(6), 2)))
+def test_decode_after_losing_two_shards(lost):
+    encoder = ReedSolomonEncoder(4, 2)
+    data_blocks = make_blocks(4, 1024)
+    shards = dict(enumerate(data_blocks + encoder.encode(data_blocks)))
+    for shard in lost:
+        del shards[shard]
+    assert encoder.decode(shards) == data_blocks
+
+
+def test_decode_with_too_few_shards():
+    encoder = ReedSolomonEncoder(4, 2)
+    data_blocks = make_blocks(4, 64)
+    shards = dict(enumerate(data_blocks + encoder.encode(data_blocks)))
+    for shard in (0, 1, 2):
+        del shards[shard]
+    with pytest.raises(ValueError):
+        encoder.decode(shards)
+
+
+def test_degraded_read_of_stored_object(tmp_path):
+    store = ErasureStore(str(tmp_path), data_shards=4, parity_shards=2, block_size=4096)
+    data = os.urandom(3 * 4 * 4096 + 123)
+    writer = store.open_writer("object")
+    writer.write(data[:10000])
+    writer.write(data[10000:])
+    manifest = writer.close()
+    for shard in (1, 4):
+        os.remove(store.get_shard_path(shard, "object"))
+
+    assert b"".join(store.iter_range(manifest, 0, len(data))) == data
+    assert b"".join(store.iter_range(manifest, 5000, 40000)) == data[5000:40000]
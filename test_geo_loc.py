@@ -0,0 +1,86 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from geo_loc import GeoIndex, encode, encode_many, decode, haversine
+from main import Bucket, Object, add_geo_meta_data, get_user_meta_data
+
+
+@pytest.fixture(scope="module")
+def points():
+    rng = np.random.default_rng(7)
+    # dense around Berlin and sparse over the globe, plus the poles and the antimeridian
+    lats = np.concatenate([rng.uniform(52.3, 52.7, 2000), rng.uniform(-90, 90, 2000), [90, -90, 0, 0]])
+    lons = np.concatenate([rng.uniform(13.1, 13.7, 2000), rng.uniform(-180, 180, 2000), [0, 0, 180, -180]])
+    return lats, lons
+
+
+@pytest.fixture(scope="module")
+def index(points):
+    lats, lons = points
+    index = GeoIndex()
+    index.insert_many([f"p{n}" for n in range(len(lats))], lats, lons)
+    return index
+
+
+def test_encode_many_matches_encode(points):
+    lats, lons = points
+    for precision in (1, 5, 9, 12):
+        batched = encode_many(lats, lons, precision).tolist()
+        assert batched == [encode(lat, lon, precision) for lat, lon in zip(lats.tolist(), lons.tolist())]
+
+
+def test_decode_is_inside_the_cell():
+    lat, lon = decode(encode(52.5163, 13.3777, 9))
+    assert abs(lat - 52.5163) < 0.001 and abs(lon - 13.3777) < 0.001
+
+
+@pytest.mark.parametrize("center, radius", [((52.5, 13.4), 2_000), ((52.5, 13.4), 25_000),
+                                            ((0.0, 179.9), 500_000), ((89.0, 0.0), 300_000)])
+def test_radius_query_matches_brute_force(index, points, center, radius):
+    lats, lons = points
+    distances = haversine(center[0], center[1], lats, lons)
+    expected = {f"p{n}" for n in np.nonzero(distances <= radius)[0].tolist()}
+    found = index.query_radius(center[0], center[1], radius)
+    assert {key for key, _, _, _ in found} == expected
+    assert [distance for _, _, _, distance in found] == sorted(distance for _, _, _, distance in found)
+
+
+def test_box_query_matches_brute_force(index, points):
+    lats, lons = points
+    inside = (lats >= 52.4) & (lats <= 52.6) & (lons >= 13.2) & (lons <= 13.5)
+    found = index.query_box(52.4, 13.2, 52.6, 13.5)
+    assert {key for key, _, _ in found} == {f"p{n}" for n in np.nonzero(inside)[0].tolist()}
+
+
+@pytest.mark.parametrize("center", [(52.5, 13.4), (-33.9, 151.2), (0.0, -179.99)])
+def test_nearest_matches_brute_force(index, points, center):
+    lats, lons = points
+    distances = haversine(center[0], center[1], lats, lons)
+    expected = np.sort(distances)[:5]
+    found = index.query_nearest(center[0], center[1], count=5)
+    assert np.allclose([distance for _, _, _, distance in found], expected)
+
+
+def test_delete_and_reinsert(index):
+    index.insert("moving", 10.0, 10.0)
+    assert index.query_nearest(10.0, 10.0)[0][0] == "moving"
+    index.insert("moving", -10.0, -10.0)
+    assert index.get_location("moving") == (-10.0, -10.0)
+    assert index.delete("moving") and not index.delete("moving")
+    assert "moving" not in index
+
+
+def test_bucket_geo_tags_only_located_objects(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with pytest.raises(ValueError):
+        get_user_meta_data([("X-Meta-Geohash", "u33db")])
+    bucket = Bucket("geo", is_private=False)
+    bucket.create_bucket()
+    geo_index = bucket.get_geo_index()
+    asyncio.run(bucket.upload_object(Object("placed", "geo", "bin", b"x",
+                                            add_geo_meta_data({"lat": "52.52", "lon": "13.4"}))))
+    asyncio.run(bucket.upload_object(Object("forged", "geo", "bin", b"x", {"geohash": "u33db"})))
+    assert geo_index.get_location("placed.bin") == (52.52, 13.4)
+    assert "forged.bin" not in geo_index
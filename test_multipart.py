@@ -0,0 +1,27 @@
+import asyncio
+
+import pytest
+
+from main import Bucket
+from object_index import LAYOUT_FILE, LAYOUT_PACKED
+
+
+@pytest.mark.parametrize("options, layout, compression", [
+    ({}, LAYOUT_FILE, None),
+    ({"compression": "zlib"}, LAYOUT_FILE, "zlib"),
+    ({"small_object_threshold": 1024 * 1024}, LAYOUT_PACKED, None),
+])
+def test_completed_upload_is_stored_like_an_upload(tmp_path, monkeypatch, options, layout, compression):
+    monkeypatch.chdir(tmp_path)
+    bucket = Bucket("parts", is_private=False, **options)
+    bucket.create_bucket()
+    parts = [b"a" * 1000, b"b" * 1000, b"c" * 10]
+    upload_id = bucket.create_multipart_upload("joined", "txt", {"type": "txt", "content_type": "text/plain"})
+    for number, part in enumerate(parts, 1):
+        asyncio.run(bucket.upload_part(upload_id, "joined", "txt", number, part))
+    meta_data = asyncio.run(bucket.complete_multipart_upload(upload_id, "joined", "txt"))
+
+    record = bucket.get_object_record("joined", "txt")
+    assert record["layout"] == layout
+    assert meta_data.get("compression") == compression
+    assert b"".join(bucket.iter_object_data(record)) == b"".join(parts)
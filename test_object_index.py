@@ -0,0 +1,128 @@
+import asyncio
+import uuid
+
+import pytest
+
+from main import Bucket, Object, ObjectAlreadyExistsException, get_user_meta_data
+from object_index import ObjectIndex, get_prefix_upper_bound
+
+
+def put(index, name, object_type="txt", **meta_data):
+    meta_data = {"size": 1, "sha256": name, **meta_data}
+    return index.put(name, object_type, uuid.uuid4(), f"{name}.{object_type}/data", 1, name, meta_data)
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = ObjectIndex(str(tmp_path))
+    yield index
+    index.close()
+
+
+def test_put_get_delete(index):
+    assert put(index, "a")
+    assert not put(index, "a")
+    assert index.contains("a", "txt") and not index.contains("a", "bin")
+    assert index.get("a", "txt")["digest"] == "a"
+    assert index.count() == 1
+    assert index.delete("a", "txt")
+    assert index.get("a", "txt") is None
+
+
+def test_list_pages_in_key_order(index):
+    names = [f"obj{n:03d}" for n in range(25)]
+    for name in reversed(names):
+        put(index, name)
+    listed, start_after = [], ""
+    while True:
+        page = index.list(start_after=start_after, limit=10)
+        if not page:
+            break
+        listed += [record["object_name"] for record in page]
+        start_after = f"{page[-1]['object_name']}.{page[-1]['object_type']}"
+    assert listed == names
+
+
+def test_list_prefix(index):
+    for name in ("photos/a", "photos/b", "photosx", "video/a"):
+        put(index, name)
+    assert [record["object_name"] for record in index.list(prefix="photos/")] == ["photos/a", "photos/b"]
+    assert [record["object_name"] for record in index.list(prefix="photos/", start_after="photos/a.txt")] \
+        == ["photos/b"]
+    assert get_prefix_upper_bound("ab") == "ac"
+
+
+def test_query_by_meta_data(index):
+    for n in range(10):
+        put(index, f"o{n}", customer="acme" if n % 2 else "other", rank=n)
+    found = index.query([("customer", "eq", "acme"), ("rank", "gte", 4)])
+    assert [record["object_name"] for _, record in found] == ["o5", "o7", "o9"]
+    with pytest.raises(ValueError):
+        index.query([("rank", "near", 1)])
+
+
+@pytest.fixture
+def listing_bucket(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    bucket = Bucket("listing", is_private=False)
+    bucket.create_bucket()
+    for n in range(7):
+        asyncio.run(bucket.upload_object(Object(f"k{n}", "listing", "bin", b"x" * n, {"n": n})))
+    return bucket
+
+
+def test_bucket_listing_continuation(listing_bucket):
+    with pytest.raises(ObjectAlreadyExistsException):
+        asyncio.run(listing_bucket.upload_object(Object("k0", "listing", "bin", b"", {})))
+
+    keys, token = [], None
+    while True:
+        page = listing_bucket.list_objects(limit=3, continuation_token=token)
+        keys += [listed["key"] for listed in page["objects"]]
+        if not page["is_truncated"]:
+            break
+        token = page["next_continuation_token"]
+    assert keys == [f"k{n}.bin" for n in range(7)]
+    with pytest.raises(ValueError):
+        listing_bucket.list_objects(continuation_token="not base64!")
+
+
+def test_bucket_query_continuation(listing_bucket):
+    page = listing_bucket.query_objects([("n", "gte", 2)], limit=4)
+    assert page["is_truncated"]
+    page = listing_bucket.query_objects([("n", "gte", 2)], limit=4,
+                                        continuation_token=page["next_continuation_token"])
+    assert [listed["key"] for listed in page["objects"]] == ["k6.bin"]
+
+
+def test_user_meta_data_cannot_override_system_keys(listing_bucket):
+    with pytest.raises(ValueError):
+        get_user_meta_data([("X-Meta-Compression", "zlib")])
+    assert get_user_meta_data([("X-Meta-Customer", "acme")]) == {"customer": "acme"}
+
+    obj = Object("forged", "listing", "bin", b"data", {"uuid": "x", "compression": "zlib", "size": 1})
+    meta_data = asyncio.run(listing_bucket.upload_object(obj))
+    assert meta_data["size"] == 4
+    assert "compression" not in meta_data
+    assert listing_bucket.get_object_record("forged", "bin")["meta_data"]["uuid"] != "x"
+
+
+def test_recovery_reindexes_logged_puts(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    bucket = Bucket("recovered", is_private=False, durability="none")
+    bucket.create_bucket()
+    for name in ("kept", "torn"):
+        asyncio.run(bucket.upload_object(Object(name, "recovered", "bin", name.encode() * 100, {})))
+    bucket.get_wal().flush()
+    # a crash lost the index rows and the tail of one data file
+    for name in ("kept", "torn"):
+        bucket.get_index().delete(name, "bin")
+    record_path = tmp_path / "recovered" / "torn.bin"
+    data_file = next(path for path in record_path.iterdir() if path.name != "meta_data.json")
+    data_file.write_bytes(data_file.read_bytes()[:10])
+
+    reopened = Bucket("recovered", is_private=False, durability="none")
+    reopened.create_bucket()
+    assert reopened.get_index().contains("kept", "bin")
+    assert not reopened.get_index().contains("torn", "bin")
+    assert not record_path.exists()
@@ -0,0 +1,100 @@
+import asyncio
+import os
+import uuid
+
+import pytest
+
+import asgi
+import main
+from main import parse_byte_ranges, MAX_BYTE_RANGES
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("", None),
+    ("bytes=0-9", [(0, 10)]),
+    ("bytes=90-", [(90, 100)]),
+    ("bytes=-10", [(90, 100)]),
+    ("bytes=-500", [(0, 100)]),
+    ("bytes=95-200", [(95, 100)]),
+    ("bytes=0-0,10-19", [(0, 1), (10, 20)]),
+    ("bytes=100-200", []),
+    ("bytes=0-4,100-200", [(0, 5)]),
+    ("items=0-9", None),
+    ("bytes=9-0", None),
+    ("bytes=abc", None),
+])
+def test_parse_byte_ranges(header, expected):
+    assert parse_byte_ranges(header, 100) == expected
+
+
+def test_too_many_ranges_are_ignored():
+    header = "bytes=" + ",".join(f"{n}-{n}" for n in range(MAX_BYTE_RANGES + 1))
+    assert parse_byte_ranges(header, 1000) is None
+
+
+@pytest.fixture(scope="module")
+def stored_object():
+    client = main.app.test_client()
+    name = f"range-{uuid.uuid4().hex}"
+    data = os.urandom(10_000)
+    assert client.post(f"/upload/{name}.bin", data=data).status_code == 200
+    return client, f"/download/{name}/application/bin", data
+
+
+def test_single_range(stored_object):
+    client, url, data = stored_object
+    response = client.get(url, headers={"Range": "bytes=100-199"})
+    assert response.status_code == 206
+    assert response.headers["Content-Range"] == f"bytes 100-199/{len(data)}"
+    assert response.data == data[100:200]
+
+
+def test_unsatisfiable_range(stored_object):
+    client, url, data = stored_object
+    response = client.get(url, headers={"Range": "bytes=20000-"})
+    assert response.status_code == 416
+
+
+def test_one_satisfiable_range_of_many(stored_object):
+    client, url, data = stored_object
+    response = client.get(url, headers={"Range": "bytes=0-4,20000-30000"})
+    assert response.status_code == 206
+    assert response.data == data[:5]
+
+
+def test_multiple_ranges(stored_object):
+    client, url, data = stored_object
+    response = client.get(url, headers={"Range": "bytes=0-9,-10"})
+    assert response.status_code == 206
+    assert response.mimetype == "multipart/byteranges"
+    assert data[:10] in response.data and data[-10:] in response.data
+
+
+def test_stale_if_range_serves_the_whole_object(stored_object):
+    client, url, data = stored_object
+    response = client.get(url, headers={"Range": "bytes=0-9", "If-Range": '"stale"'})
+    assert response.status_code == 200
+    assert response.data == data
+
+
+def asgi_get(path, headers):
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": path, "query_string": b"",
+             "headers": [(name.lower().encode(), value.encode()) for name, value in headers.items()]}
+    asyncio.run(asgi.app(scope, receive, send))
+    return messages[0]["status"], b"".join(message.get("body", b"") for message in messages[1:])
+
+
+def test_asgi_if_range(stored_object):
+    client, url, data = stored_object
+    etag = client.get(url).headers["ETag"]
+    assert asgi_get(url, {"Range": "bytes=0-9", "If-Range": etag}) == (206, data[:10])
+    assert asgi_get(url, {"Range": "bytes=0-9", "If-Range": '"stale"'}) == (200, data)
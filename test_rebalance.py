@@ -0,0 +1,85 @@
+import asyncio
+import bisect
+
+from main import Bucket, Object, ConsistentHashing, ConsistentNode
+from rebalance import BucketNode, Rebalancer, get_owner_changes, get_moved_fraction
+
+KEYS = [f"object-{n}.bin" for n in range(5000)]
+
+
+def make_ring(node_ids):
+    hashing = ConsistentHashing(len(node_ids))
+    for node_id in node_ids:
+        hashing.put(ConsistentNode(node_id))
+    return hashing
+
+
+def get_owners(hashing):
+    return {key: hashing.get_request_server(key).node for key in KEYS}
+
+
+def find_change(changes, key):
+    point = ConsistentHashing.Hash.get_point(key)
+    position = bisect.bisect_right([low for low, _, _, _ in changes], point) - 1
+    if position >= 0 and point <= changes[position][1]:
+        return changes[position]
+    return None
+
+
+def test_adding_a_node_moves_its_share():
+    old, new = make_ring(["a", "b", "c", "d"]), make_ring(["a", "b", "c", "d", "e"])
+    changes = get_owner_changes(old.get_ring().get_ring(), new.get_ring().get_ring())
+    assert 0.15 < get_moved_fraction(changes) < 0.25
+    assert {new_owner for _, _, _, new_owner in changes} == {"e"}
+
+    old_owners, new_owners = get_owners(old), get_owners(new)
+    moved = [key for key in KEYS if old_owners[key] != new_owners[key]]
+    assert 0.15 < len(moved) / len(KEYS) < 0.25
+    for key in KEYS:
+        change = find_change(changes, key)
+        if old_owners[key] == new_owners[key]:
+            assert change is None
+        else:
+            assert change[2:] == (old_owners[key], new_owners[key])
+
+
+def test_removing_a_node_only_moves_its_keys():
+    old, new = make_ring(["a", "b", "c", "d"]), make_ring(["a", "b", "d"])
+    changes = get_owner_changes(old.get_ring().get_ring(), new.get_ring().get_ring())
+    assert {old_owner for _, _, old_owner, _ in changes} == {"c"}
+    old_owners, new_owners = get_owners(old), get_owners(new)
+    assert all(new_owners[key] == old_owners[key] for key in KEYS if old_owners[key] != "c")
+
+
+def test_identical_rings_have_no_changes():
+    ring = make_ring(["a", "b"]).get_ring().get_ring()
+    assert get_owner_changes(ring, ring) == []
+    assert get_owner_changes([], ring) == []
+
+
+def test_rebalancer_moves_objects_between_buckets(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    buckets = {node_id: Bucket(f"node-{node_id}", is_private=False) for node_id in ("a", "b", "c")}
+    for bucket in buckets.values():
+        bucket.create_bucket()
+    nodes = {node_id: BucketNode(bucket) for node_id, bucket in buckets.items()}
+    hashing = make_ring(["a", "b"])
+    for n in range(60):
+        owner = hashing.get_request_server(f"k{n}.bin").node
+        asyncio.run(buckets[owner].upload_object(Object(f"k{n}", f"node-{owner}", "bin", b"v" * n, {})))
+
+    old_ring = hashing.get_ring().get_ring()
+    hashing.put(ConsistentNode("c"))
+    changes = get_owner_changes(old_ring, hashing.get_ring().get_ring())
+    # an earlier run was interrupted after copying one object
+    interrupted = next(n for n in range(60) if hashing.get_request_server(f"k{n}.bin").node == "c")
+    asyncio.run(buckets["c"].upload_object(Object(f"k{interrupted}", "node-c", "bin", b"v" * interrupted, {})))
+
+    progress = Rebalancer(changes, nodes, 1e9).run()
+    assert progress["state"] == "done" and not progress["failed_objects"]
+    assert progress["moved_objects"] == progress["total_objects"] > 1
+    for n in range(60):
+        owner = hashing.get_request_server(f"k{n}.bin").node
+        for node_id, bucket in buckets.items():
+            assert bucket.get_index().contains(f"k{n}", "bin") == (node_id == owner)
+    assert Rebalancer(changes, nodes, 1e9).run()["total_objects"] == 0
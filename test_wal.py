@@ -0,0 +1,87 @@
+import os
+import threading
+import time
+
+import pytest
+
+import wal
+from wal import WriteAheadLog, WalClosedException, DURABILITY_NONE
+
+
+def test_replay_after_reopen(tmp_path):
+    path = str(tmp_path / "wal.log")
+    log = WriteAheadLog(path)
+    lsns = [log.append({"op": "put", "n": n}) for n in range(5)]
+    log.close()
+    assert lsns == [1, 2, 3, 4, 5]
+
+    log = WriteAheadLog(path)
+    assert [record["n"] for _, record in log.replay()] == list(range(5))
+    assert [lsn for lsn, _ in log.replay(after_lsn=3)] == [4, 5]
+    assert log.append({"op": "put", "n": 5}) == 6
+    log.close()
+
+
+@pytest.mark.parametrize("cut", [1, 7, 20])
+def test_torn_tail_is_cut_off(tmp_path, cut):
+    path = str(tmp_path / "wal.log")
+    log = WriteAheadLog(path)
+    for n in range(3):
+        log.append({"n": n})
+    log.close()
+    os.truncate(path, os.path.getsize(path) - cut)
+
+    log = WriteAheadLog(path)
+    assert [record["n"] for _, record in log.replay()] == [0, 1]
+    # the next record takes the lsn of the torn one and is readable after it
+    assert log.append({"n": 3}) == 3
+    log.close()
+    assert [record["n"] for _, record in WriteAheadLog(path).replay()] == [0, 1, 3]
+
+
+def test_corrupted_record_ends_the_log(tmp_path):
+    path = str(tmp_path / "wal.log")
+    log = WriteAheadLog(path)
+    for n in range(3):
+        log.append({"n": n})
+    log.close()
+    with open(path, "r+b") as log_file:
+        log_file.seek(-2, os.SEEK_END)
+        log_file.write(b"??")
+    assert [record["n"] for _, record in WriteAheadLog(path).replay()] == [0, 1]
+
+
+def test_concurrent_sync_appends_share_fsyncs(tmp_path, monkeypatch):
+    fsync = os.fsync
+
+    def slow_fsync(fd):
+        time.sleep(0.005)
+        fsync(fd)
+    monkeypatch.setattr(wal.os, "fsync", slow_fsync)
+
+    log = WriteAheadLog(str(tmp_path / "wal.log"))
+    threads = [threading.Thread(target=lambda: [log.append({"n": n}) for n in range(20)]) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = log.get_stats()
+    log.close()
+
+    assert stats["synced_lsn"] == 320
+    assert stats["fsyncs"] < 320 / 4
+    assert len(list(WriteAheadLog(str(tmp_path / "wal.log")).replay())) == 320
+
+
+def test_checkpoint_drops_covered_records(tmp_path):
+    path = str(tmp_path / "wal.log")
+    log = WriteAheadLog(path, durability=DURABILITY_NONE)
+    for n in range(4):
+        log.append({"n": n})
+    log.flush()
+    log.checkpoint(2)
+    log.append({"n": 4})
+    log.close()
+    assert [lsn for lsn, _ in WriteAheadLog(path).replay()] == [3, 4, 5]
+    with pytest.raises(WalClosedException):
+        log.append({"n": 5})
@@ -0,0 +1,322 @@
+import contextvars
+import functools
+import itertools
+import json
+import os
+import queue
+import random
+import threading
+import time
+
+# Spans a trace keeps at most, later spans are only counted so a trace
+# of a huge upload stays readable
+MAX_TRACE_SPANS = 1000
+
+# Seconds the writer waits for more traces before writing a batch
+FLUSH_INTERVAL = 1.0
+
+# The trace of the current request, context variables follow the request
+# into asyncio tasks and asyncio.to_thread
+_current_trace = contextvars.ContextVar("datadepot_trace", default=None)
+
+
+class NullSpan:
+    """Span of an unsampled request, records nothing."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set_args(self, **args):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    """
+    A timed phase of a traced request, recorded as a complete ('X') event
+    of the trace event format when it ends.
+    """
+
+    def __init__(self, trace, name, args: dict) -> None:
+        self.__trace = trace
+        self.__name = name
+        self.__args = args
+        self.__started = None
+
+    def __enter__(self):
+        self.__started = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.__args["error"] = exc_type.__name__
+        self.__trace.add_span(self.__name, self.__started, time.perf_counter_ns(), self.__args)
+        return False
+
+    def set_args(self, **args):
+        """
+        Adds arguments shown with the span, e.g. sizes known at its end.
+
+        :param  args:
+        :return None:
+        """
+        self.__args.update(args)
+
+
+class Trace:
+    """
+    The root span of a sampled request. Its spans are collected in memory
+    and handed to the tracer at once when the root ends. Every trace gets
+    its own track (tid) in the viewer, concurrent requests served by one
+    thread or event loop would overlap on a thread track.
+    """
+
+    def __init__(self, tracer, name, args: dict, trace_id: int) -> None:
+        self.__tracer = tracer
+        self.__name = name
+        self.__args = args
+        self.__trace_id = trace_id
+        self.__events = []
+        self.__dropped = 0
+        self.__started = None
+        self.__token = None
+
+    def get_trace_id(self):
+        return self.__trace_id
+
+    def set_args(self, **args):
+        self.__args.update(args)
+
+    def __enter__(self):
+        self.__token = _current_trace.set(self)
+        self.__started = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        ended = time.perf_counter_ns()
+        _current_trace.reset(self.__token)
+        if exc_type is not None:
+            self.__args["error"] = exc_type.__name__
+        if self.__dropped:
+            self.__args["dropped_spans"] = self.__dropped
+        self.__events.append(self._make_event(self.__name, self.__started, ended, self.__args))
+        self.__tracer.emit(self.__trace_id, self.__events)
+        return False
+
+    def add_span(self, name, started: int, ended: int, args: dict):
+        """
+        :param  name:
+        :param  started: perf_counter_ns
+        :param  ended: perf_counter_ns
+        :param  args:
+        :return None:
+        """
+        if len(self.__events) >= MAX_TRACE_SPANS:
+            self.__dropped += 1
+            return
+        self.__events.append(self._make_event(name, started, ended, args))
+
+    def _make_event(self, name, started: int, ended: int, args: dict):
+        return {
+            "name": name,
+            "ph": "X",
+            "ts": self.__tracer.get_timestamp(started),
+            "dur": (ended - started) / 1000,
+            "tid": self.__trace_id,
+            "args": {"thread": threading.current_thread().name, **args},
+        }
+
+
+def span(name, **args):
+    """
+    Times a phase of the current request, e.g.
+
+        with span("write_chunk", size=len(chunk)):
+            ...
+
+    Outside of a sampled trace this is a shared no-op span.
+
+    :param  name:
+    :param  args: shown with the span
+    :return context manager:
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return NULL_SPAN
+    return Span(trace, name, args)
+
+
+def get_current_trace():
+    """
+    :return the Trace of the current request or None when it is not sampled:
+    """
+    return _current_trace.get()
+
+
+class Tracer:
+    """
+    Samples requests and writes their spans to a file in the trace event
+    format (JSON array format), which chrome://tracing, Perfetto and
+    speedscope open directly. Traces are appended by a background writer
+    so sampled requests do no file I/O, the closing bracket of the array
+    is optional in this format which lets several runs and processes
+    append to the same file.
+    """
+
+    def __init__(self, path, sample_rate: float = 0.0, flush_interval: float = FLUSH_INTERVAL) -> None:
+        if not 0.0 <= sample_rate <= 1.0:
+            raise ValueError("The sample rate must be within [0, 1]")
+        self.__path = path
+        self.__sample_rate = sample_rate
+        self.__flush_interval = flush_interval
+        self.__trace_ids = itertools.count(1)
+        self.__pid = os.getpid()
+        # wall clock of the perf counter origin, timestamps of processes line up
+        self.__epoch_us = time.time_ns() / 1000 - time.perf_counter_ns() / 1000
+        self.__queue = queue.Queue()
+        self.__flush_requested = threading.Event()
+        self.__writer = None
+        self.__lock = threading.Lock()
+        self.__traces = 0
+
+    def get_path(self):
+        return self.__path
+
+    def get_sample_rate(self):
+        return self.__sample_rate
+
+    def set_sample_rate(self, sample_rate: float):
+        """
+        :param  sample_rate: fraction of the requests traced, 0 disables tracing
+        :return None:
+        :raise  ValueError:
+        """
+        if not 0.0 <= sample_rate <= 1.0:
+            raise ValueError("The sample rate must be within [0, 1]")
+        self.__sample_rate = sample_rate
+
+    def get_timestamp(self, perf_counter_ns: int):
+        """
+        :param  perf_counter_ns:
+        :return microseconds since the epoch:
+        """
+        return self.__epoch_us + perf_counter_ns / 1000
+
+    def trace(self, name, **args):
+        """
+        Starts the trace of a request if it is sampled, spans opened
+        within the with block become its children.
+
+        :param  name: e.g. 'POST /upload'
+        :param  args: shown with the root span
+        :return context manager, a Trace or the no-op span:
+        """
+        if self.__sample_rate <= 0.0 or _current_trace.get() is not None:
+            return NULL_SPAN
+        if self.__sample_rate < 1.0 and random.random() >= self.__sample_rate:
+            return NULL_SPAN
+        return Trace(self, name, args, next(self.__trace_ids))
+
+    def emit(self, trace_id: int, events):
+        """
+        Queues the events of a finished trace for the writer.
+
+        :param  trace_id:
+        :param  events:
+        :return None:
+        """
+        root = events[-1]
+        names = [{"name": "thread_name", "ph": "M", "tid": trace_id, "args": {"name": f"#{trace_id} {root['name']}"}},
+                 {"name": "thread_sort_index", "ph": "M", "tid": trace_id, "args": {"sort_index": trace_id}}]
+        self.__queue.put(names + events)
+        with self.__lock:
+            self.__traces += 1
+            if self.__writer is None:
+                self.__writer = threading.Thread(target=self._run_writer, name="trace-writer", daemon=True)
+                self.__writer.start()
+
+    def _run_writer(self):
+        while True:
+            batch = [self.__queue.get()]
+            self.__flush_requested.wait(self.__flush_interval)
+            self.__flush_requested.clear()
+            while True:
+                try:
+                    batch.append(self.__queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._write(batch)
+            for _ in batch:
+                self.__queue.task_done()
+
+    def _write(self, batch):
+        lines = []
+        for events in batch:
+            for event in events:
+                event["pid"] = self.__pid
+                lines.append(json.dumps(event, separators=(",", ":"), default=str) + ",\n")
+        with open(self.__path, "a") as trace_file:
+            if trace_file.tell() == 0:
+                trace_file.write("[\n")
+            trace_file.write("".join(lines))
+
+    def flush(self):
+        """
+        Writes the queued traces without waiting for the flush interval.
+
+        :return None:
+        """
+        self.__flush_requested.set()
+        self.__queue.join()
+
+    def get_stats(self):
+        return {"path": self.__path, "sample_rate": self.__sample_rate, "traces": self.__traces}
+
+    def traced(self, name):
+        """
+        Decorator tracing every call of a function as a request, keyword
+        arguments (the url parameters of a view) are shown with the trace.
+
+        :param  name:
+        :return decorator:
+        """
+        def decorate(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.trace(name, **kwargs):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorate
+
+
+def traced_aiter(aiterable, name):
+    """
+    Times every wait for the next item of an async iterable as a span,
+    e.g. the reads of a request body. Outside of a sampled trace the
+    iterable is returned as it is.
+
+    :param  aiterable:
+    :param  name: of the spans
+    :return async iterable:
+    """
+    if _current_trace.get() is None:
+        return aiterable
+    return _iter_traced(aiterable, name)
+
+
+async def _iter_traced(aiterable, name):
+    iterator = aiterable.__aiter__()
+    while True:
+        with span(name) as read_span:
+            try:
+                item = await iterator.__anext__()
+            except StopAsyncIteration:
+                read_span.set_args(end=True)
+                return
+            read_span.set_args(size=len(item))
+        yield item
@@ -0,0 +1,289 @@
+import collections
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+
+from metrics import DISK_WRITE_DURATION, DISK_FSYNC_DURATION
+
+# Durability levels of an append:
+#   none  - written by the background writer, never fsynced by the log
+#   async - fsynced by the background writer, the caller does not wait
+#   sync  - the caller waits until the record is fsynced
+DURABILITY_NONE = "none"
+DURABILITY_ASYNC = "async"
+DURABILITY_SYNC = "sync"
+DURABILITY_LEVELS = (DURABILITY_NONE, DURABILITY_ASYNC, DURABILITY_SYNC)
+
+# Records are length prefixed and checksummed:
+#
+#     payload length | crc32 | lsn | payload
+#
+# the crc covers the lsn and the payload, a record failing it can only
+# be the torn tail of a crash and ends the log.
+RECORD_HEADER = struct.Struct("<IIQ")
+
+# A batch is written with one write and one fsync, concurrent appends
+# arriving while a batch is being synced form the next batch
+MAX_BATCH_BYTES = 4 * 1024 * 1024
+
+
+class WalClosedException(Exception):
+    """Exception raised when appending to a closed log."""
+
+
+def fsync_path(path):
+    """
+    Fsyncs a file, or a directory to make the files created, renamed or
+    removed in it durable.
+
+    :param  path:
+    :return None:
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def encode_record(lsn: int, payload: bytes):
+    body = struct.pack("<Q", lsn) + payload
+    return struct.pack("<II", len(payload), zlib.crc32(body)) + body
+
+
+def iter_log_records(path):
+    """
+    Reads the valid records of a log file in order.
+
+    :param  path:
+    :return generator of (lsn, payload bytes, end offset):
+    """
+    try:
+        log_file = open(path, "rb")
+    except FileNotFoundError:
+        return
+    with log_file:
+        offset = 0
+        while True:
+            header = log_file.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            length, crc, lsn = RECORD_HEADER.unpack(header)
+            payload = log_file.read(length)
+            if len(payload) < length or zlib.crc32(header[8:] + payload) != crc:
+                return
+            offset += RECORD_HEADER.size + length
+            yield lsn, payload, offset
+
+
+class WriteAheadLog:
+    """
+    Append-only write-ahead log with group commit.
+
+    Appends only enqueue the encoded record, a background writer takes
+    everything queued, writes it with a single write and covers it with
+    a single fsync, so N concurrent sync appends cost one fsync instead
+    of N. Records are json documents identified by a growing log
+    sequence number (lsn).
+    """
+
+    def __init__(self, path, durability: str = DURABILITY_SYNC, max_batch_bytes: int = MAX_BATCH_BYTES) -> None:
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(f"Unknown durability level '{durability}'")
+        self.__path = path
+        self.__durability = durability
+        self.__max_batch_bytes = max_batch_bytes
+        self.__condition = threading.Condition()
+        self.__io_lock = threading.Lock()
+        self.__pending = collections.deque()
+        self.__pending_sync = False
+        self.__closed = False
+        self.__error = None
+        self.__batches = 0
+        self.__fsyncs = 0
+        self.__records_written = 0
+
+        # recover, the torn tail of a crash is cut off before appending
+        valid_end, last_lsn = 0, 0
+        for lsn, _, end in iter_log_records(path):
+            valid_end, last_lsn = end, lsn
+        self.__fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        os.ftruncate(self.__fd, valid_end)
+        self.__next_lsn = last_lsn + 1
+        self.__written_lsn = last_lsn
+        self.__synced_lsn = last_lsn
+
+        self.__writer = threading.Thread(target=self._run_writer, name=f"wal-{path}", daemon=True)
+        self.__writer.start()
+
+    def get_path(self):
+        return self.__path
+
+    def get_last_lsn(self):
+        """
+        :return int, the lsn of the last appended record:
+        """
+        with self.__condition:
+            return self.__next_lsn - 1
+
+    def append(self, record: dict, durability: str = None):
+        """
+        Appends a record to the log.
+
+        :param  record: json serializable dict
+        :param  durability: overrides the durability level of the log
+        :return int, the lsn of the record:
+        :raise  WalClosedException and OSError when the writer failed:
+        """
+        durability = durability or self.__durability
+        payload = json.dumps(record, separators=(",", ":"), default=str).encode()
+        with self.__condition:
+            if self.__closed:
+                raise WalClosedException(f"Write-ahead log '{self.__path}' is closed")
+            lsn = self.__next_lsn
+            self.__next_lsn += 1
+            self.__pending.append(encode_record(lsn, payload))
+            if durability != DURABILITY_NONE:
+                self.__pending_sync = True
+            self.__condition.notify_all()
+            if durability == DURABILITY_SYNC:
+                while self.__synced_lsn < lsn and self.__error is None:
+                    self.__condition.wait()
+                if self.__error is not None:
+                    raise self.__error
+        return lsn
+
+    def flush(self):
+        """
+        Waits until every record appended so far is written and fsynced.
+
+        :return None:
+        """
+        with self.__condition:
+            lsn = self.__next_lsn - 1
+            self.__pending_sync = True
+            self.__condition.notify_all()
+            while self.__synced_lsn < lsn and self.__error is None:
+                self.__condition.wait()
+            if self.__error is not None:
+                raise self.__error
+
+    def _needs_sync(self):
+        # a flush of records which were written without an fsync
+        return self.__pending_sync and self.__synced_lsn < self.__written_lsn
+
+    def _run_writer(self):
+        while True:
+            with self.__condition:
+                while not self.__pending and not self.__closed and not self._needs_sync():
+                    self.__condition.wait()
+                if not self.__pending and self.__closed:
+                    return
+                batch, size = [], 0
+                while self.__pending and (not batch or size + len(self.__pending[0]) <= self.__max_batch_bytes):
+                    record = self.__pending.popleft()
+                    batch.append(record)
+                    size += len(record)
+                needs_sync = self.__pending_sync
+                if not self.__pending:
+                    self.__pending_sync = False
+                last_lsn = self.__written_lsn + len(batch)
+
+            try:
+                data = b"".join(batch)
+                with self.__io_lock:
+                    started = time.perf_counter()
+                    written = 0
+                    while written < len(data):
+                        written += os.write(self.__fd, data[written:])
+                    written_at = time.perf_counter()
+                    DISK_WRITE_DURATION.observe(written_at - started, ("wal",))
+                    if needs_sync:
+                        os.fsync(self.__fd)
+                        DISK_FSYNC_DURATION.observe(time.perf_counter() - written_at, ("wal",))
+            except OSError as e:
+                with self.__condition:
+                    self.__error = e
+                    self.__condition.notify_all()
+                return
+
+            with self.__condition:
+                self.__batches += 1
+                self.__records_written += len(batch)
+                self.__written_lsn = last_lsn
+                if needs_sync:
+                    self.__fsyncs += 1
+                    self.__synced_lsn = last_lsn
+                self.__condition.notify_all()
+
+    def replay(self, after_lsn: int = 0):
+        """
+        Reads back the records of the log, used for crash recovery.
+
+        :param  after_lsn: only records with a greater lsn are returned
+        :return generator of (lsn, record dict):
+        """
+        for lsn, payload, _ in iter_log_records(self.__path):
+            if lsn > after_lsn:
+                yield lsn, json.loads(payload)
+
+    def checkpoint(self, lsn: int):
+        """
+        Drops the records up to lsn once the state they describe is
+        durable elsewhere. The remaining records are copied to a new log
+        which replaces the old one atomically, appends keep queueing
+        while the copy is made.
+
+        :param  lsn:
+        :return None:
+        """
+        with self.__io_lock:
+            temp_path = f"{self.__path}.tmp"
+            with open(temp_path, "wb") as temp_file:
+                for record_lsn, payload, _ in iter_log_records(self.__path):
+                    if record_lsn > lsn:
+                        temp_file.write(encode_record(record_lsn, payload))
+                temp_file.flush()
+                os.fsync(temp_file.fileno())
+            os.replace(temp_path, self.__path)
+            fsync_path(os.path.dirname(os.path.abspath(self.__path)))
+            os.close(self.__fd)
+            self.__fd = os.open(self.__path, os.O_WRONLY | os.O_APPEND)
+
+    def get_size(self):
+        with self.__io_lock:
+            return os.fstat(self.__fd).st_size
+
+    def get_stats(self):
+        """
+        :return dict with the lsns and how well appends were batched:
+        """
+        with self.__condition:
+            return {
+                "durability": self.__durability,
+                "next_lsn": self.__next_lsn,
+                "synced_lsn": self.__synced_lsn,
+                "batches": self.__batches,
+                "fsyncs": self.__fsyncs,
+                "records_per_batch": self.__records_written / self.__batches if self.__batches else 0.0,
+            }
+
+    def close(self):
+        """
+        Writes and fsyncs the pending records and stops the writer.
+
+        :return None:
+        """
+        with self.__condition:
+            if self.__closed:
+                return
+            self.__pending_sync = True
+            self.__closed = True
+            self.__condition.notify_all()
+        self.__writer.join()
+        if self.__error is None:
+            os.fsync(self.__fd)
+        os.close(self.__fd)